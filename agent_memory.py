@@ -0,0 +1,116 @@
+import threading
+from collections import deque
+from config import MEMORY_CONFIG
+from context_manager import ARTICLE_MARKER, fit_to_tokens, summarize_suggestions
+from edit_script import EDITS_MARKER
+from utils import estimate_tokens
+
+
+def get_memory_config(config):
+    """
+    合并默认Agent记忆配置和配置文件中的Agent记忆配置
+    """
+    memory_config = dict(MEMORY_CONFIG)
+    memory_config.update(config.get("memory", {}))
+    return memory_config
+
+
+class AgentMemory:
+    """
+    Agent自己的有界记忆
+
+    记录Agent每次分析的输出（去掉修改后的文章和修改操作，只保留分析和建议），供其后续轮次参考。
+    mode 决定记录方式：
+        "ring": 环形缓冲区，按原文保留最近的记录
+        "summary": 只保留每条记录的抽取式摘要（不超过 summary_tokens）
+        "off": 不记录
+    两种记录方式下，记录条数不超过 max_entries，总token数不超过 max_tokens，超出时淘汰最早的记录，
+    因此长时间运行的会话中记忆占用保持不变
+    """
+    def __init__(self, mode="summary", max_entries=4, max_tokens=1200, summary_tokens=300):
+        """
+        参数:
+            mode: 记录方式，"ring"、"summary" 或 "off"
+            max_entries: 最多保留的记录条数
+            max_tokens: 所有记录的token总数上限
+            summary_tokens: summary 方式下每条记录的token上限
+        """
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.round = 0
+        self.total_tokens = 0
+        self._entries = deque()
+        self._lock = threading.Lock()
+
+    def start_round(self, round_number):
+        """
+        开始新的一轮，之后的记录属于该轮；渲染时只给出之前轮次的记录，
+        保证同一轮内（例如并行润色的各个分片）的提示词不受彼此影响
+        """
+        self.round = round_number
+
+    def add(self, content):
+        """
+        记录一次输出
+
+        参数:
+            content: Agent的完整输出
+        """
+        if self.mode == "off" or self.max_entries <= 0:
+            return
+        text = content.split(ARTICLE_MARKER, 1)[0].split(EDITS_MARKER, 1)[0].strip()
+        if not text:
+            return
+        if self.mode == "summary":
+            text = summarize_suggestions(text, self.summary_tokens)
+        text = fit_to_tokens(text, self.max_tokens)
+        tokens = estimate_tokens(text)
+
+        with self._lock:
+            self._entries.append({"round": self.round, "content": text, "tokens": tokens})
+            self.total_tokens += tokens
+            while len(self._entries) > self.max_entries or self.total_tokens > self.max_tokens:
+                self.total_tokens -= self._entries.popleft()["tokens"]
+
+    def render(self):
+        """
+        把之前轮次的记录渲染为提示词中的文本，没有记录时返回空字符串
+        """
+        with self._lock:
+            entries = [entry for entry in self._entries if entry["round"] < self.round]
+        return "\n".join(f"（第{entry['round']}轮）{entry['content']}" for entry in entries)
+
+    def clear(self):
+        """
+        清空记忆，开始新的对话时调用
+        """
+        with self._lock:
+            self._entries.clear()
+            self.total_tokens = 0
+            self.round = 0
+
+    @property
+    def entries(self):
+        """
+        当前保留的记录（副本）
+        """
+        with self._lock:
+            return [dict(entry) for entry in self._entries]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def create_agent_memory(config):
+    """
+    根据配置创建Agent记忆
+    """
+    memory_config = get_memory_config(config)
+    return AgentMemory(
+        memory_config["mode"],
+        memory_config["max_entries"],
+        memory_config["max_tokens"],
+        memory_config["summary_tokens"]
+    )
@@ -1,22 +1,55 @@
-from openai import OpenAI
-from config import load_config
+from config import load_config, resolve_route, DEFAULT_AGENT_MODE, DEFAULT_OUTPUT_FORMAT
+from llm_client import (
+    get_client, get_async_client, chat_completion, async_chat_completion,
+    get_reasoning_config, is_reasoning_model
+)
+from edit_script import EDITS_MARKER, apply_edit_output
+from prompt_templates import get_prompt_registry
+from agent_memory import create_agent_memory, get_memory_config
+from tracing import start_span
+
+# 所有Agent共用的提示词模板（输出格式、单次请求说明、整理输出），也是基础Agent自己的模板
+AGENT_TEMPLATE = "agent"
 
 class Agent:
     """
     基础Agent类
+    
+    mode 决定每次润色的请求方式：
+        "two_pass": 先思考（think），再把思考结果整理成建议和修改后的文章，共两次请求
+        "single_pass": 一次请求直接输出建议和修改后的文章
+    
+    depends_on 为依赖图调度（round_mode 为 "dag"）时需要等待其输出的上游Agent名称
+    
+    output_format 决定修改后文章的给出方式：
+        "article": 输出修改后的完整文章
+        "edits": 只输出修改操作（锚点、替换内容、理由），由本地应用到文章上，大幅减少输出token
+    
+    routing 为本Agent各操作单独设置的模型和采样参数，优先于 api.routing 中的全局设置
+    
+    memory 为本Agent的有界记忆，记录其之前轮次的分析和建议，并在后续轮次的提示词中给出
+    
+    提示词来自 prompts 目录下的模板文件，template 为本Agent使用的模板名称，子类各自设置
     """
-    def __init__(self, name, description, color, config=None):
+    template = AGENT_TEMPLATE
+    
+    def __init__(self, name, description, color, config=None, mode=DEFAULT_AGENT_MODE, depends_on=None,
+                 output_format=DEFAULT_OUTPUT_FORMAT, routing=None):
         self.name = name
         self.description = description
         self.color = color
         self.config = config or load_config()
-        self.client = OpenAI(
-            api_key=self.config["api"]["deepseek_key"],
-            base_url=self.config["api"]["deepseek_base_url"]
-        )
-        self.history = []
+        self.mode = mode
+        self.depends_on = list(depends_on or [])
+        self.output_format = output_format
+        self.routing = routing or {}
+        self.client = get_client(self.config)
+        self.prompts = get_prompt_registry(self.config)
+        self.memory = create_agent_memory(self.config)
+        if self._skips_second_pass():
+            print(f"🧠 {self.name} 的思考阶段使用推理模型 {self._route('think')[0]}，直接采用推理后的回答")
     
-    def think(self, text, reference_data, context):
+    def think(self, text, reference_data, context, reasoning_callback=None, remember=True):
         """
         Agent思考过程，生成对文章的润色意见
         保留thinking过程便于调试
@@ -25,23 +58,26 @@ class Agent:
             text: 需要润色的文本
             reference_data: 参考资料数据，包含content, style_analysis和ref_type
             context: 当前对话上下文
+            reasoning_callback: 推理模型的推理过程回调 callback(agent_name, chunk)
+            remember: 是否把思考结果记入记忆
         """
-        prompt = self._create_prompt(text, reference_data, context)
-        
-        response = self.client.chat.completions.create(
-            model=self.config["api"]["model"],
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": text}
-            ],
-            stream=False  # 不使用流式输出，一次性获取完整响应
-        )
+        model, params = self._route("think")
+        with self._trace_phase("think"):
+            thought = chat_completion(
+                self.client,
+                model,
+                self._create_think_messages(text, reference_data, context),
+                stream=False,  # 不使用流式输出，一次性获取完整响应
+                params=params,
+                config=self.config,
+                reasoning_callback=self._wrap_callback(reasoning_callback)
+            )
         
-        thought = response.choices[0].message.content
-        self.history.append({"role": "assistant", "content": thought})
+        if remember:
+            self.memory.add(thought)
         return thought
     
-    def think_stream(self, text, reference_data, context, callback=None):
+    def think_stream(self, text, reference_data, context, callback=None, reasoning_callback=None, remember=True):
         """
         Agent思考过程的流式版本，实时返回生成内容
         
@@ -50,39 +86,32 @@ class Agent:
             reference_data: 参考资料数据，包含content, style_analysis和ref_type
             context: 当前对话上下文
             callback: 回调函数，用于处理流式输出 callback(agent_name, chunk)
+            reasoning_callback: 推理模型的推理过程回调 callback(agent_name, chunk)
+            remember: 是否把思考结果记入记忆
             
         返回:
             完整的思考结果
         """
-        prompt = self._create_prompt(text, reference_data, context)
-        
-        stream = self.client.chat.completions.create(
-            model=self.config["api"]["model"],
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": text}
-            ],
-            stream=True  # 使用流式输出
-        )
+        model, params = self._route("think")
+        with self._trace_phase("think"):
+            thought = chat_completion(
+                self.client,
+                model,
+                self._create_think_messages(text, reference_data, context),
+                stream=True,  # 使用流式输出
+                callback=self._wrap_callback(callback),
+                params=params,
+                config=self.config,
+                reasoning_callback=self._wrap_callback(reasoning_callback)
+            )
         
-        # 收集完整响应
-        thought = ""
-        
-        # 处理流式响应
-        for chunk in stream:
-            if chunk.choices and chunk.choices[0].delta.content:
-                content_chunk = chunk.choices[0].delta.content
-                thought += content_chunk
-                
-                # 如果提供了回调函数，回调通知UI更新
-                if callback:
-                    callback(self.name, content_chunk)
-        
-        # 保存到历史记录
-        self.history.append({"role": "assistant", "content": thought})
+        # 保存到记忆
+        if remember:
+            self.memory.add(thought)
         return thought
     
-    def generate_response(self, text, reference_data, context, thinking=None, stream=False, callback=None):
+    def generate_response(self, text, reference_data, context, thinking=None, stream=False, callback=None,
+                          reasoning_callback=None, remember=True):
         """
         生成最终的润色建议（去除thinking过程）
         
@@ -93,88 +122,275 @@ class Agent:
             thinking: 预先生成的思考过程（可选）
             stream: 是否使用流式输出
             callback: 流式输出的回调函数
+            reasoning_callback: 推理模型的推理过程回调 callback(agent_name, chunk)
+            remember: 是否把本次输出的润色建议记入记忆；分片润色时由调用方在合并后统一记录。
+                各种模式记录的都是最终输出的润色建议部分，不记录思考过程
         """
+        if self.mode == "single_pass" and not thinking:
+            response = self._generate_single_pass(
+                text, reference_data, context, stream, callback, reasoning_callback, remember=False
+            )
+            return self._remember(self._apply_output_format(response, text), remember)
+        
+        if not thinking and self._skips_second_pass():
+            response = self._generate_single_pass(
+                text, reference_data, context, stream, callback, reasoning_callback, operation="think", remember=False
+            )
+            return self._remember(self._apply_output_format(response, text), remember)
+        
         if not thinking:
             if stream and callback:
-                thinking = self.think_stream(text, reference_data, context, callback)
+                thinking = self.think_stream(text, reference_data, context, callback, reasoning_callback, False)
             else:
-                thinking = self.think(text, reference_data, context)
+                thinking = self.think(text, reference_data, context, reasoning_callback, False)
+        
+        messages = self._create_response_messages(reference_data, thinking, text)
+        model, params = self._route("response")
+        
+        if stream and callback:
+            # 流式生成
+            with self._trace_phase("response"):
+                response = chat_completion(
+                    self.client,
+                    model,
+                    messages,
+                    stream=True,
+                    callback=self._wrap_callback(callback),
+                    params=params,
+                    config=self.config,
+                    reasoning_callback=self._wrap_callback(reasoning_callback)
+                )
+        else:
+            # 标准生成（不流式）
+            with self._trace_phase("response"):
+                response = chat_completion(
+                    self.client,
+                    model,
+                    messages,
+                    stream=False,
+                    params=params,
+                    config=self.config,
+                    reasoning_callback=self._wrap_callback(reasoning_callback)
+                )
+        return self._remember(self._apply_output_format(response, text), remember)
+    
+    def _remember(self, output, remember=True):
+        """
+        把输出中的润色建议记入记忆（修改稿部分由记忆自行去掉），返回原输出
+        """
+        if remember:
+            self.memory.add(output)
+        return output
+    
+    def _apply_output_format(self, response, text):
+        """
+        edits 格式下把修改操作应用到文章上，转换为包含完整修改稿的标准输出
+        """
+        if self.output_format != "edits":
+            return response
+        return apply_edit_output(response, text)
+    
+    def _generate_single_pass(self, text, reference_data, context, stream=False, callback=None,
+                              reasoning_callback=None, operation="single_pass", remember=True):
+        """
+        单次请求模式：一次请求同时完成分析并输出建议和修改后的文章
+        
+        参数:
+            text: 需要润色的文本
+            reference_data: 参考资料数据
+            context: 当前对话上下文
+            stream: 是否使用流式输出
+            callback: 流式输出的回调函数
+            reasoning_callback: 推理模型的推理过程回调
+            operation: 路由模型和参数时使用的操作名称
+            remember: 是否把输出记入记忆
+        """
+        use_stream = stream and callback
+        model, params = self._route(operation)
+        with self._trace_phase(operation):
+            response = chat_completion(
+                self.client,
+                model,
+                self._create_single_pass_messages(text, reference_data, context),
+                stream=bool(use_stream),
+                callback=self._wrap_callback(callback) if use_stream else None,
+                params=params,
+                config=self.config,
+                reasoning_callback=self._wrap_callback(reasoning_callback)
+            )
+        
+        if remember:
+            self.memory.add(response)
+        return response
+    
+    def _trace_phase(self, operation):
+        """
+        追踪本Agent的一个阶段（think、response、single_pass 或 final），阶段内的LLM调用挂在该span下
+        """
+        return start_span(self.config, f"agent.{operation}", agent=self.name, phase=operation, mode=self.mode,
+                          output_format=self.output_format)
+    
+    def _wrap_callback(self, callback):
+        """
+        将 callback(agent_name, chunk) 形式的回调转换为调用层使用的 callback(chunk)
+        """
+        if not callback:
+            return None
+        return lambda chunk: callback(self.name, chunk)
+    
+    def _skips_second_pass(self):
+        """
+        two_pass 模式的思考阶段路由到推理模型时，推理过程本身就是思考，
+        直接让推理模型按最终格式回答，省去整理输出的第二次请求
+        """
+        if self.mode != "two_pass" or not get_reasoning_config(self.config)["skip_second_pass"]:
+            return False
+        model, _ = self._route("think")
+        return is_reasoning_model(self.config, model)
+    
+    def _route(self, operation):
+        """
+        获取本Agent执行某个操作使用的模型和采样参数
+        
+        参数:
+            operation: 操作名称，如 "think"、"response"、"single_pass"、"final"
+            
+        返回:
+            (模型名称, 采样参数字典)
+        """
+        return resolve_route(self.config, operation, self.routing)
+    
+    def _create_single_pass_messages(self, text, reference_data, context):
+        """
+        构建单次请求模式的消息：静态提示词和输出格式要求在前，动态内容在后
         
+        参数:
+            text: 需要润色的文本
+            reference_data: 参考资料数据
+            context: 当前对话上下文
+            
+        返回:
+            消息列表
+        """
+        if self.output_format == "edits":
+            deliverable = "然后以修改操作的形式给出你的修改，不要输出完整文章"
+        else:
+            deliverable = "然后提供按照你的建议修改后的完整文章"
+        instruction = self.prompts.render(
+            AGENT_TEMPLATE, "single_pass",
+            static={"deliverable": deliverable, "output_format": self._create_output_format()}
+        )
+        prompt = "\n\n".join([
+            self._create_static_prompt(),
+            instruction,
+            self._create_dynamic_prompt(text, reference_data, context)
+        ])
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": text}
+        ]
+    
+    def _create_output_format(self):
+        """
+        润色结果的输出格式要求，两种模式共用
+        """
+        if self.output_format == "edits":
+            return self._create_edits_output_format()
+        return self.prompts.render(AGENT_TEMPLATE, "output_article", static={"name": self.name})
+    
+    def _create_edits_output_format(self):
+        """
+        edits 格式的输出要求：只输出修改操作，不输出完整文章
+        """
+        return self.prompts.render(
+            AGENT_TEMPLATE, "output_edits", static={"name": self.name, "edits_marker": EDITS_MARKER}
+        )
+    
+    def _create_think_messages(self, text, reference_data, context):
+        """
+        构建思考阶段的请求消息
+        
+        参数:
+            text: 需要润色的文本
+            reference_data: 参考资料数据
+            context: 当前对话上下文
+            
+        返回:
+            消息列表
+        """
+        prompt = self._create_prompt(text, reference_data, context)
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": text}
+        ]
+    
+    def _create_response_messages(self, reference_data, thinking, text=None):
+        """
+        构建生成最终润色建议阶段的请求消息
+        
+        参数:
+            reference_data: 参考资料数据
+            thinking: 思考阶段的输出
+            text: 需要润色的文本，edits 格式下附在思考结果之后，供逐字摘录锚点
+            
+        返回:
+            消息列表
+        """
         # 获取参考资料类型
         ref_type = reference_data.get("ref_type", "self")
         
-        # 根据参考资料类型调整提示词
-        prompt_prefix = ""
+        # 根据参考资料类型调整提示词，放在固定内容之后，保证提示词前缀不随参考资料变化
+        reference_note = ""
         if ref_type == "document":
             # 文档类型，偏向理论指导
-            prompt_prefix = f'你是一位名为"{self.name}"的世界顶级文学润色专家，参考了权威学术文档的指导。'
+            reference_note = "你参考了权威学术文档的指导。"
         elif ref_type == "article":
             # 文章类型，偏向风格模仿
-            prompt_prefix = f'你是一位名为"{self.name}"的世界顶级文学润色专家，参考了高质量文学作品的风格。'
+            reference_note = "你参考了高质量文学作品的风格。"
+        
+        if self.output_format == "edits":
+            deliverable = "然后，请以修改操作的形式给出你的修改，不要输出完整文章。"
+            user_content = f"{thinking}\n\n当前文章：\n{text}" if text else thinking
         else:
-            # 默认类型
-            prompt_prefix = f'你是一位名为"{self.name}"的世界顶级文学润色专家。'
+            deliverable = "然后，请提供按照你的建议修改后的完整文章。"
+            user_content = thinking
         
         # 生成最终输出（不包含思考过程）
-        prompt = f"""
-        {prompt_prefix}
-        请基于你之前的思考，给出对文章的最终润色建议。然后，请提供按照你的建议修改后的完整文章。
-        
-        你的输出必须包含以下两部分：
-        
-        # {self.name} 的润色建议
-        [在此提供具体、专业、可执行的润色建议。必须详细且有针对性，避免笼统的评论。提供精确的修改意见和替代表达方式。]
+        prompt = self.prompts.render(AGENT_TEMPLATE, "response", static={
+            "name": self.name,
+            "deliverable": deliverable,
+            "output_format": self._create_output_format(),
+            "reference_note": reference_note
+        })
+        
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": user_content}
+        ]
+    
+    def _create_prompt(self, text, reference_data, context):
+        """
+        创建完整的分析提示词：静态部分在前，动态部分在后
         
-        # 修改后的文章内容
-        [在此提供根据你的建议修改后的完整文章内容，这是最重要的部分。]
+        静态部分（角色设定和润色要求）对同一个Agent逐字节不变，放在最前面可以命中服务端的前缀缓存；
+        机械用语列表、对话上下文等每次可能变化的内容都放在静态部分之后
         
-        注意：
-        - 你的建议必须具体、专业、可执行，避免笼统的评论
-        - 提供精确的修改意见和替代表达方式，而不是泛泛而谈
-        - 必须提供完整的修改后文章内容，这是最终交付的成果
+        参数:
+            text: 需要润色的文本
+            reference_data: 参考资料数据，包含content, style_analysis和ref_type
+            context: 当前对话上下文
         """
-        
-        if stream and callback:
-            # 流式生成
-            stream_response = self.client.chat.completions.create(
-                model=self.config["api"]["model"],
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": thinking}
-                ],
-                stream=True
-            )
-            
-            # 收集完整响应
-            full_response = ""
-            
-            # 处理流式响应
-            for chunk in stream_response:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content_chunk = chunk.choices[0].delta.content
-                    full_response += content_chunk
-                    
-                    # 通知UI更新
-                    if callback:
-                        callback(self.name, content_chunk)
-            
-            return full_response
-        else:
-            # 标准生成（不流式）
-            response = self.client.chat.completions.create(
-                model=self.config["api"]["model"],
-                messages=[
-                    {"role": "system", "content": prompt},
-                    {"role": "user", "content": thinking}
-                ],
-                stream=False
-            )
-            
-            return response.choices[0].message.content
+        return self._create_static_prompt() + "\n\n" + self._create_dynamic_prompt(text, reference_data, context)
     
-    def _create_prompt(self, text, reference_data, context):
+    def _create_static_prompt(self):
         """
-        创建基础提示词，子类会重写这个方法
+        创建提示词的静态部分：渲染本Agent模板的 [static] 节，按配置版本预渲染，重复调用不会重新拼接
+        """
+        return self.prompts.render(self.template, "static", static=self._create_static_slots())
+    
+    def _create_dynamic_prompt(self, text, reference_data, context):
+        """
+        创建提示词的动态部分：渲染本Agent模板的 [dynamic] 节，只有对话上下文等槽位在每次调用时填充
         
         参数:
             text: 需要润色的文本
@@ -192,609 +408,241 @@ class Agent:
         else:
             reference_type_desc = "请基于文章本身进行分析和润色。"
         
-        return f"""
-        你是一位名为"{self.name}"的世界顶级文学润色专家。
-        {self.description}
-        
-        请分析以下待润色的文章，并给出专业的润色建议。
-        在分析时，请参考提供的参考文档以了解合适的风格和表达方式。
+        prompt = self.prompts.render(
+            self.template, "dynamic", static=self._create_static_slots(),
+            reference_type_desc=reference_type_desc, context=context
+        )
         
-        润色时应避免使用以下机械用语：{', '.join(self.config["mechanical_words"])}
+        # 本Agent之前轮次的分析和建议放在最后，第一轮没有记忆时提示词不变
+        memory = self.memory.render() if get_memory_config(self.config)["include_in_prompt"] else ""
+        if memory:
+            prompt += "\n\n" + self.prompts.render(AGENT_TEMPLATE, "memory", memory=memory)
+        return prompt
+    
+    def _create_static_slots(self):
         """
+        提示词模板中随配置变化、但在两次配置修改之间保持不变的槽位，作为预渲染缓存的键
+        """
+        return {
+            "name": self.name,
+            "description": self.description,
+            "mechanical_words": tuple(self.config["mechanical_words"])
+        }
 
 
 class LiteraryExpert(Agent):
     """
     文学专家Agent - 专注于文学性、修辞手法和格调
     """
-    def _create_prompt(self, text, reference_docs, context):
-        return f"""
-        你是一位名为"{self.name}"的世界级文学大师，被公认为当代最卓越的文学评论家和文体专家。你拥有60余年深厚的文学研究和创作经验，曾经指导过12位国际文学奖得主完善其作品，出版过37部关于文学艺术的专著，并在全球顶尖文学院校担任荣誉教授。你对文学艺术的理解已臻化境，能捕捉到常人无法觉察的文学精妙之处，并有能力将平凡文字提升至艺术殿堂级别。
-
-        {self.description}
-        
-        请以你无与伦比的文学敏感度和专业素养，对以下待润色的文章进行深入分析和艺术重塑。你需要专注于提升其文学性、修辞技巧和艺术格调，使之达到顶级文学作品的标准。你的专业领域涵盖以下方面（但绝不仅限于此）：
-
-        1. 【修辞手法的艺术性提升】：
-           - 精确诊断并完善各类修辞手法，包括：比喻、隐喻、拟人、夸张、对比、排比、引用、反问、设问、借代、象征、反语、双关等，确保每处修辞都恰如其分，自然融入文本肌理
-           - 依据文章的情感基调和主题内涵，创造令人惊艳的原创比喻和隐喻，避免陈词滥调和平庸之笔
-           - 巧妙设计修辞层次，形成由浅入深、由显至隐的修辞节奏，增强文本的艺术深度
-           - 针对特定段落精心设计复合修辞手法，通过多层次修辞技巧的融合，创造出独特的艺术表现力
-           - 确保所有修辞手法均服务于文章主题，而非仅为修辞而修辞
-           - 每处修辞手法的应用都应当具有新颖性、独创性和启发性，避免落入俗套
-           - 分析文章现有的修辞模式，针对薄弱之处提供3-5种可供选择的修辞方案
-
-        2. 【文学意象系统的构建与完善】：
-           - 识别文章中的核心意象，并构建完整的意象系统，使各个意象之间形成有机联系
-           - 设计首尾呼应的意象框架，使文章开头和结尾的意象形成完美的艺术闭环
-           - 打造层次分明的意象谱系，包括主导意象、辅助意象、背景意象和点缀意象，形成立体的意象结构
-           - 确保意象选择与文章主题、情感基调和风格特征完美契合
-           - 在关键转折点设计强力意象，以增强文章的戏剧性和感染力
-           - 提炼并强化文章中具有原创性的意象，使之成为文章的亮点和记忆点
-           - 为抽象概念创造具体可感的意象载体，使深刻思想能够通过形象直观地呈现
-           - 确保意象的选择既契合中国传统审美，又具有现代文学气息，实现传统与现代的完美融合
-
-        3. 【文学格调的精准塑造】：
-           - 依据文章主题和内容，精确定位并提升其文学格调（如典雅、清新、庄重、沉郁、豪放、婉约、洒脱、含蓄等）
-           - 在保持格调统一的前提下，根据内容需要，设计格调的微妙变化，如由含蓄到奔放的过渡，或从沉静到激昂的转变
-           - 运用独特的语言节奏、语气变化和情感铺陈，强化文章的格调特性
-           - 分析中外经典文学作品的格调特点，借鉴其精华，但避免简单模仿
-           - 根据文章题材和目标读者，平衡严肃文学性与可读性的关系，确保艺术性与接受度的完美统一
-           - 为文章注入独特的美学韵味和哲理深度，提升其文化内涵和思想高度
-           - 确保文章格调与内容、主题、情感和表达目的高度一致，避免格调与内容的不和谐
-
-        4. 【艺术感染力的多维度增强】：
-           - 精心设计情感起伏曲线，确保文章具有扣人心弦的情感张力和感染力
-           - 在关键段落植入情感共鸣点，触发读者的情感记忆和心理认同
-           - 运用场景调度和氛围营造技巧，创造沉浸式阅读体验，使读者在阅读过程中产生身临其境之感
-           - 巧妙设计悬念、铺垫和呼应，制造文学性的惊喜和智性的满足
-           - 通过节奏变化、语气转换和情绪波动，形成富有层次感的艺术体验
-           - 精心设计细节描写，使抽象情感通过具体细节得到真实、深刻的表达
-           - 在叙述中融入感官体验描写，调动读者的视觉、听觉、嗅觉、味觉和触觉感受
-           - 建立作者与读者之间的情感纽带，使文章不仅是文字的呈现，更是心灵的交流
-
-        5. 【中国文学传统与现代表达的融合】：
-           - 汲取中国古典文学的精华，如诗词曲赋的意境美、辞赋的气势、古文的简约等
-           - 巧妙融入中国传统文化元素，如古典典故、诗词名句、成语典故等，但避免生搬硬套
-           - 平衡传统审美与现代表达，既有中国文学的韵味，又具现代文学的活力
-           - 在吸收西方文学技巧的同时，保持中国文学的独特气质和精神内核
-           - 针对文章主题，借鉴相关领域的经典文学表达方式，如山水文学、思想散文、抒情小品等
-        
-        在润色过程中，你需要做到极致细致和专业：
-
-        1. 【具体修改建议的精准性】：
-           - 为文章的每个关键段落提供至少3种不同层次的修改方案，从微调到大幅重塑
-           - 每个修改建议都必须精确到词句层面，提供具体的替换文本，而非笼统的方向性建议
-           - 对关键句式和段落，提供原创的、艺术性极高的重写范例，展示专业水准
-           - 将抽象的文学理论转化为具体可行的修改方案，实现理论与实践的完美结合
-
-        2. 【修改理念的专业深度】：
-           - 详细分析每个修改建议背后的文学原理和艺术考量，使作者理解修改的艺术价值和必要性
-           - 引用相关文学理论和创作经验，为修改建议提供理论支撑和专业依据
-           - 分析世界级文学大师在类似情境下的处理方法，借鉴其精髓但避免简单复制
-           - 从多角度论证修改建议的艺术效果，包括读者心理、文体特点、主题表达等维度
-
-        3. 【文本分析的深入性】：
-           - 识别并指出文章中的文学亮点和艺术闪光点，予以保留和强化
-           - 精准定位文章的文学瓶颈和艺术短板，提供针对性的提升方案
-           - 解析文章的艺术结构和美学特征，基于此进行有针对性的改进
-           - 分析文章与参考文档之间的文学风格差异，借鉴其精华但保持原文的独特性
-
-        4. 【作者风格的尊重与提升】：
-           - 深入把握作者的独特风格和表达习惯，在此基础上进行艺术提升
-           - 保留原文的核心情感和思想内涵，确保修改不偏离作者的创作初衷
-           - 在艺术加工的过程中，强化而非削弱作者的独特声音和个性特点
-           - 确保所有修改都是对原文的升华而非改变，让作者感到作品被完善而非被取代
-        
-        在分析时，你需要深入研究提供的参考文档，提取其文学精华并将其应用于当前文章的润色过程。要做到"取其精华、去其糟粕"，吸收参考文档的艺术特质但不盲目模仿其表面形式。参考文档应被视为润色的灵感来源和风格参照，而非简单复制的模板。
-        
-        你必须坚决避免使用以下平庸的机械用语，这些表达会大大降低文章的文学价值：{', '.join(self.config["mechanical_words"])}。除此之外，还应避免使用任何陈词滥调、网络流行语和缺乏文学性的表达方式。
-        
-        目前的对话上下文如下，请参考但不要受其限制：
-        {context}
-        
-        现在，请以世界顶级文学大师的标准，对文章进行最细致、最全面、最专业的文学性分析，并提出精确到位、具体可行的提升建议。你的每一处修改建议都应当精准、深刻、富有洞见，体现出真正一流文学专家的水准。记住，你不仅是在润色一篇文章，更是在创造一件艺术品，你的专业建议将决定这件作品能否达到真正的文学高度。
-        """
+    template = "literary_expert"
 
 
 class LanguageOptimizer(Agent):
     """
     语言优化师Agent - 专注于语法、词汇选择和句式优化
     """
-    def _create_prompt(self, text, reference_docs, context):
-        return f"""
-        你是一位名为"{self.name}"的至高无上的语言艺术大师，全球语言学界公认的"文字炼金术士"。你拥有8种语言的精通能力和45年的语言研究经验，出版过23部语言艺术专著，其中《语言的精确性与表现力》《词汇选择的艺术》和《句式结构与美学》被译为31种语言，是全球语言学院校的必读经典。你曾担任12位诺贝尔文学奖得主的语言顾问，被誉为"能让普通文字焕发生命力的魔术师"。你对词汇和语法的敏感度达到了常人无法企及的境界，能够精确捕捉到语言表达中最细微的瑕疵和最微妙的可能性。
-
-        {self.description}
-        
-        请以你无可比拟的语言洞察力和艺术鉴赏力，对以下待润色的文章进行语言层面的全方位优化。你需要将普通的语言表达提升至精准、优美、富有表现力的艺术境界。你的专业领域涵盖以下方面（但绝不局限于此）：
-
-        1. 【词汇精确性与丰富性的极致追求】：
-           - 以超凡的语言敏感度诊断每一个用词，将模糊、宽泛、苍白的表达替换为精准、生动、富有画面感的词语
-           - 为每个关键词提供精确度分级（1-5星）评估，并为3星以下的词语提供至少5个不同层次的替代选项
-           - 根据语境特点，辨析近义词之间的细微差别（如"凝望"、"注视"、"打量"、"端详"、"凝视"的精确用法区别）
-           - 识别并消除重复用词，为文章创建丰富多样的词汇系统，形成"词汇地图"
-           - 根据文章主题和风格，引入恰当的专业术语、学术词汇或文学性词汇，提升语言的专业度和深度
-           - 设计关键词在文章中的战略性重复与变奏，形成语言的韵律美和主题强化
-           - 检测并替换陈旧过时的表达方式，注入新鲜而不失典雅的现代表达
-           - 针对文章的每个段落，创建"词汇亮点"，使之成为整篇文章的语言焦点和记忆点
-
-        2. 【句式结构的艺术性设计与优化】：
-           - 精确分析每个句子的结构平衡性、节奏感和表现力，并提供针对性的重构方案
-           - 设计句式长度的战略性变化，创造"长—短—长"或"短—长—短"等节奏模式，使文章具有明显的语言韵律感
-           - 根据内容的情感强度和逻辑重要性，匹配最恰当的句式结构（如排比、递进、设问、反问、倒装等）
-           - 为文章设计句式的渐进式发展，如从简单句到复合句的过渡，形成语言的层次感和立体感
-           - 在关键转折点和情感高潮处，设计独特的句式结构，增强文本的戏剧性和冲击力
-           - 创造"句群结构"，使相邻句子之间形成有机联系，增强段落的整体性和流畅性
-           - 分析并优化句子的音韵美和节奏感，确保朗读时的和谐与流畅
-           - 设计句首和句尾的特殊处理，增强句子的开合美感和力量感
-           - 精心设计过渡句式，使段落之间的连接自然而不生硬，如使用呼应、铺垫、递进等技巧
-
-        3. 【语法精确性与表现力的完美融合】：
-           - 以极致严谨的标准检查并优化每一处语法结构，包括：时态一致性、主谓一致、动宾搭配、定语顺序等
-           - 评估并优化标点符号的使用，使其不仅grammatically正确，更能增强文本的节奏感和表现力
-           - 分析句子的逻辑结构，确保因果关系、条件关系、转折关系等逻辑关系清晰而有力
-           - 优化代词指代系统，确保每个代词的指代对象明确无歧义
-           - 设计语法结构的微妙变化，如在特定情境下使用倒装句、省略句等特殊结构增强表现力
-           - 精确分析并调整语态（主动/被动）的使用，根据强调对象和表达效果选择最佳语态
-           - 设计语法的"精巧变格"，在规范的基础上创造出独特而有效的语法表达
-           - 检测并消除语法的"过度规范"现象，在保证准确性的同时增加语言的自然感和亲和力
-
-        4. 【语言生动性与感染力的战略性提升】：
-           - 将每一个抽象概念转化为具体可感的形象，创造出"可视化语言体系"
-           - 为文章设计多维度的感官描写系统，包括视觉、听觉、嗅觉、味觉、触觉的具体描述
-           - 创造"语言动能系统"，用动态的、有生命力的表达替代静态、平面的叙述
-           - 设计情感词汇的精确使用策略，通过词语选择直接唤起读者的情感共鸣
-           - 在关键处植入语言亮点和惊喜点，制造阅读过程中的愉悦感和发现感
-           - 为文章注入恰到好处的幽默元素或智性成分，增加语言的趣味性和思想深度
-           - 设计"语言回环"结构，使文章前后呼应，增强整体性和完成度
-           - 创造具有"记忆黏性"的表达，使读者在阅读后能牢记文章的核心表达
-
-        5. 【中文语言特色的精妙运用】：
-           - 挖掘并运用汉语的独特表现力，如成语、谚语、歇后语的精准使用
-           - 善用汉语的简约之美，在关键处使用四字结构或成语，增强语言的节奏感和力量感
-           - 根据语境需要，恰当融入古典汉语的简洁表达，增添文化底蕴和表达深度
-           - 巧妙运用汉语量词的丰富性和形象性，选择最能体现对象特征的专属量词
-           - 设计汉语特有的叠词、联绵词使用，增添语言的音律美和形象性
-           - 平衡现代表达与传统韵味，创造既有传统文化根基又富有现代活力的语言风格
-        
-        在润色过程中，你必须做到极致的专业和细致：
-
-        1. 【语言诊断的精确性】：
-           - 对文章进行"语言扫描"，创建词汇、句式、语法三个维度的问题清单
-           - 为每个问题标注严重程度（轻微/中等/严重）和优化价值（一般/重要/关键）
-           - 对文章的语言表现力进行分段评估，找出语言表现最弱和最强的段落
-           - 识别文章的语言风格特点，并据此提供与风格一致的优化建议
-
-        2. 【修改方案的具体可行性】：
-           - 每个修改建议都必须包含原文表达、问题分析、具体替换文本三个部分
-           - 为关键句子提供至少3个不同层次的优化版本，从轻微调整到彻底重写
-           - 每个修改建议都附带该修改如何提升文章整体语言质量的简要分析
-           - 修改建议必须精确到词句层面，避免笼统的方向性指导
-           - 提供可直接采用的、精心打磨的替代表达，而非粗略的修改方向
-
-        3. 【语言理论的专业支撑】：
-           - 运用现代语言学理论分析文本的语言特点和优化空间
-           - 引用相关语言研究和文学创作理论，为修改建议提供权威支持
-           - 解释每个修改背后的语言艺术原理，提升作者的语言认知和表达能力
-           - 分析优秀作家在类似语言场景中的处理方法，提供借鉴但避免模仿
-
-        4. 【原作风格的尊重与提升】：
-           - 精确识别作者的语言习惯和风格特点，在优化过程中保持并强化其独特性
-           - 确保所有修改建议与作者原有风格相协调，增强而非改变其表达特色
-           - 保留作者语言中的创新之处和个性表达，重点优化通用性语言问题
-           - 在进行重大修改建议时，提供修改的理据和预期效果的详细分析
-        
-        在分析文章时，请对比研究提供的参考文档，提取其中的优秀语言表达特点并灵活应用于当前文章的优化过程。你应从参考文档中汲取语言精华，但不做简单复制，而是融会贯通，创造出既有参考借鉴又独具特色的优化方案。
-        
-        你必须坚决避免使用以下机械化、平庸化的表达方式，它们会严重损害文章的语言品质：{', '.join(self.config["mechanical_words"])}。此外，还应避免使用任何陈词滥调、网络流行语和缺乏语言美感与表现力的表达。
-        
-        目前的对话上下文如下，请参考但不受其局限：
-        {context}
-        
-        现在，请以世界顶级语言大师的标准，对文章进行最细致、最专业、最全面的语言分析，并提出精确、可行、富有创见的语言优化方案。你的每一处修改建议都应当精准到位、深入浅出、切实可行，体现出顶尖语言专家的专业素养和艺术追求。记住，你不仅是在完善文字，更是在锻造一件语言艺术品，你的专业建议将决定这篇文章能否达到语言表达的最高境界。
-        """
+    template = "language_optimizer"
 
 
 class StructureAnalyst(Agent):
     """
     结构分析师Agent - 专注于文章结构、段落组织和逻辑连贯性
     """
-    def _create_prompt(self, text, reference_docs, context):
-        return f"""
-        你是一位名为"{self.name}"的举世无双的文章结构大师，当代最杰出的文本架构设计专家，被文学界誉为"结构炼金术士"和"逻辑建筑师"。你拥有40余年文本结构研究经验，曾为18位世界级作家设计过获奖作品的结构框架，出版过28部关于文章结构学的权威著作，其中《文本结构的艺术》和《逻辑构建与叙事策略》被译为36种语言，成为全球写作课程的标准教材。你曾任哈佛、牛津等顶尖学府的写作结构学教授，开创了"整体结构美学"理论体系。你能够精确识别任何文本的结构优劣，洞察常人无法察觉的逻辑缺陷，并能将平淡无序的文本重构为具有完美结构美感和逻辑力量的杰作。
-
-        {self.description}
-        
-        请以你无与伦比的结构洞察力和逻辑构建能力，对以下待润色的文章进行深度结构分析和精准重构。你需要对其整体架构、段落组织和逻辑连贯性进行全方位优化，使之达到结构严谨、层次分明、逻辑流畅的顶级水准。你的专业领域涵盖以下方面（但绝不仅限于此）：
-
-        1. 【宏观结构的战略性设计与优化】：
-           - 精确诊断文章的整体结构类型（如三段式、金字塔式、递进式、对比式、首尾呼应式等），评估其适用性，并提供最优结构模式建议
-           - 绘制"结构地图"，精确分析文章各组成部分（引言、论述、结论等）的比例分配、功能定位和相互关系
-           - 评估文章是否采用了最合适的叙事结构或论证结构，并提供具体改进方案
-           - 分析文章的"结构节奏"，包括信息密度分布、逻辑转折点设置、高潮安排等，并设计最佳节奏曲线
-           - 对文章开头和结尾进行特别分析，精确评估其吸引力、概括性和首尾呼应效果，提供多种优化方案
-           - 创建文章的"骨架图"，可视化展示各部分之间的层级关系和逻辑衔接，帮助识别结构弱点
-           - 制定分段策略，确保各部分篇幅比例合理，重点突出，过渡自然，整体和谐
-           - 检测并消除结构上的冗余和不平衡，确保文章构架精简而稳固
-
-        2. 【段落组织的微观艺术与精密工程】：
-           - 对每个段落进行"功能定位"，明确其在文章整体中的特定作用（引入、论证、展开、过渡、总结等）
-           - 分析段落内部结构，评估其是否遵循"统一主题、逻辑递进、前后连贯"的原则
-           - 设计最优的段落长度分布，创造段落长短的艺术变化，形成节奏感和阅读韵律
-           - 精心设计段落开头句和结尾句，增强段落的完整性和表现力
-           - 为各段落间创建精妙的逻辑桥梁和过渡句，确保段落之间的连接自然流畅
-           - 对关键段落进行"微结构设计"，精确安排段落内部的句序和信息展开顺序
-           - 分析并优化段落的"内部凝聚力"，确保段内句子紧密围绕中心思想展开
-           - 设计段落的"形象特征"，如通过段落形式（如长短、密疏）来强化内容特点
-           - 创建段落间的呼应系统，使不同段落之间形成内容上的共鸣和呼应
-
-        3. 【逻辑关系的精密构建与优化】：
-           - 绘制文章的"逻辑流程图"，精确展示各论点、论据之间的逻辑关系网络
-           - 检测并修复逻辑断裂、跳跃、倒置或混乱之处，确保思路流畅，论证严密
-           - 优化各种逻辑关系的表达，包括因果关系、对比关系、并列关系、递进关系等，确保表达精确清晰
-           - 设计逻辑推进的最佳路径，使读者能轻松跟随作者的思维轨迹，不产生混淆或困惑
-           - 识别并修正潜在的逻辑谬误，如循环论证、偷换概念、不当类比等
-           - 增强论点与论据之间的紧密联系，确保每个论点都有充分有力的支持
-           - 优化论证策略，根据内容特点选择最适合的论证方法（如归纳、演绎、类比等）
-           - 设计"逻辑深度梯次"，使文章具有多层次的思想深度，而非浅层表述
-           - 构建"预设-回应"结构，预先回应读者可能的疑问和反驳，增强说服力
-
-        4. 【叙事节奏与信息流的艺术控制】：
-           - 精心设计信息展开的节奏和韵律，创造如交响乐般的起伏变化和张弛有度
-           - 分析并优化文章的"信息密度分布"，避免信息过载或内容空洞
-           - 设置战略性的"悬念点"和"递进点"，维持读者的好奇心和阅读动力
-           - 创建"情感波动曲线"，与逻辑展开相互配合，增强文章的感染力
-           - 优化叙述视角和时间线安排，选择最能突出主题和增强表现力的叙事策略
-           - 设计"主题深化路径"，使核心思想随文章进展不断深化和拓展
-           - 规划信息释放的节奏，控制关键信息的揭示时机，创造最大的表达效果
-           - 分析并优化文章的"节奏转换点"，确保转换自然且具有艺术效果
-           - 设计整体的"紧张-松弛"模式，使文章如呼吸般自然流畅
-
-        5. 【中西方结构理论的融合创新】：
-           - 融合中国传统文论中的"起承转合"与西方修辞学的结构理论，创造兼具东西方美学的结构体系
-           - 结合中国古典文学的"散而不乱、整而有章"原则与现代结构主义理论
-           - 汲取中国传统散文的"形散神聚"特点与西方论说文的严密结构特点
-           - 平衡直线式发展与环形结构的特点，创造既有明确方向又有艺术回环的文本结构
-           - 融合传统与现代的段落组织原则，满足当代读者的阅读习惯和审美需求
-        
-        在结构润色过程中，你需要做到极致的细致和专业：
-
-        1. 【结构分析的系统性】：
-           - 采用"多层次扫描"方法，依次分析文章的宏观结构、段落组织、句群结构和句法结构
-           - 创建详细的"结构问题清单"，包括严重程度评级和修复优先级
-           - 绘制文章当前的"结构图谱"和优化后的"理想结构图谱"，直观展示改进方向
-           - 对文章结构进行全方位评估，包括清晰度、连贯性、平衡性、层次感、节奏感等维度
-           - 识别并标注文章的结构亮点和问题点，区分需要保留的优点和需要改进的弱点
-
-        2. 【修改方案的精确可行】：
-           - 提供逐段的结构优化建议，包括位置调整、功能重定义、内容重组等具体操作
-           - 为关键结构问题提供多种替代方案（至少3种），并分析各方案的优缺点
-           - 详细说明如何实现段落重组和逻辑重构，包括具体的移动、合并、拆分和添加策略
-           - 设计平滑的过渡句和连接段，确保结构调整后的自然衔接
-           - 提供直接可用的重组样例，而非仅提出笼统的调整建议
-
-        3. 【理论支持的专业深度】：
-           - 引用相关文体学和结构理论支持你的分析和建议
-           - 解释每个结构调整背后的理论依据和艺术考量
-           - 分析杰出文学作品中类似结构的处理方法，提供有说服力的范例
-           - 阐述结构调整将如何提升文章的整体质量、表达效果和读者体验
-           - 预测结构优化后可能产生的积极效果，如逻辑更清晰、主题更突出等
-
-        4. 【原文意图的尊重与增强】：
-           - 确保所有结构调整都服务于强化原文的核心主题和表达意图
-           - 保留原文结构中的创新亮点和独特之处，着重修正问题点
-           - 在提出重大结构调整时，详细解释如何确保不偏离原文的基本方向和目的
-           - 分析作者可能采用当前结构的原因，在修改建议中考虑这些因素
-           - 确保结构优化是对原文的提升而非彻底改写，尊重作者的创作主权
-        
-        在分析过程中，请深入研究提供的参考文档，提取其中优秀的结构特点，并将这些特点灵活应用于当前文章的结构优化。注意吸收精华而非简单模仿，确保优化后的结构既借鉴了范例的优点，又保持了文章自身的特色和原创性。
-        
-        你必须坚决避免使用以下机械化、平庸的过渡表达，这些表达会破坏文章的结构流畅性和专业性：{', '.join(self.config["mechanical_words"])}。此外，还应避免使用任何陈旧、生硬的结构衔接方式和逻辑转折表达。
-        
-        目前的对话上下文如下，请参考但不要受其局限：
-        {context}
-        
-        现在，请以世界顶级结构大师的标准，对文章进行最细致、最全面、最专业的结构分析，并提出精确到位、具体可行的结构优化建议。你的每一处修改建议都应当体现出高深的结构设计智慧和精湛的逻辑构建技巧。记住，你不仅是在调整文章的骨架，更是在打造一座逻辑严密、结构优美的思想大厦，你的专业建议将决定这件作品能否达到真正的结构完美和逻辑无懈。
-        """
+    template = "structure_analyst"
 
 
 class StyleShaper(Agent):
     """
     风格塑造师Agent - 专注于文体风格、语调和情感表达
     """
-    def _create_prompt(self, text, reference_docs, context):
-        return f"""
-        你是一位名为"{self.name}"的举世闻名的文体风格大师，当代最伟大的风格塑造权威，被誉为"文学气质的炼金术士"和"风格魔术师"。你拥有超越凡人的文体鉴赏力，能够精确识别任何文本的风格特质，并能将其提炼、强化或重塑。你拥有50余年的文体研究和风格塑造经验，出版过31部关于文学风格的专著，其中《风格的艺术》《作家声音的塑造》和《文学气质论》被翻译成41种语言，是全球文学院校的必读经典。你曾任普林斯顿大学和索邦大学的文体学教授，指导过26位国际文学奖得主找到并完善他们独特的文学声音。你对古今中外各种文学流派的风格特征了如指掌，能够精确捕捉并模拟任何一种文学风格，同时又能创造出独一无二的风格印记。
-
-        {self.description}
-        
-        请以你无与伦比的风格洞察力和气质塑造能力，对以下待润色的文章进行深度风格分析和艺术重塑。你需要对其文体风格、语调和情感表达进行全方位的优化和提升，使之具有鲜明的艺术特色和强烈的风格个性。你的专业领域涵盖以下方面（但绝不仅限于此）：
-
-        1. 【文体风格的精准诊断与塑造】：
-           - 对文章进行"风格指纹"分析，精确识别其当前风格特征（如写实、抒情、哲理、讽刺、浪漫、现实主义等）及其强度和纯度
-           - 创建"风格谱系图"，分析文章风格的各组成元素及其比例分布，如形式美、情感强度、思想深度、描写细腻度等
-           - 评估当前风格与主题内容的匹配度，判断是否需要调整风格方向或进行风格纯化
-           - 根据内容和目的，设计最理想的风格定位，并提供达成这一风格的具体路径
-           - 识别文章中的风格断裂或不协调之处，设计风格统一化策略
-           - in为文章创建独特的"风格标识"，如特殊的句式模式、词汇选择偏好、修辞特色等
-           - 分析风格的层次感，设计从表层风格到深层风格的多维度风格体系
-           - 设计战略性的"风格变奏"，在保持整体一致的同时，增加局部的风格变化和丰富性
-           - 分析文章的"文体隐喻系统"，设计能强化主题的风格象征
-
-        2. 【语调把握与精妙设计】：
-           - 精确分析文章的语调特质（如庄重、亲切、冷静、热烈、幽默、忧伤等）及其适切性
-           - 设计理想的"语调曲线"，规划语调如何随文章内容发展而变化，创造起伏有致的语调韵律
-           - 精心校准语调的强度，避免语调过强导致做作，或语调过弱导致平淡
-           - 创造"语调和声"效果，在主导语调之外，增添微妙的辅助语调，增加层次感
-           - 设计语调转换的过渡技巧，使语调变化自然而不突兀
-           - 分析语调与读者预期的匹配度，调整语调以最大化读者共鸣
-           - 创建"语调标记词汇"，通过特定词语的战略性使用来强化特定语调
-           - 分析文章中的"语调锚点"（关键句），确保这些句子准确体现所需语调
-           - 设计"语调节点"，在文章关键处设置强烈的语调表现，形成语调高潮
-
-        3. 【情感表达的深度与精确性】：
-           - 绘制文章的"情感地图"，分析情感类型、强度分布和变化曲线
-           - 评估情感表达与内容的匹配度，确保情感既真实又适度，避免情感过度或不足
-           - 设计情感的"明暗层次"，平衡直接表达与含蓄暗示，创造情感的立体感
-           - 创建"情感共鸣点"，在文章关键处植入能触发读者情感记忆的表达
-           - 设计情感表达的"具象化策略"，通过具体细节和感官描写使抽象情感具体可感
-           - 平衡理性与感性的表达比例，根据文章类型和目的调整二者的关系
-           - 创造"情感张力"，通过对立情感的并置或冲突，增强文章的戏剧性
-           - 设计"情感递进"路径，使情感随着内容发展逐渐深化和复杂化
-           - 分析并优化"情感色彩词"的使用，确保情感表达的精准和丰富
-
-        4. 【作者声音的识别与提升】：
-           - 精确捕捉作者独特的表达习惯和思维方式，提炼其个人风格的核心特质
-           - 区分作者风格中的优势特点和需改进之处，强化前者，改善后者
-           - 设计作者声音的"成熟路径"，帮助其发展出更加独特、成熟的个人风格
-           - 确保风格优化不会掩盖作者的真实声音，而是使其更加纯粹和鲜明
-           - 分析作者语言中的"个性标记"，如特定句式偏好、词汇选择特点、修辞习惯等，有选择地强化这些特点
-           - 评估作者声音的一致性，确保整篇文章体现出连贯的个人风格
-           - 创建作者的"风格识别系统"，帮助作者理解并有意识地运用自己的风格特点
-           - 平衡独特性与可读性，确保个人风格鲜明但不至于晦涩难懂
-
-        5. 【风格传统与创新的平衡】：
-           - 分析文章与相关文学传统的关系，既尊重传统又不被其束缚
-           - 识别可能的风格创新点，鼓励有意义的风格实验和突破
-           - 评估风格元素的时代感，更新过时表达，注入现代活力
-           - 在借鉴经典风格的同时，避免陈词滥调和老套表达
-           - 创造"传统-创新"的融合策略，使文章既有根基又有新意
-           - 分析风格创新的风险和收益，确保创新服务于表达而非哗众取宠
-
-        6. 【中国文学传统的风格精髓运用】：
-           - 汲取中国古典文学的意境美学，如诗词的含蓄意象、散文的情景交融
-           - 借鉴中国传统文论中的"气韵""神采""意境"等概念，提升文章的艺术境界
-           - 融合古今中外的风格特点，创造既有中国韵味又具现代气息的独特风格
-           - 灵活运用中国文学的抒情传统和哲理传统，增强文章的情感深度和思想高度
-           - 吸收中国古典审美中的"和而不同"原则，在统一中求变化，在变化中求统一
-        
-        在风格润色过程中，你需要做到极致的专业和精确：
-
-        1. 【风格分析的精确性】：
-           - 进行多维度的风格扫描，从词汇、句式、修辞、语气、节奏等各方面分析文章的风格特征
-           - 创建详细的"风格诊断报告"，包括风格优势、弱点、不一致处和提升空间
-           - 对文章进行"风格分段分析"，识别不同段落的风格变化和统一需求
-           - 生成"风格发展建议"，包括短期和长期的风格塑造目标
-           - 提供"风格参照系"，列举与目标风格相近的优秀作品供参考
-
-        2. 【修改建议的具体可行】：
-           - 提供精确到位的风格优化建议，包括具体的词句修改、段落重写和整体调整
-           - 为关键段落提供多个不同风格强度的改写版本（至少3个），从微调到大幅重塑
-           - 详细解释每处修改如何强化整体风格和提升表达效果
-           - 设计"风格强化练习"，帮助作者更好地掌握和运用目标风格
-           - 创建"风格检查清单"，便于作者在未来写作中自行评估和调整风格
-
-        3. 【理论支持的专业深度】：
-           - 引用相关文体学理论和风格研究支持你的分析和建议
-           - 解释风格修改背后的美学原理和艺术考量
-           - 借鉴文学大师的风格处理手法，提供有说服力的例证
-           - 分析风格选择对读者接受度和文章整体效果的影响
-           - 预测风格优化可能带来的积极变化，如表现力增强、情感共鸣加深等
-
-        4. 【原风格特质的尊重与提升】：
-           - 确保所有风格调整都是基于原文风格的有机发展，而非生硬移植
-           - 保留并强化原文风格中的独特闪光点，重点修正不协调之处
-           - 在文风优化中保持作者的真实声音和个性特点，使风格更具辨识度
-           - 分析作者可能的风格意图，确保修改符合创作初衷
-           - 平衡风格理想与实际可行性，提供循序渐进的风格提升路径
-        
-        在分析过程中，请深入研究提供的参考文档，精确把握其风格特质并灵活应用于当前文章的风格塑造。注意吸收风格精华而非表面模仿，确保风格优化既有借鉴参考也保持原创性和独特性。
-        
-        你必须坚决避免使用以下机械化、缺乏风格感的表达方式，它们会严重削弱文章的艺术气质：{', '.join(self.config["mechanical_words"])}。此外，还应避免任何陈词滥调、网络流行语和风格老旧的表达方式。
-        
-        目前的对话上下文如下，请参考但不要受其局限：
-        {context}
-        
-        现在，请以世界顶级风格大师的标准，对文章进行最细致、最全面、最专业的风格分析，并提出精确到位、具体可行的风格优化建议。你的每一处修改建议都应当体现出深刻的风格洞察力和精湛的气质塑造艺术。记住，你不仅是在改进文字表达，更是在塑造一件具有鲜明气质和独特魅力的艺术品，你的专业建议将决定这件作品能否拥有令人难忘的风格魅力和持久的艺术生命力。
-        """
+    template = "style_shaper"
 
 
 class ComprehensiveReviewer(Agent):
     """
     综合评审员Agent - 负责整合各个专家的建议并做最终决策
     """
-    def _create_prompt(self, text, reference_docs, context):
-        return f"""
-        你是一位名为"{self.name}"的传奇文学评审大师，当代最权威的文学总编辑，被全球文坛公认为"文学判官"和"艺术守护者"。你拥有无与伦比的综合判断能力和超凡的文学平衡智慧，被誉为"能将不同意见熔铸为完美整体的炼金术士"。你拥有55年的文学编辑和评审经验，曾担任《纽约客》《巴黎评论》等世界顶级文学期刊的总编辑，主持过31项国际顶级文学奖的评选工作，培养了43位后来获得诺贝尔文学奖的作家。你出版过27部关于文学评论和编辑艺术的专著，其中《文学决策的艺术》《编辑之眼》和《审美平衡论》被翻译成46种语言，成为全球文学院校的必读经典。你精通世界各大文学传统，能够精确权衡不同文学元素的价值和关系，做出最有利于作品艺术性的综合决策。
+    template = "comprehensive_reviewer"
 
-        {self.description}
+    def generate_final_text(self, original_text, expert_suggestions, reference_docs):
+        """
+        生成最终润色后的文章
+        """
+        model, params = self._route("final")
+        with self._trace_phase("final"):
+            return chat_completion(
+                self.client,
+                model,
+                self._create_final_messages(original_text, expert_suggestions, reference_docs),
+                stream=False,
+                params=params,
+                config=self.config
+            )
+    
+    def _create_final_messages(self, original_text, expert_suggestions, reference_docs):
+        """
+        构建生成最终文章的请求消息
         
-        请以你无可比拟的综合判断力和文学智慧，对以下待润色的文章及各位专家的意见进行最高水准的综合评审。你需要整合各方面的专业建议，解决可能的冲突，并做出最终的润色决策，使文章达到艺术完美的境界。你的专业领域涵盖以下方面（但绝不仅限于此）：
-
-        1. 【全局平衡的战略性把控】：
-           - 精确评估各位专家意见的价值、适用性和优先级，创建"建议价值矩阵"
-           - 识别各专家建议之间的互补性、重叠性和冲突性，绘制"意见关系图谱"
-           - 根据文章的核心目的和艺术追求，确立润色的首要目标和次要目标
-           - 制定"意见整合策略"，确定哪些建议应当完全采纳、部分采纳或婉拒不用
-           - 设计各类文学元素（如修辞、结构、风格、语言等）之间的最佳平衡比例
-           - 构建"文学元素协同系统"，使各类元素互相强化而非相互抵消
-           - 分析并解决各专家建议间的潜在冲突，设计创造性的调和方案
-           - 确保润色方案的整体性和一致性，避免拼凑感和不协调感
-           - 在多元建议中把握文章的核心精神和灵魂，确保不因过度修改而失去原作的本质
-
-        2. 【整体一致性的精密保障】：
-           - 建立"风格协调检验系统"，确保所有修改后的风格特征保持高度一致
-           - 设计"逻辑连贯性保障方案"，确保修改后的文章逻辑更加严密而非松散
-           - 创建"主题突显策略"，使文章的中心思想通过各种修改而更加鲜明，而非被削弱
-           - 设置"风格边界"，确保风格优化不会导致文体混杂或特色丧失
-           - 构建"元素互动模型"，确保修辞手法、结构设计、语言选择等各元素和谐共存
-           - 设计"过渡平滑系统"，使不同专家建议的衔接处自然流畅
-           - 建立"一致性检查点"，在文章的关键位置设置特殊标记，确保全文在这些点上保持风格和逻辑的一致
-           - 分析修改前后的"文本连贯度变化"，确保所有改动增强而非破坏文本的整体性
-           - 设计"风格指纹保留策略"，确保修改后的文章仍能体现作者的独特风格
-
-        3. 【最终品质的极致把关】：
-           - 建立"文学品质多维评估体系"，从艺术性、思想性、感染力、创新性等多角度评估文章
-           - 设计"读者体验地图"，预测不同类型读者对文章的感受和反应
-           - 制定"弱点消除策略"，精确定位并消除文章中的所有艺术瑕疵
-           - 建立"亮点强化系统"，识别并提升文章的独特优势和闪光点
-           - 创建"艺术张力测量表"，评估并提升文章的情感力量和思想深度
-           - 设计"记忆点布局"，在文章关键处设置能给读者留下深刻印象的表达
-           - 进行"时间耐受性测试"，评估文章是否具有持久的艺术价值而非短暂的时尚感
-           - 设计"细节完美化方案"，确保文章的每一处细节都经过精心打磨
-           - 进行"整体升华策略"，使文章不仅在局部优美，更在整体上达到艺术境界
-
-        4. 【风格统一性的精确审核】：
-           - 制定"风格纯度测量标准"，评估并提升文章风格的纯粹性和鲜明度
-           - 设计"风格连贯性保障系统"，确保从开头到结尾风格一脉相承
-           - 创建"语调协调策略"，使文章的语调变化有规律、有节奏而非混乱无序
-           - 建立"风格特征突显机制"，使文章的风格特点更加鲜明而非平庸
-           - 设计"风格创新与传统平衡策略"，既尊重文学传统又不失创新精神
-           - 进行"风格纯正性检测"，识别并消除不协调的风格元素
-           - 创建"风格层次结构"，使文章在保持整体风格统一的同时，具有丰富的风格层次
-           - 设计"风格节奏曲线"，使风格强度随内容发展而有节律地变化
-           - 建立"风格标志系统"，使文章具有独特的风格标识和记忆点
-
-        5. 【跨文化与现代性的平衡】：
-           - 评估文章的文化兼容性，确保其既有文化根基又具有跨文化的理解力
-           - 设计"传统-现代平衡策略"，使文章既传承文学传统又符合当代审美
-           - 创建"东西方美学融合框架"，汲取中西文学传统的精华，创造兼容并蓄的艺术表达
-           - 设计"时代适应性策略"，使文章既有永恒的艺术价值又有当代的共鸣力
-           - 建立"文化深度层次"，使文章在表层之下蕴含丰富的文化内涵
-        
-        在综合评审过程中，你需要做到极致的专业和精确：
-
-        1. 【专家意见的全面分析】：
-           - 对每位专家的建议进行"价值分层分析"，区分核心价值、辅助价值和可替代部分
-           - 创建"专家建议比较矩阵"，直观展示各专家意见的异同点和互补性
-           - 进行"建议效果预测"，评估每个建议可能产生的艺术效果和读者反应
-           - 设计"建议优先级排序系统"，确定采纳建议的先后顺序和重要程度
-           - 创建"专家意图理解模型"，深入把握每位专家建议背后的艺术考量和理论依据
-
-        2. 【决策过程的透明与理据】：
-           - 为每个采纳或不采纳的决定提供详细的艺术理由和专业解释
-           - 设计"决策树展示"，清晰呈现你是如何在多种可能中做出最优选择
-           - 提供"替代方案分析"，说明其他可能的决策路径及其优缺点
-           - 引用相关文学理论和艺术原则支持你的决策，增强说服力和专业性
-           - 预测你的决策可能带来的整体艺术效果，展示其价值和必要性
+        参数:
+            original_text: 原始文章
+            expert_suggestions: 汇总的专家建议
+            reference_docs: 参考资料的风格分析
+            
+        返回:
+            消息列表
+        """
+        prompt = self.prompts.render(
+            self.template, "final", static=self._create_static_slots(),
+            original_text=original_text, expert_suggestions=expert_suggestions, reference_docs=reference_docs
+        )
+        
+        return [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": self.prompts.render(self.template, "final_request")}
+        ]
 
-        3. 【修改建议的具体可行】：
-           - 提供精确到位的综合修改方案，包括具体的文本修改、结构调整和风格优化
-           - 设计"修改实施路径"，提供清晰的步骤指导如何实现最终的艺术效果
-           - 创建"修改效果对比示例"，展示修改前后的艺术效果对比
-           - 设计"修改难度分级"，使作者清楚了解各项修改的复杂度和优先级
-           - 提供"修改后的风险控制建议"，防止修改过程中可能出现的问题
 
-        4. 【原作精神的尊重与升华】：
-           - 确保所有修改决策都尊重并强化原作的核心精神和创作意图
-           - 设计"作者意图保护机制"，在综合各方建议时不偏离作者的根本追求
-           - 创建"原作精华提取系统"，识别并保留原作中最有价值的部分
-           - 建立"修改边界框架"，明确哪些是可以优化的，哪些是不应触动的
-           - 设计"作者风格增强策略"，使修改后的文章更能体现作者的独特风格，而非淡化其个性
-        
-        在最终综合过程中，你需要对提供的参考文档和前面各位专家的建议进行深度整合分析。你应该既尊重每位专家的专业判断，又保持独立的评审立场，以创造出超越各部分之和的艺术整体。最终的决策应当既兼顾各方面的艺术要求，又具有内在的一致性和和谐性。
-        
-        你必须坚决避免使用以下机械化、缺乏艺术感的表达方式，它们会降低文章的整体品质：{', '.join(self.config["mechanical_words"])}。此外，还应避免使用任何陈词滥调、网络流行语和缺乏文学性的表达方式。
-        
-        目前的对话上下文如下，请参考但不要受其局限：
-        {context}
+class AsyncAgent:
+    """
+    Agent的异步版本，包装一个同步Agent并复用其提示词，通过异步客户端发送请求
+    
+    多个会话可以在同一个事件循环中并发执行，而不需要为每个会话占用一个线程
+    """
+    def __init__(self, agent):
+        self.agent = agent
+        self.name = agent.name
+        self.description = agent.description
+        self.color = agent.color
+        self.config = agent.config
+        self.depends_on = agent.depends_on
+    
+    @property
+    def memory(self):
+        return self.agent.memory
+    
+    async def think(self, text, reference_data, context, callback=None, reasoning_callback=None, remember=True):
+        """
+        异步思考过程，传入callback时使用流式输出
         
-        现在，请以世界顶级文学总编辑的标准，对文章和各专家意见进行最全面、最深入、最平衡的综合评审，并提出最终的润色决策。你的每一处判断都应当体现出卓越的文学智慧和非凡的综合能力。记住，你不仅是在整合意见，更是在创造一件和谐完美的艺术品，你的最终决策将决定这件作品能否达到真正的艺术卓越和思想高度。
+        参数:
+            text: 需要润色的文本
+            reference_data: 参考资料数据，包含content, style_analysis和ref_type
+            context: 当前对话上下文
+            callback: 回调函数 callback(agent_name, chunk)，可以是普通函数或协程函数
+            reasoning_callback: 推理模型的推理过程回调 callback(agent_name, chunk)
+            remember: 是否把思考结果记入记忆
+            
+        返回:
+            完整的思考结果
         """
+        model, params = self.agent._route("think")
+        with self.agent._trace_phase("think"):
+            thought = await async_chat_completion(
+                get_async_client(self.config),
+                model,
+                self.agent._create_think_messages(text, reference_data, context),
+                stream=callback is not None,
+                callback=self._wrap_callback(callback),
+                params=params,
+                config=self.config,
+                reasoning_callback=self._wrap_callback(reasoning_callback)
+            )
+        
+        if remember:
+            self.agent.memory.add(thought)
+        return thought
     
-    def generate_final_text(self, original_text, expert_suggestions, reference_docs):
+    async def generate_response(self, text, reference_data, context, thinking=None, stream=False, callback=None,
+                                reasoning_callback=None, remember=True):
         """
-        生成最终润色后的文章
+        异步生成最终的润色建议，参数与 Agent.generate_response 相同
         """
-        prompt = f"""
-        你是一位世界顶级的文学创作大师，当代最伟大的文字炼金术士，被誉为"能将普通文字转化为永恒艺术的魔法师"。你拥有罕见的文本重塑能力和艺术整合天赋，能够从多方建议中提炼精华，并将其融合为完美的艺术整体。你曾经改写过37部后来成为经典的文学作品，指导过24位诺贝尔文学奖得主完善其代表作，出版过《文字的炼金术》《艺术文本的创造》等被译为53种语言的创作理论专著。你对文字的掌控已达到出神入化的境界，能够精确操控每个词句的力量和韵律，创造出超越常规表达的艺术奇迹。
-        
-        现在，你面临一项重要任务：根据原始文章和各位专家的润色建议，创作出一篇达到文学艺术巅峰的杰作。这不是简单的编辑或整合，而是一次彻底的艺术再创造，你需要将所有元素熔铸为完美统一的整体，使其既保留原作的精神实质，又提升至前所未有的艺术高度。
-        
-        原始文章：
-        {original_text}
+        use_stream = stream and callback is not None
         
-        专家建议：
-        {expert_suggestions}
+        single_pass_operation = None
+        if not thinking:
+            if self.agent.mode == "single_pass":
+                single_pass_operation = "single_pass"
+            elif self.agent._skips_second_pass():
+                single_pass_operation = "think"
+        
+        if single_pass_operation:
+            model, params = self.agent._route(single_pass_operation)
+            with self.agent._trace_phase(single_pass_operation):
+                response = await async_chat_completion(
+                    get_async_client(self.config),
+                    model,
+                    self.agent._create_single_pass_messages(text, reference_data, context),
+                    stream=use_stream,
+                    callback=self._wrap_callback(callback) if use_stream else None,
+                    params=params,
+                    config=self.config,
+                    reasoning_callback=self._wrap_callback(reasoning_callback)
+                )
+            return self.agent._remember(self.agent._apply_output_format(response, text), remember)
         
-        参考文档风格：
-        {reference_docs}
+        if not thinking:
+            thinking = await self.think(
+                text, reference_data, context, callback if use_stream else None, reasoning_callback, False
+            )
         
-        在创作这篇艺术杰作时，你需要做到：
-
-        1. 【元素的精炼与重构】：
-           - 精确提取原文的核心精神和灵魂，确保这一本质在重写过程中不被稀释或扭曲
-           - 从各专家建议中提炼最具价值的洞见和技巧，辨识其中的精华与泛泛之谈
-           - 创造性地整合不同专家的建议，形成超越各部分之和的艺术整体
-           - 在保留原文核心意图的前提下，大胆重构表达方式，追求最高的艺术表现力
-           - 在各种可能的表达中，始终选择最精准、最有力、最富美感的表达方式
-
-        2. 【文学品质的极致追求】：
-           - 确保每个句子都具有精准的表达力和独特的艺术美感
-           - 创造丰富多样的句式结构和节奏变化，形成如音乐般的语言韵律
-           - 精心设计修辞手法的运用，使之自然融入文本而非刻意堆砌
-           - 打造立体的意象系统和象征网络，增加文本的深度和丰富性
-           - 精确控制情感的表达强度和释放节奏，创造扣人心弦的情感体验
-           - 确保文章具有清晰而优美的结构，每个部分都有其精确的位置和功能
-
-        3. 【风格的纯粹与鲜明】：
-           - 创造独特而统一的风格特征，使整篇文章具有鲜明的艺术个性
-           - 确保风格的内在一致性，从开头到结尾保持风格的纯粹和连贯
-           - 根据内容需要，设计风格的微妙变化和层次感，但不破坏整体风格统一
-           - 在尊重原文风格倾向的基础上，提升其纯度和表现力
-           - 确保最终文本既有独特的风格特色，又具有广泛的艺术感染力
-
-        4. 【感染力与持久价值的创造】：
-           - 打造能引起读者强烈情感共鸣和思想触动的表达
-           - 创造具有"记忆粘性"的关键句和段落，使读者久读不忘
-           - 设计思想的递进和深化路径，引导读者随文本不断深入思考
-           - 平衡感性表达与理性内涵，创造情感与思想的完美结合
-           - 确保文章具有超越时代的持久艺术价值和人文意义
-
-        5. 【艺术整体的和谐统一】：
-           - 确保文章的各个部分和元素形成有机统一的整体，没有任何割裂感或不协调
-           - 精心设计文章的节奏和韵律，创造如音乐般流畅而起伏有致的阅读体验
-           - 确保文章的每个局部都服务于整体效果，没有多余或脱节的部分
-           - 创造首尾呼应和内部照应的艺术结构，增强文本的整体性和完整感
-           - 确保最终文本达到"浑然天成"的艺术境界，没有任何刻意或生硬之处
-
-        在创作过程中，你必须避免任何机械用语、陈词滥调和缺乏文学性的表达。你的每一个词句选择都应当是经过精心考量的，每一处修辞都应当是自然而富有创意的，每一个段落都应当是结构严密而富有表现力的。
+        model, params = self.agent._route("response")
+        with self.agent._trace_phase("response"):
+            response = await async_chat_completion(
+                get_async_client(self.config),
+                model,
+                self.agent._create_response_messages(reference_data, thinking, text),
+                stream=use_stream,
+                callback=self._wrap_callback(callback) if use_stream else None,
+                params=params,
+                config=self.config,
+                reasoning_callback=self._wrap_callback(reasoning_callback)
+            )
+        return self.agent._remember(self.agent._apply_output_format(response, text), remember)
+    
+    async def generate_final_text(self, original_text, expert_suggestions, reference_docs):
+        """
+        异步生成最终润色后的文章，仅在包装综合评审员时可用
+        """
+        model, params = self.agent._route("final")
+        with self.agent._trace_phase("final"):
+            return await async_chat_completion(
+                get_async_client(self.config),
+                model,
+                self.agent._create_final_messages(original_text, expert_suggestions, reference_docs),
+                stream=False,
+                params=params,
+                config=self.config
+            )
+    
+    def _wrap_callback(self, callback):
+        """
+        将 callback(agent_name, chunk) 形式的回调转换为调用层使用的 callback(chunk)
+        """
+        if not callback:
+            return None
+        return lambda chunk: callback(self.name, chunk)
 
-        你的输出必须包含以下两个部分，格式必须严格遵循：
 
-        # 综合评审员的润色建议
-        [在此提供具体、全面、专业的润色建议，汇总并优化其他专家的建议，指出你的综合决策和理由]
+# Agent名称到实现类的注册表，agent_config.json 中的 type 字段（默认为 name）在这里查找
+AGENT_CLASSES = {
+    "文学专家": LiteraryExpert,
+    "语言优化师": LanguageOptimizer,
+    "结构分析师": StructureAnalyst,
+    "风格塑造师": StyleShaper,
+    "综合评审员": ComprehensiveReviewer
+}
 
-        # 最终润色结果
-        [在此提供完整的、经过全面润色后的文章。这是最终交付的成果，必须是一个完整的艺术作品]
 
-        注意：
-        - 润色建议部分应当简明扼要但内容全面，展示你如何整合了各位专家的意见
-        - 最终润色结果必须是一篇完整的文章，而不仅仅是建议
-        - 确保文章保持原作的核心思想，同时艺术性得到显著提升
-        """
-        
-        response = self.client.chat.completions.create(
-            model=self.config["api"]["model"],
-            messages=[
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": "请创作最终润色后的文学杰作，必须包含润色建议和最终润色结果两部分"}
-            ],
-            stream=False
-        )
-        
-        return response.choices[0].message.content
+def register_agent_class(agent_type, agent_class):
+    """
+    注册新的Agent实现类，之后可以在 agent_config.json 中通过 type 字段使用
+    
+    参数:
+        agent_type: 类型名称
+        agent_class: Agent的子类
+    """
+    AGENT_CLASSES[agent_type] = agent_class
 
 
 def create_agents(config=None):
@@ -806,40 +654,20 @@ def create_agents(config=None):
     
     agents = []
     for agent_config in config["agents"]:
-        if agent_config["name"] == "文学专家":
-            agents.append(LiteraryExpert(
-                agent_config["name"],
-                agent_config["description"],
-                agent_config["color"],
-                config
-            ))
-        elif agent_config["name"] == "语言优化师":
-            agents.append(LanguageOptimizer(
-                agent_config["name"],
-                agent_config["description"],
-                agent_config["color"],
-                config
-            ))
-        elif agent_config["name"] == "结构分析师":
-            agents.append(StructureAnalyst(
-                agent_config["name"],
-                agent_config["description"],
-                agent_config["color"],
-                config
-            ))
-        elif agent_config["name"] == "风格塑造师":
-            agents.append(StyleShaper(
-                agent_config["name"],
-                agent_config["description"],
-                agent_config["color"],
-                config
-            ))
-        elif agent_config["name"] == "综合评审员":
-            agents.append(ComprehensiveReviewer(
-                agent_config["name"],
-                agent_config["description"],
-                agent_config["color"],
-                config
-            ))
-    
-    return agents 
\ No newline at end of file
+        agent_type = agent_config.get("type", agent_config["name"])
+        agent_class = AGENT_CLASSES.get(agent_type)
+        if agent_class is None:
+            print(f"⚠️ 未知的Agent类型: {agent_type}，已跳过")
+            continue
+        agents.append(agent_class(
+            agent_config["name"],
+            agent_config["description"],
+            agent_config["color"],
+            config,
+            agent_config.get("mode", DEFAULT_AGENT_MODE),
+            agent_config.get("depends_on"),
+            agent_config.get("output_format", DEFAULT_OUTPUT_FORMAT),
+            agent_config.get("routing")
+        ))
+    
+    return agents 
@@ -0,0 +1,350 @@
+import io
+import os
+import copy
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime
+from config import load_config
+from engine import Engine
+from mock_server import start_mock_server
+from usage_stats import collect_usage
+from utils import percentile
+
+# 基准测试的语料和结果目录，相对于程序所在目录
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+CORPUS_DIR = os.path.join(BENCHMARK_DIR, "corpus")
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+
+# 报告的延迟百分位
+PERCENTILES = (50, 95, 99)
+
+# 默认使用的模拟服务设置：比真实服务快得多，测出的主要是本项目自身的开销和并发结构
+DEFAULT_MOCK_SETTINGS = {
+    "first_token_latency": 0.05,
+    "tokens_per_second": 2000.0
+}
+
+# 与基线比较时，延迟或token数增长超过该比例视为回归
+DEFAULT_THRESHOLD = 0.2
+
+
+def load_corpus(names=None):
+    """
+    读取基准测试语料
+
+    参数:
+        names: 要读取的文章名称列表（不含扩展名），为空时读取语料目录中的全部文章
+
+    返回:
+        {文章名称: 文章内容}，按名称排序
+    """
+    available = sorted(filename[:-4] for filename in os.listdir(CORPUS_DIR) if filename.endswith(".txt"))
+    corpus = {}
+    for name in names or available:
+        if name not in available:
+            raise ValueError(f"语料中没有文章 {name}，可选: {', '.join(available)}")
+        with open(os.path.join(CORPUS_DIR, f"{name}.txt"), "r", encoding="utf-8") as f:
+            corpus[name] = f.read().strip()
+    return corpus
+
+
+def create_benchmark_config(base_url=None, round_mode=None, use_cache=False, use_rate_limit=None):
+    """
+    在系统配置的基础上创建基准测试使用的配置
+
+    参数:
+        base_url: 后端地址，为空时使用配置文件中的 api.deepseek_base_url
+        round_mode: 轮次执行方式，为空时使用配置文件中的设置
+        use_cache: 是否启用本地响应缓存；默认关闭，否则重复运行时测到的是缓存而不是后端
+        use_rate_limit: 是否启用本地限流；为None时对模拟服务关闭（否则测到的主要是令牌桶的排队时间），
+                        对真实服务按配置文件
+
+    返回:
+        配置字典
+    """
+    config = copy.deepcopy(load_config())
+    if base_url:
+        config["api"]["deepseek_base_url"] = base_url
+        # 模拟服务不校验密钥，但客户端要求密钥非空
+        config["api"]["deepseek_key"] = config["api"].get("deepseek_key") or "mock"
+    if round_mode:
+        config["round_mode"] = round_mode
+    config["cache"] = dict(config.get("cache", {}), enabled=use_cache)
+    if use_rate_limit is None:
+        use_rate_limit = not base_url and config["api"].get("rate_limit", {}).get("enabled", True)
+    config["api"]["rate_limit"] = dict(config["api"].get("rate_limit", {}), enabled=use_rate_limit)
+    return config
+
+
+def summarize_latencies(values):
+    """
+    汇总一组耗时（秒）：次数、平均值、各百分位和最大值，没有数据时各项为None
+    """
+    summary = {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "max": max(values) if values else None
+    }
+    for p in PERCENTILES:
+        summary[f"p{p}"] = percentile(values, p)
+    return summary
+
+
+def _summarize_tokens(records):
+    """
+    汇总用量记录中的token数
+    """
+    totals = {"calls": len(records)}
+    for key in ("prompt_tokens", "completion_tokens", "reasoning_tokens", "cache_hit_tokens", "cache_miss_tokens"):
+        totals[key] = sum(record.get(key, 0) for record in records)
+    return totals
+
+
+def run_article(config, text, max_rounds):
+    """
+    用一个新的交互引擎完整润色一篇文章，记录每一轮和最终润色的耗时
+
+    返回:
+        {"rounds": [每轮耗时], "final": 最终润色耗时, "records": 用量记录, "error": 出错信息或None}
+    """
+    engine = Engine(config)
+    run = {"rounds": [], "final": None, "records": [], "error": None}
+
+    with collect_usage() as records:
+        start_time = time.perf_counter()
+        result = engine.start_polishing(text, max_rounds)
+        elapsed = time.perf_counter() - start_time
+        while result.get("success"):
+            if result.get("is_final"):
+                run["final"] = elapsed
+                break
+            run["rounds"].append(elapsed)
+            start_time = time.perf_counter()
+            result = engine.next_round()
+            elapsed = time.perf_counter() - start_time
+        else:
+            run["error"] = result.get("message", "未知错误")
+
+    run["records"] = list(records)
+    return run
+
+
+def run_benchmark(corpus, config, max_rounds=2, repeat=1, verbose=False):
+    """
+    运行基准测试：每篇文章润色 repeat 次，每次 max_rounds 轮加最终润色
+
+    参数:
+        corpus: {文章名称: 文章内容}
+        config: 基准测试配置（见 create_benchmark_config）
+        max_rounds: 每次润色的轮次
+        repeat: 每篇文章重复的次数
+        verbose: 是否显示润色过程的输出，默认只显示进度
+
+    返回:
+        结果字典，可用 json 保存并与之后的结果比较
+    """
+    articles = {}
+    all_rounds, all_finals, all_records = [], [], []
+    errors = 0
+    wall_start = time.perf_counter()
+
+    # 引擎在当前目录下清理和写入 agent_outputs，在临时目录中运行以免影响工作目录
+    original_dir = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="benchmark_"))
+    try:
+        for name, text in corpus.items():
+            rounds, finals, records = [], [], []
+            for index in range(repeat):
+                print(f"⏱️ {name} ({len(text)} 字符) 第 {index + 1}/{repeat} 次...")
+                output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+                with output:
+                    run = run_article(config, text, max_rounds)
+                if run["error"]:
+                    errors += 1
+                    print(f"❌ {name} 润色失败: {run['error']}")
+                rounds.extend(run["rounds"])
+                if run["final"] is not None:
+                    finals.append(run["final"])
+                records.extend(run["records"])
+
+            articles[name] = {
+                "chars": len(text),
+                "round_latency": summarize_latencies(rounds),
+                "final_latency": summarize_latencies(finals),
+                "tokens": _summarize_tokens(records)
+            }
+            all_rounds.extend(rounds)
+            all_finals.extend(finals)
+            all_records.extend(records)
+    finally:
+        os.chdir(original_dir)
+
+    # 每个Agent的首token延迟，只统计流式请求（非流式请求没有首token时间）
+    ttft = {}
+    for record in all_records:
+        if record.get("first_token_latency") is not None:
+            ttft.setdefault(record.get("agent") or "其他", []).append(record["first_token_latency"])
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "backend": config["api"]["deepseek_base_url"],
+        "model": config["api"].get("model"),
+        "round_mode": config.get("round_mode"),
+        "rounds": max_rounds,
+        "repeat": repeat,
+        "wall_seconds": time.perf_counter() - wall_start,
+        "errors": errors,
+        "round_latency": summarize_latencies(all_rounds),
+        "final_latency": summarize_latencies(all_finals),
+        "ttft": {agent: summarize_latencies(values) for agent, values in sorted(ttft.items())},
+        # 本地限流的排队时间包含在轮次耗时中，单独列出以便判断耗时变化是否来自限流
+        "rate_limit_wait": sum(record.get("rate_limit_wait", 0.0) for record in all_records),
+        "tokens": _summarize_tokens(all_records),
+        "articles": articles
+    }
+
+
+def _collect_metrics(results):
+    """
+    取出用于回归比较的指标：{指标名称: 数值}，数值越大越差
+    """
+    metrics = {}
+    for key in ("round_latency", "final_latency"):
+        for p in PERCENTILES:
+            metrics[f"{key}.p{p}"] = results[key].get(f"p{p}")
+    for agent, summary in results["ttft"].items():
+        metrics[f"ttft.{agent}.p95"] = summary.get("p95")
+    for key in ("prompt_tokens", "completion_tokens"):
+        metrics[f"tokens.{key}"] = results["tokens"].get(key)
+    return metrics
+
+
+def compare_results(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    与基线结果比较
+
+    参数:
+        results: 本次结果
+        baseline: 基线结果
+        threshold: 增长超过该比例视为回归
+
+    返回:
+        回归列表，每项为 {"metric", "baseline", "current", "change"}
+    """
+    current_metrics = _collect_metrics(results)
+    baseline_metrics = _collect_metrics(baseline)
+    regressions = []
+    for metric, value in current_metrics.items():
+        base = baseline_metrics.get(metric)
+        if value is None or not base:
+            continue
+        change = value / base - 1
+        if change > threshold:
+            regressions.append({"metric": metric, "baseline": base, "current": value, "change": change})
+    return regressions
+
+
+def _format_latency(summary):
+    """
+    把耗时汇总格式化为一行文本
+    """
+    if not summary["count"]:
+        return "无数据"
+    values = "  ".join(f"p{p} {summary[f'p{p}']:.3f}s" for p in PERCENTILES)
+    return f"{values}  (n={summary['count']})"
+
+
+def format_report(results):
+    """
+    把基准测试结果格式化为便于阅读的文本
+    """
+    tokens = results["tokens"]
+    lines = [
+        f"📊 基准测试结果（后端 {results['backend']}，{results['round_mode']}，{results['rounds']} 轮 × {results['repeat']} 次）",
+        f"   总耗时: {results['wall_seconds']:.2f}秒，失败: {results['errors']} 次，"
+        f"本地限流排队合计: {results.get('rate_limit_wait', 0.0):.2f}秒",
+        f"   轮次耗时: {_format_latency(results['round_latency'])}",
+        f"   最终润色: {_format_latency(results['final_latency'])}"
+    ]
+    for name, article in results["articles"].items():
+        lines.append(f"   [{name} {article['chars']}字] 轮次 {_format_latency(article['round_latency'])}")
+    lines.append("   首token延迟:")
+    for agent, summary in results["ttft"].items():
+        lines.append(f"     {agent}: {_format_latency(summary)}")
+    lines.append(
+        f"   token: 调用 {tokens['calls']} 次，提示词 {tokens['prompt_tokens']}（缓存命中 {tokens['cache_hit_tokens']}），"
+        f"输出 {tokens['completion_tokens']}"
+    )
+    return "\n".join(lines)
+
+
+def parse_args():
+    """
+    解析命令行参数
+    """
+    parser = argparse.ArgumentParser(description="文章润色端到端基准测试")
+    parser.add_argument("--backend", choices=("mock", "config"), default="mock",
+                        help="mock: 进程内的模拟服务（默认）；config: 配置文件中的真实服务")
+    parser.add_argument("--articles", nargs="+", help="要测试的语料（short、medium、long），默认全部")
+    parser.add_argument("--rounds", type=int, default=2, help="每篇文章的润色轮次")
+    parser.add_argument("--repeat", type=int, default=3, help="每篇文章重复的次数")
+    parser.add_argument("--round-mode", choices=("sequential", "fanout", "dag"), help="轮次执行方式，默认按配置文件")
+    parser.add_argument("--use-cache", action="store_true", help="启用本地响应缓存")
+    parser.add_argument("--use-rate-limit", action="store_true", default=None,
+                        help="使用模拟服务时也启用本地限流（默认关闭，真实服务按配置文件）")
+    parser.add_argument("--output", help="结果文件，默认 benchmarks/results/<时间>.json")
+    parser.add_argument("--compare", help="与该基线结果文件比较，出现回归时以非零状态退出")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="视为回归的增长比例")
+    parser.add_argument("--first-token-latency", type=float, default=DEFAULT_MOCK_SETTINGS["first_token_latency"],
+                        help="模拟服务的首token延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_MOCK_SETTINGS["tokens_per_second"],
+                        help="模拟服务的输出速度")
+    parser.add_argument("--verbose", action="store_true", help="显示润色过程的输出")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    corpus = load_corpus(args.articles)
+
+    server = None
+    base_url = None
+    if args.backend == "mock":
+        server, base_url = start_mock_server({
+            "first_token_latency": args.first_token_latency,
+            "tokens_per_second": args.tokens_per_second
+        })
+        print(f"🧪 使用模拟LLM服务: {base_url}")
+
+    try:
+        config = create_benchmark_config(base_url, args.round_mode, args.use_cache, args.use_rate_limit)
+        results = run_benchmark(corpus, config, args.rounds, args.repeat, args.verbose)
+    finally:
+        if server:
+            server.shutdown()
+
+    print(format_report(results))
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存: {output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold)
+        if regressions:
+            print(f"❌ 与基线 {args.compare} 相比出现 {len(regressions)} 项回归:")
+            for item in regressions:
+                print(f"   {item['metric']}: {item['baseline']:.3f} → {item['current']:.3f} (+{item['change']:.0%})")
+            raise SystemExit(1)
+        print(f"✅ 与基线 {args.compare} 相比没有超过 {args.threshold:.0%} 的回归")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import copy
 import json
 
 # DeepSeek API配置
@@ -12,33 +13,202 @@ MODELS = {
     "DeepSeek-R1": "deepseek-reasoner"
 }
 
+# 服务端处理未命中缓存的提示词的大致速度（tokens/秒），用于估算提示词缓存节省的时间
+DEFAULT_PREFILL_TOKENS_PER_SECOND = 2000
+
+# 共享HTTP连接池配置（所有Agent和文档处理器共用）
+POOL_CONFIG = {
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    "keepalive_expiry": 60
+}
+
+# 客户端限流配置：所有会话共用，额度不足时在本地排队，避免触发服务端的429
+RATE_LIMIT_CONFIG = {
+    "enabled": True,
+    "requests_per_minute": 60,
+    "tokens_per_minute": 200000,
+    "expected_completion_tokens": 1500  # 未设置max_tokens时为输出预留的token数
+}
+
+# 调用重试配置：限流（429）、5xx、连接中断和超时时按抖动的指数退避重试
+RETRY_CONFIG = {
+    "max_attempts": 5,        # 每次调用最多尝试的次数（包括第一次）
+    "base_delay": 1.0,        # 退避基准时间（秒），第n次重试的等待上限为 base_delay * 2^(n-1)
+    "max_delay": 30.0,        # 单次退避等待的上限（秒）
+    "max_retry_after": 60.0,  # 服务端Retry-After的最长遵守时间（秒）
+    "attempt_timeout": 180.0,     # 单次尝试的最长时间（秒），包括流式输出的全部时间
+    "first_token_timeout": 60.0,  # 流式输出中等待第一个token的最长时间（秒）
+    "idle_timeout": 30.0,         # 流式输出中两段内容之间的最长间隔（秒）
+    "fallback_model": "",         # 停滞后改用的备用模型，为空时只重试原模型
+    "fallback_after_stalls": 1    # 原模型停滞多少次后改用备用模型
+}
+
+# 按操作路由模型和采样参数，model 为空时使用 api.model，未设置的参数使用服务端默认值。
+# 每个Agent还可以在自己的 routing 中按操作单独设置，优先于这里的全局设置。
+# 操作包括：think（思考）、response（整理输出）、single_pass（单次请求）、final（最终润色）、
+# style_analysis（参考资料风格分析）、extract_mechanical_words、remove_mechanical_words、seam（分片接缝润色）
+ROUTED_PARAMS = ("max_tokens", "temperature")
+ROUTING_CONFIG = {
+    "think": {"model": ""},
+    "response": {"model": ""},
+    "single_pass": {"model": ""},
+    "final": {"model": ""},
+    "style_analysis": {"model": ""},
+    "extract_mechanical_words": {"model": ""},
+    "remove_mechanical_words": {"model": ""},
+    "seam": {"model": ""}
+}
+
+# LLM响应缓存配置：相同的模型、消息和采样参数直接返回缓存结果
+CACHE_CONFIG = {
+    "enabled": True,
+    "path": "cache/llm_cache.sqlite3",
+    "max_bytes": 200 * 1024 * 1024,  # 缓存总大小上限，超出后按LRU淘汰
+    "replay_chunk_delay": 0          # 回放流式缓存时每个分块之间的间隔（秒）
+}
+
+# 对话上下文配置：在token预算内保留最新修改稿，较早轮次压缩为摘要
+CONTEXT_CONFIG = {
+    "enabled": True,
+    "budget_tokens": 8000,
+    "summary_ratio": 0.3,  # 存在更早轮次时，为其摘要保留的预算比例
+    "article_mode": "diff"  # 上下文中修改稿的形式："diff"（句子级差异）、"reference"（引用）或 "full"（原文）
+}
+
+# 长文章分片配置：超过 min_chars 的文章按段落分片并行润色，再拼接并润色拼接处
+SHARDING_CONFIG = {
+    "enabled": True,
+    "min_chars": 8000,     # 达到该长度的文章才分片
+    "shard_chars": 3000,   # 每个分片的目标字符数
+    "overlap_chars": 200,  # 提供给每个分片的相邻分片首尾的字符数（仅作衔接参考）
+    "max_workers": 4,      # 同时润色的分片数量上限
+    "smooth_seams": True,  # 拼接后是否对每个拼接处做一次接缝润色
+    "seam_window": 150,    # 接缝润色时拼接处每一侧的字符数
+    "seam_model": ""       # 接缝润色使用的模型，为空时按 api.routing 中 seam 的设置
+}
+
+# 推理模型配置：推理模型先流式输出推理过程（reasoning_content），再输出正文
+REASONING_CONFIG = {
+    "reasoning_models": ["deepseek-reasoner"],
+    "show_reasoning": True,    # 是否在界面中单独显示推理过程
+    "skip_second_pass": True   # two_pass 模式的思考阶段使用推理模型时，直接采用其回答，不再单独请求整理输出
+}
+
+# Agent记忆配置：每个Agent保留自己之前轮次的分析和建议，条数和token数都有上限，
+# mode 为 "ring"（按原文保留最近的记录）、"summary"（只保留摘要）或 "off"（不记录）
+MEMORY_CONFIG = {
+    "mode": "summary",
+    "max_entries": 4,
+    "max_tokens": 1200,
+    "summary_tokens": 300,      # summary 方式下每条记录的token上限
+    "include_in_prompt": True   # 是否在Agent后续轮次的提示词中给出其记忆
+}
+
+# 提示词模板配置：模板以数据文件存放在 directory 中（相对于程序所在目录），修改后自动重新加载
+PROMPT_CONFIG = {
+    "directory": "prompts",
+    "reload_interval": 1.0  # 检查模板文件是否修改的最小间隔（秒）
+}
+
+# dry run 估算配置：不调用API，按以下假设估算每次调用的输出长度和耗时
+DRY_RUN_CONFIG = {
+    "thinking_tokens": 1200,         # 思考阶段、风格分析等分析类调用的预计输出token数
+    "suggestion_tokens": 600,        # 润色建议部分的预计输出token数
+    "edit_ratio": 0.3,               # edits 格式下修改操作约占文章token数的比例
+    "decode_tokens_per_second": 30,  # 输出速度
+    "request_overhead": 1.0,         # 每次请求的网络和排队开销（秒），不含提示词处理和输出
+    "time_scale": 0.005              # 模拟运行时按预计耗时的该比例等待，用于估算并行调度下的实际总耗时
+}
+
+# 调用追踪配置：记录每个任务、轮次、Agent阶段和LLM调用的耗时span，
+# exporters 可包含 "jsonl"（写入 path，超过 max_bytes 时轮转）和 "otlp"（按 OTLP/HTTP JSON 发送到 otlp_endpoint）
+TRACING_CONFIG = {
+    "enabled": True,
+    "exporters": ["jsonl"],
+    "path": "traces/spans.jsonl",
+    "max_bytes": 10 * 1024 * 1024,
+    "backup_count": 5,
+    "otlp_endpoint": "http://127.0.0.1:4318/v1/traces",
+    "otlp_headers": {},
+    "service_name": "literasage",
+    "batch_size": 64,       # otlp 每次发送的最大span数
+    "flush_interval": 2.0   # otlp 发送间隔（秒）
+}
+
+# 指标接口配置：在 host:port 的 /metrics 路径以 Prometheus 文本格式提供运行指标，与界面一同启动
+METRICS_CONFIG = {
+    "enabled": True,
+    "host": "127.0.0.1",
+    "port": 9464
+}
+
 # Agent配置
 DEFAULT_MAX_ROUNDS = 3  # 默认对话轮次
+
+# 每轮的执行方式："sequential" 各Agent依次修改文章；"fanout" 四位专家并行分析同一篇文章，再由综合评审员合并；
+# "dag" 按各Agent的 depends_on 依赖关系调度，依赖就绪即开始执行
+DEFAULT_ROUND_MODE = "sequential"
+DEFAULT_MAX_PARALLEL_AGENTS = 4  # fanout 和 dag 模式下同时执行的Agent数量上限
+
+# Agent请求模式："two_pass"（先思考再整理输出，两次请求）或 "single_pass"（一次请求直接输出）
+DEFAULT_AGENT_MODE = "two_pass"
+
+# Agent输出格式："article"（输出修改后的完整文章）或 "edits"（只输出修改操作，由本地应用，减少输出token）
+DEFAULT_OUTPUT_FORMAT = "article"
+
+# 配置文件中Agent缺少这些字段时使用的默认值（内置Agent优先使用 AGENTS 中的设置）
+AGENT_FIELD_DEFAULTS = {
+    "mode": DEFAULT_AGENT_MODE,
+    "output_format": DEFAULT_OUTPUT_FORMAT,
+    "routing": {},
+    "depends_on": []
+}
 AGENTS = [
     {
         "name": "文学专家",
         "description": "专注于文学性、修辞手法和格调，擅长提升文章的文学价值和艺术性。",
-        "color": "blue"
+        "color": "blue",
+        "mode": DEFAULT_AGENT_MODE,
+        "output_format": DEFAULT_OUTPUT_FORMAT,
+        "routing": {},
+        "depends_on": []
     },
     {
         "name": "语言优化师",
         "description": "专注于语法、词汇选择和句式优化，擅长提高语言表达的准确性和多样性。",
-        "color": "green"
+        "color": "green",
+        "mode": DEFAULT_AGENT_MODE,
+        "output_format": DEFAULT_OUTPUT_FORMAT,
+        "routing": {},
+        "depends_on": []
     },
     {
         "name": "结构分析师",
         "description": "专注于文章结构、段落组织和逻辑连贯性，擅长优化文章的整体结构和逻辑流。",
-        "color": "orange"
+        "color": "orange",
+        "mode": DEFAULT_AGENT_MODE,
+        "output_format": DEFAULT_OUTPUT_FORMAT,
+        "routing": {},
+        "depends_on": []
     },
     {
         "name": "风格塑造师",
         "description": "专注于文体风格、语调和情感表达，擅长塑造特定的文章风格和调性。",
-        "color": "purple"
+        "color": "purple",
+        "mode": DEFAULT_AGENT_MODE,
+        "output_format": DEFAULT_OUTPUT_FORMAT,
+        "routing": {},
+        "depends_on": []
     },
     {
         "name": "综合评审员",
         "description": "负责整合各个专家的建议并做最终决策，擅长平衡各方观点形成最优方案。",
-        "color": "red"
+        "color": "red",
+        "mode": DEFAULT_AGENT_MODE,
+        "output_format": DEFAULT_OUTPUT_FORMAT,
+        "routing": {},
+        "depends_on": ["文学专家", "语言优化师", "结构分析师", "风格塑造师"]
     }
 ]
 
@@ -79,11 +249,27 @@ def load_config():
                 "deepseek_key": DEEPSEEK_API_KEY,
                 "deepseek_base_url": DEEPSEEK_BASE_URL,
                 "model": DEFAULT_MODEL,
-                "models": MODELS
+                "models": MODELS,
+                "pool": POOL_CONFIG,
+                "retry": RETRY_CONFIG,
+                "rate_limit": RATE_LIMIT_CONFIG,
+                "routing": ROUTING_CONFIG,
+                "prefill_tokens_per_second": DEFAULT_PREFILL_TOKENS_PER_SECOND
             },
             "agents": AGENTS,
             "max_rounds": DEFAULT_MAX_ROUNDS,
-            "mechanical_words": DEFAULT_MECHANICAL_WORDS
+            "round_mode": DEFAULT_ROUND_MODE,
+            "max_parallel_agents": DEFAULT_MAX_PARALLEL_AGENTS,
+            "mechanical_words": DEFAULT_MECHANICAL_WORDS,
+            "cache": CACHE_CONFIG,
+            "context": CONTEXT_CONFIG,
+            "sharding": SHARDING_CONFIG,
+            "reasoning": REASONING_CONFIG,
+            "memory": MEMORY_CONFIG,
+            "prompts": PROMPT_CONFIG,
+            "dry_run": DRY_RUN_CONFIG,
+            "tracing": TRACING_CONFIG,
+            "metrics": METRICS_CONFIG
         }
         need_save = True
     
@@ -111,7 +297,12 @@ def ensure_config_complete(config):
             "deepseek_key": DEEPSEEK_API_KEY,
             "deepseek_base_url": DEEPSEEK_BASE_URL,
             "model": DEFAULT_MODEL,
-            "models": MODELS
+            "models": MODELS,
+            "pool": POOL_CONFIG,
+            "retry": RETRY_CONFIG,
+            "rate_limit": RATE_LIMIT_CONFIG,
+            "routing": ROUTING_CONFIG,
+            "prefill_tokens_per_second": DEFAULT_PREFILL_TOKENS_PER_SECOND
         }
         modified = True
     else:
@@ -133,24 +324,140 @@ def ensure_config_complete(config):
         if "models" not in api_config:
             api_config["models"] = MODELS
             modified = True
+            
+        if "pool" not in api_config:
+            api_config["pool"] = POOL_CONFIG
+            modified = True
+            
+        if "retry" not in api_config:
+            api_config["retry"] = RETRY_CONFIG
+            modified = True
+            
+        if "rate_limit" not in api_config:
+            api_config["rate_limit"] = RATE_LIMIT_CONFIG
+            modified = True
+            
+        if "routing" not in api_config:
+            api_config["routing"] = ROUTING_CONFIG
+            modified = True
+            
+        if "prefill_tokens_per_second" not in api_config:
+            api_config["prefill_tokens_per_second"] = DEFAULT_PREFILL_TOKENS_PER_SECOND
+            modified = True
     
     # 确保agents字段存在
     if "agents" not in config:
         config["agents"] = AGENTS
         modified = True
     
+    # 确保各Agent的字段存在，内置Agent按 AGENTS 补全（包括综合评审员对四位专家的依赖），
+    # 否则旧配置文件在 dag 模式下会让综合评审员与专家同时开始
+    default_agents = {agent["name"]: agent for agent in AGENTS}
+    agent_names = {agent_config.get("name") for agent_config in config["agents"]}
+    for agent_config in config["agents"]:
+        defaults = default_agents.get(agent_config.get("name"), AGENT_FIELD_DEFAULTS)
+        for key, value in AGENT_FIELD_DEFAULTS.items():
+            if key in agent_config:
+                continue
+            value = defaults.get(key, value)
+            if key == "depends_on":
+                # 只保留配置中存在的上游Agent
+                value = [name for name in value if name in agent_names]
+            agent_config[key] = copy.deepcopy(value)
+            modified = True
+    
     # 确保max_rounds字段存在
     if "max_rounds" not in config:
         config["max_rounds"] = DEFAULT_MAX_ROUNDS
         modified = True
     
+    # 确保round_mode字段存在
+    if "round_mode" not in config:
+        config["round_mode"] = DEFAULT_ROUND_MODE
+        modified = True
+    
+    # 确保max_parallel_agents字段存在
+    if "max_parallel_agents" not in config:
+        config["max_parallel_agents"] = DEFAULT_MAX_PARALLEL_AGENTS
+        modified = True
+    
     # 确保mechanical_words字段存在
     if "mechanical_words" not in config:
         config["mechanical_words"] = DEFAULT_MECHANICAL_WORDS
         modified = True
     
+    # 确保cache字段存在
+    if "cache" not in config:
+        config["cache"] = CACHE_CONFIG
+        modified = True
+    
+    # 确保context字段存在
+    if "context" not in config:
+        config["context"] = CONTEXT_CONFIG
+        modified = True
+    
+    # 确保sharding字段存在
+    if "sharding" not in config:
+        config["sharding"] = SHARDING_CONFIG
+        modified = True
+    
+    # 确保reasoning字段存在
+    if "reasoning" not in config:
+        config["reasoning"] = REASONING_CONFIG
+        modified = True
+    
+    # 确保memory字段存在
+    if "memory" not in config:
+        config["memory"] = MEMORY_CONFIG
+        modified = True
+    
+    # 确保prompts字段存在
+    if "prompts" not in config:
+        config["prompts"] = PROMPT_CONFIG
+        modified = True
+    
+    # 确保dry_run字段存在
+    if "dry_run" not in config:
+        config["dry_run"] = DRY_RUN_CONFIG
+        modified = True
+    
+    # 确保tracing字段存在
+    if "tracing" not in config:
+        config["tracing"] = TRACING_CONFIG
+        modified = True
+    
+    # 确保metrics字段存在
+    if "metrics" not in config:
+        config["metrics"] = METRICS_CONFIG
+        modified = True
+    
     return modified
 
+def resolve_route(config, operation, agent_routing=None):
+    """
+    获取某个操作使用的模型和采样参数
+    
+    依次应用 api.model、api.routing 中该操作的设置和Agent自己的 routing 设置，
+    后者中非空的项覆盖前者
+    
+    参数:
+        config: 系统配置
+        operation: 操作名称
+        agent_routing: Agent的 routing 设置（可选）
+        
+    返回:
+        (模型名称, 采样参数字典)
+    """
+    model = config["api"]["model"]
+    params = {}
+    for routing in (config["api"].get("routing", {}), agent_routing or {}):
+        route = routing.get(operation, {})
+        model = route.get("model") or model
+        for name in ROUTED_PARAMS:
+            if route.get(name) is not None:
+                params[name] = route[name]
+    return model, params
+
 def save_config(config):
     """
     保存配置到文件
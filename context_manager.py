@@ -0,0 +1,304 @@
+import re
+import difflib
+from config import CONTEXT_CONFIG
+from utils import estimate_tokens
+
+# Agent输出中修改后文章部分的标题
+ARTICLE_MARKER = "# 修改后的文章内容"
+
+# 综合评审员最终输出中润色结果部分的标题
+FINAL_RESULT_MARKER = "# 最终润色结果"
+
+# 修改稿与当前待润色文本相同时使用的引用
+SAME_AS_CURRENT_REFERENCE = "[与当前待润色的文章相同，此处省略]"
+
+# 修改稿已被后续版本取代时使用的引用
+SUPERSEDED_REFERENCE = "[该版本已被后续修改取代，此处省略]"
+
+
+def split_agent_output(content):
+    """
+    将Agent输出拆分为润色建议和修改后的文章
+
+    参数:
+        content: Agent的完整输出
+
+    返回:
+        (润色建议, 修改后的文章)，没有文章部分时文章为None
+    """
+    if ARTICLE_MARKER not in content:
+        return content.strip(), None
+    suggestions, article = content.split(ARTICLE_MARKER, 1)
+    return suggestions.strip(), article.strip()
+
+
+def extract_article(content):
+    """
+    取出Agent输出中修改后的文章，作为下一个Agent的输入
+
+    参数:
+        content: Agent的完整输出
+
+    返回:
+        修改后的文章，没有文章部分时返回None；输出中有多个文章标题时取第一个标题之后、下一个标题之前的内容
+    """
+    if ARTICLE_MARKER not in content:
+        return None
+    return content.split(ARTICLE_MARKER, 2)[1].strip()
+
+
+def find_latest_article(history, round_responses=None):
+    """
+    从最近的响应开始向前查找最新的修改稿
+
+    参数:
+        history: 已完成轮次的列表，每项包含 round 和 responses
+        round_responses: 当前轮次中已完成的Agent响应
+
+    返回:
+        最新的修改稿，没有时返回None
+    """
+    responses = [r for round_data in history for r in round_data["responses"]] + list(round_responses or [])
+    for response in reversed(responses):
+        _, article = split_agent_output(response["content"])
+        if article:
+            return article
+    return None
+
+
+def split_sentences(text):
+    """
+    按中文句末标点和换行切分句子，保留标点
+    """
+    return [s for s in re.split(r'(?<=[。！？；!?\n])', text) if s.strip()]
+
+
+def sentence_diff(current_text, article):
+    """
+    以句子为单位生成从当前文本到修改稿的差异，只包含修改过的句子
+
+    参数:
+        current_text: 当前待润色的文本
+        article: 修改稿
+
+    返回:
+        每行以 "-"（删除）或 "+"（新增）开头的差异文本
+    """
+    lines = []
+    for line in difflib.unified_diff(
+        [s.strip() for s in split_sentences(current_text)],
+        [s.strip() for s in split_sentences(article)],
+        lineterm="",
+        n=0
+    ):
+        if line.startswith(("---", "+++", "@@")):
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def compact_article(article, current_text, mode):
+    """
+    压缩上下文中的修改稿，避免同一篇文章在提示词中重复出现
+
+    参数:
+        article: 修改稿
+        current_text: 当前待润色的文本（已作为用户消息发送）
+        mode: "full" 保留原文；"reference" 替换为引用；"diff" 替换为相对当前文本的句子级差异
+
+    返回:
+        压缩后的修改稿
+    """
+    if mode == "full" or not current_text:
+        return article
+    if article.strip() == current_text.strip():
+        return SAME_AS_CURRENT_REFERENCE
+    if mode == "diff":
+        diff = sentence_diff(current_text, article)
+        # 改动很大时差异比原文还长，此时保留原文
+        if len(diff) < len(article):
+            return f"[相对当前待润色文章的修改]\n{diff}"
+        return article
+    return SUPERSEDED_REFERENCE
+
+
+def compact_agent_output(content, current_text, mode):
+    """
+    将Agent输出中的修改稿替换为引用或差异，润色建议部分保持不变
+    """
+    suggestions, article = split_agent_output(content)
+    if article is None:
+        return content
+    return f"{suggestions}\n{ARTICLE_MARKER}\n{compact_article(article, current_text, mode)}"
+
+
+def fit_to_tokens(text, max_tokens):
+    """
+    将文本截断到不超过指定的token数
+
+    参数:
+        text: 原始文本
+        max_tokens: token上限
+
+    返回:
+        截断后的文本，发生截断时以省略号结尾
+    """
+    if max_tokens <= 0:
+        return ""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    # 按比例估算保留的字符数，再逐步收缩直到满足上限
+    keep = int(len(text) * max_tokens / estimate_tokens(text))
+    while keep > 0 and estimate_tokens(text[:keep] + "……") > max_tokens:
+        keep = int(keep * 0.9)
+    return text[:keep] + "……" if keep > 0 else ""
+
+
+def summarize_suggestions(text, max_tokens):
+    """
+    抽取式压缩润色建议：按原顺序保留完整的句子，直到达到token上限
+
+    参数:
+        text: 润色建议
+        max_tokens: 摘要的token上限
+
+    返回:
+        压缩后的建议
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+
+    sentences = [s for s in re.split(r'(?<=[。！？；\n])', text) if s.strip()]
+    summary = ""
+    for sentence in sentences:
+        if estimate_tokens(summary + sentence) > max_tokens:
+            break
+        summary += sentence
+
+    # 第一句就超过上限时直接截断
+    return summary.strip() + "……" if summary else fit_to_tokens(text, max_tokens)
+
+
+class ContextManager:
+    """
+    在token预算内组装多Agent对话上下文
+
+    组装时的优先级：
+        1. 最新的修改稿，与当前待润色文本相同时替换为引用，否则按 article_mode 给出差异或原文
+        2. 更早轮次的润色建议，按Agent压缩为摘要（越新的轮次越靠前，越不容易被截掉）
+        3. 最近一轮（进行中的一轮，或刚完成的一轮）各Agent的润色建议
+    预算不足时依次压缩低优先级的部分，保证上下文总长度不超过预算；
+    存在更早轮次时，至少为其摘要保留 summary_ratio 比例的剩余预算
+    """
+    def __init__(self, budget_tokens, summary_ratio=0.3, article_mode="diff"):
+        self.budget_tokens = budget_tokens
+        self.summary_ratio = summary_ratio
+        self.article_mode = article_mode
+
+    def build_context(self, history, round_responses=None, current_text=None, include_article=True):
+        """
+        组装对话上下文
+
+        参数:
+            history: 已完成轮次的列表，每项包含 round 和 responses
+            round_responses: 当前轮次中已完成的Agent响应
+            current_text: 当前待润色的文本，最新修改稿与之比较后以引用或差异的形式给出
+            include_article: 是否包含最新修改稿，分片润色时修改稿按分片另行附上
+
+        返回:
+            不超过token预算的上下文字符串
+        """
+        round_responses = round_responses or []
+        if round_responses:
+            recent_responses = round_responses
+            older_rounds = history
+        elif history:
+            recent_responses = history[-1]["responses"]
+            older_rounds = history[:-1]
+        else:
+            return ""
+
+        budget = self.budget_tokens
+
+        # 1. 最新的修改稿
+        article_section = ""
+        latest_article = find_latest_article(history, round_responses) if include_article else None
+        if latest_article:
+            latest_article = compact_article(latest_article, current_text, self.article_mode)
+            article_section = fit_to_tokens(f"\n最新修改稿：\n{latest_article}\n", budget)
+            budget -= estimate_tokens(article_section)
+
+        # 2. 更早轮次的摘要，先占用保留的预算，未用完的部分留给最近一轮
+        summary_section = self._build_summary_section(older_rounds, int(budget * self.summary_ratio))
+        budget -= estimate_tokens(summary_section)
+
+        # 3. 最近一轮的润色建议
+        recent_section = self._build_recent_section(recent_responses, budget)
+
+        return summary_section + recent_section + article_section
+
+    def _build_recent_section(self, responses, budget):
+        """
+        最近一轮各Agent的润色建议，预算不足时平均分配给每个Agent
+        """
+        if not responses or budget <= 0:
+            return ""
+
+        entries = [(r["agent_name"], split_agent_output(r["content"])[0]) for r in responses]
+        section = "\n最近一轮的润色建议：\n" + "".join(f"{name}: {text}\n" for name, text in entries)
+        if estimate_tokens(section) <= budget:
+            return section
+
+        share = budget // len(entries) - 10
+        section = "\n最近一轮的润色建议：\n" + "".join(
+            f"{name}: {summarize_suggestions(text, share)}\n" for name, text in entries
+        )
+        return fit_to_tokens(section, budget)
+
+    def _build_summary_section(self, older_rounds, budget):
+        """
+        更早轮次的润色建议，按Agent合并后压缩为摘要
+        """
+        if not older_rounds or budget <= 0:
+            return ""
+
+        per_agent = {}
+        for round_data in reversed(older_rounds):
+            for response in round_data["responses"]:
+                suggestions, _ = split_agent_output(response["content"])
+                per_agent.setdefault(response["agent_name"], []).append(
+                    f"(轮次{round_data['round']}) {suggestions}"
+                )
+
+        share = budget // len(per_agent) - 10
+        summaries = [(name, summarize_suggestions(" ".join(items), share)) for name, items in per_agent.items()]
+        summaries = [(name, summary) for name, summary in summaries if summary]
+        if not summaries:
+            return ""
+
+        section = "\n更早轮次的建议摘要：\n" + "".join(f"{name}: {summary}\n" for name, summary in summaries)
+        return fit_to_tokens(section, budget)
+
+
+def get_context_config(config):
+    """
+    合并默认上下文配置和配置文件中的上下文配置
+    """
+    context_config = dict(CONTEXT_CONFIG)
+    context_config.update(config.get("context", {}))
+    return context_config
+
+
+def create_context_manager(config):
+    """
+    根据配置创建上下文管理器，未启用时返回None
+    """
+    context_config = get_context_config(config)
+    if not context_config["enabled"]:
+        return None
+    return ContextManager(
+        context_config["budget_tokens"],
+        context_config["summary_ratio"],
+        context_config["article_mode"]
+    )
@@ -1,10 +1,31 @@
-from agents import create_agents
-from config import load_config
+from agents import create_agents, AsyncAgent, ComprehensiveReviewer
+from config import load_config, DEFAULT_PREFILL_TOKENS_PER_SECOND, DEFAULT_ROUND_MODE, DEFAULT_MAX_PARALLEL_AGENTS
+from usage_stats import collect_usage, summarize_usage, attribute_usage
+from context_manager import (
+    create_context_manager, get_context_config, compact_agent_output, extract_article, fit_to_tokens,
+    split_agent_output, find_latest_article, FINAL_RESULT_MARKER
+)
+from scheduler import DagScheduler, format_critical_path
+from sharding import ShardedPolisher, create_style_brief
+from llm_client import get_reasoning_config, async_client_scope
+from tracing import begin_span, start_span, NOOP_SPAN
+from metrics import (
+    JOBS_IN_FLIGHT, JOBS_STARTED, JOBS_FINISHED, JOB_DURATION, ROUNDS, ROUND_DURATION, AGENT_RUNS, AGENT_DURATION
+)
+from utils import estimate_tokens
 import time
 import asyncio
+import inspect
 import threading
+import contextvars
 import concurrent.futures
 import os
+import weakref
+from contextlib import contextmanager
+
+# 进程内所有的会话，用于统计进行中的润色任务数；会话被丢弃（例如引擎重置）后自动移除
+_conversations = weakref.WeakSet()
+JOBS_IN_FLIGHT.set_function(lambda: sum(1 for conversation in list(_conversations) if conversation.job_start_time))
 
 class Conversation:
     """
@@ -14,7 +35,20 @@ class Conversation:
         self.config = config or load_config()
         print("🤖 初始化Conversation，创建Agent...")
         self.agents = create_agents(self.config)
-        print(f"✅ 成功创建 {len(self.agents)} 个Agent")
+        self.async_agents = [AsyncAgent(agent) for agent in self.agents]
+        self.context_manager = create_context_manager(self.config)
+        self.sharded_polisher = ShardedPolisher(self.config)
+        self.article_mode = get_context_config(self.config)["article_mode"]
+        self.round_mode = self.config.get("round_mode", DEFAULT_ROUND_MODE)
+        self.max_parallel_agents = self.config.get("max_parallel_agents", DEFAULT_MAX_PARALLEL_AGENTS)
+        # 依赖图调度器，创建时即检查依赖关系是否有效
+        self.scheduler = None
+        if self.round_mode == "dag":
+            self.scheduler = DagScheduler(
+                {agent.name: agent.depends_on for agent in self.agents},
+                self.max_parallel_agents
+            )
+        print(f"✅ 成功创建 {len(self.agents)} 个Agent，轮次执行方式: {self.round_mode}")
         self.history = []
         self.current_round = 0
         self.max_rounds = self.config["max_rounds"]
@@ -22,6 +56,10 @@ class Conversation:
         self.reference_data = {}
         self.final_text = ""
         self.callbacks = {"on_agent_response": None}  # 回调函数
+        self.job_span = NOOP_SPAN  # 当前润色任务的调用追踪span，各轮次和最终润色挂在它下面
+        self.job_start_time = None  # 当前润色任务的开始时间，没有进行中的任务时为None
+        _conversations.add(self)
+        self._callback_lock = threading.Lock()  # 扇出模式下多个Agent并发通知UI
     
     def register_callback(self, event_name, callback_fn):
         """
@@ -46,11 +84,46 @@ class Conversation:
         返回:
             第一轮对话结果
         """
+        self._prepare_conversation(original_text, reference_data, max_rounds)
+        
+        # 开始第一轮对话
+        try:
+            return self.next_round()
+        except Exception as e:
+            import traceback
+            self._end_job("error", e)
+            print(f"❌ 启动对话时出错: {str(e)}")
+            traceback.print_exc()
+            raise
+    
+    async def start_conversation_async(self, original_text, reference_data, max_rounds=None):
+        """
+        start_conversation 的异步版本，参数与返回值相同
+        """
+        self._prepare_conversation(original_text, reference_data, max_rounds)
+        
+        try:
+            return await self.next_round_async()
+        except Exception as e:
+            import traceback
+            self._end_job("error", e)
+            print(f"❌ 启动对话时出错: {str(e)}")
+            traceback.print_exc()
+            raise
+    
+    def _prepare_conversation(self, original_text, reference_data, max_rounds):
+        """
+        重置对话状态，为新的对话做准备
+        """
         print("📝 开始新的对话流程...")
+        # 上一个任务没有生成最终结果就被新任务取代
+        self._end_job("abandoned")
         self.original_text = original_text
         self.reference_data = reference_data
         self.history = []
         self.current_round = 0
+        for agent in self.agents:
+            agent.memory.clear()
         
         # 清理旧的输出文件
         self._clean_output_files()
@@ -58,14 +131,17 @@ class Conversation:
         if max_rounds is not None:
             self.max_rounds = max_rounds
         
-        # 开始第一轮对话
-        try:
-            return self.next_round()
-        except Exception as e:
-            import traceback
-            print(f"❌ 启动对话时出错: {str(e)}")
-            traceback.print_exc()
-            raise
+        self.job_span = begin_span(
+            self.config,
+            "job",
+            article_chars=len(original_text),
+            ref_type=reference_data.get("ref_type"),
+            max_rounds=self.max_rounds,
+            round_mode=self.round_mode,
+            agents=len(self.agents)
+        )
+        self.job_start_time = time.time()
+        JOBS_STARTED.inc()
     
     def _clean_output_files(self):
         """
@@ -100,145 +176,677 @@ class Conversation:
             print(f"🏁 已达到最大轮次 {self.max_rounds}，生成最终结果")
             return self.generate_final_text()
         
+        round_label = f"第 {self.current_round + 1} 轮"
+        self._start_memory_round()
+        start_time = time.time()
+        with start_span(self.config, "round", parent=self.job_span, round=self.current_round + 1,
+                        round_mode=self.round_mode) as round_span:
+            with collect_usage() as usage_records:
+                if self.round_mode == "fanout":
+                    result = self._run_fanout_round()
+                elif self.round_mode == "dag":
+                    result = self._run_dag_round()
+                else:
+                    result = self._run_sequential_round()
+            result["usage"] = self._summarize_usage(usage_records, round_label)
+            self._trace_result(round_span, result)
+        ROUNDS.inc(round_mode=self.round_mode, outcome="error" if result.get("error") else "ok")
+        ROUND_DURATION.observe(time.time() - start_time, round_mode=self.round_mode)
+        return result
+    
+    def _start_memory_round(self):
+        """
+        通知各Agent的记忆开始新的一轮，本轮的提示词中只包含之前轮次的记忆
+        """
+        for agent in self.agents:
+            agent.memory.start_round(self.current_round + 1)
+    
+    def _run_sequential_round(self):
+        """
+        串行执行本轮的所有Agent，每个Agent以前一个Agent修改后的文章作为输入
+        
+        返回:
+            当前轮次的对话结果
+        """
         print(f"🔄 开始第 {self.current_round + 1} 轮对话...")
         round_responses = []
-        context = self._get_conversation_context()
         
         # 获取参考资料类型
         ref_type = self.reference_data.get("ref_type", "self")
         print(f"📚 使用参考资料类型: {ref_type}")
         
         try:
-            # 获取所有Agent（包括最后一个综合评审员）
-            agents = self.agents
-            
             # 当前文本，初始为原始文本
             current_text = self.original_text
             
-            # 当前上下文，初始为空
-            current_context = context
-            
-            # 创建一个目录用于保存中间结果
-            output_dir = "agent_outputs"
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # 依次执行每个Agent
-            for i, agent in enumerate(agents):
-                agent_name = agent.name
-                print(f"🤖 正在处理: {agent_name}")
-                
+            # 依次执行每个Agent（包括最后一个综合评审员）
+            for agent in self.agents:
+                print(f"🤖 正在处理: {agent.name}")
                 start_time = time.time()
+                response = self._create_agent_response(agent)
                 
-                # 创建响应对象
-                response = {
-                    "agent_name": agent_name,
-                    "agent_color": agent.color,
-                    "content": ""
-                }
-                
-                # 流式回调函数
-                def agent_callback(name, chunk):
-                    response["content"] += chunk
-                    # 通知UI更新
-                    if self.callbacks["on_agent_response"]:
-                        self.callbacks["on_agent_response"]({
-                            "agent_name": name,
-                            "agent_color": agent.color,
-                            "content": chunk,
-                            "is_chunk": True
-                        })
+                # 当前上下文：之前轮次的对话加上本轮已完成的Agent输出
+                current_context = self._get_conversation_context(round_responses, current_text)
                 
                 try:
                     # 执行Agent，使用流式输出
-                    agent_response = agent.generate_response(
+                    agent_response = self._generate_agent_response(
+                        agent,
                         current_text,
                         self.reference_data,
                         current_context,
                         stream=True,
-                        callback=agent_callback
+                        callback=self._make_agent_callback(agent, response),
+                        reasoning_callback=self._make_reasoning_callback(agent, response)
                     )
-                    
-                    # 更新响应内容
-                    response["content"] = agent_response
-                    
-                    # 将结果保存为Markdown文件
-                    markdown_file = os.path.join(output_dir, f"round_{self.current_round + 1}_{agent_name}.md")
-                    with open(markdown_file, "w", encoding="utf-8") as f:
-                        f.write(f"# {agent_name} 的润色建议\n\n")
-                        f.write(agent_response)
-                    
-                    print(f"✅ 已保存 {agent_name} 的处理结果到 {markdown_file}")
-                    
-                    # 更新上下文，加入当前Agent的输出
-                    current_context += f"\n{agent_name}: {agent_response}"
-                    
-                    # 提取修改后的文章内容（如果存在）
-                    if "# 修改后的文章内容" in agent_response:
-                        parts = agent_response.split("# 修改后的文章内容")
-                        if len(parts) > 1:
-                            # 提取修改后的文章内容作为下一个Agent的输入
-                            modified_text = parts[1].strip()
-                            print(f"🔄 从 {agent_name} 的输出中提取了修改后的文章内容: {len(modified_text)} 字符")
-                            
-                            # 更新当前文本，作为下一个Agent的输入
-                            current_text = modified_text
-                        else:
-                            print(f"⚠️ 无法从 {agent_name} 的输出中提取修改后的文章内容")
-                    else:
-                        print(f"⚠️ {agent_name} 的输出中没有找到修改后的文章内容部分")
-                    
+                    current_text = self._handle_agent_output(agent, response, agent_response, current_text)
                 except Exception as e:
-                    import traceback
-                    print(f"❌ Agent {agent_name} 执行失败: {str(e)}")
-                    traceback.print_exc()
-                    # 添加错误响应
-                    response["content"] = f"[处理过程中出错: {str(e)}]"
-                    # 通知UI更新错误
-                    if self.callbacks["on_agent_response"]:
-                        self.callbacks["on_agent_response"]({
-                            "agent_name": agent_name,
-                            "agent_color": agent.color,
-                            "content": response["content"],
-                            "is_error": True
-                        })
+                    self._handle_agent_error(agent, response, e)
                 
                 # 记录Agent响应
                 round_responses.append(response)
                 
                 elapsed = time.time() - start_time
-                print(f"✅ {agent_name} 响应完成，耗时: {elapsed:.2f}秒，长度: {len(response['content'])} 字符")
+                print(f"✅ {agent.name} 响应完成，耗时: {elapsed:.2f}秒，长度: {len(response['content'])} 字符")
+            
+            return self._complete_round(round_responses)
+        except Exception as e:
+            return self._fail_round(round_responses, e)
+    
+    async def next_round_async(self):
+        """
+        next_round 的异步版本，通过异步客户端执行各个Agent
+        
+        同一个事件循环可以同时驱动多个会话的 next_round_async，不需要为每个会话占用一个线程。
+        注册的 on_agent_response 回调可以是普通函数或协程函数。
+        
+        返回:
+            当前轮次的对话结果，如果已达到最大轮次，则返回最终润色结果
+        """
+        # 事件循环结束前关闭本轮使用的异步连接，避免连接在事件循环关闭后才被丢弃
+        async with async_client_scope():
+            if self.current_round >= self.max_rounds:
+                print(f"🏁 已达到最大轮次 {self.max_rounds}，生成最终结果")
+                return await self.generate_final_text_async()
             
-            # 更新历史记录
-            round_result = {
-                "round": self.current_round + 1,
-                "responses": round_responses
-            }
+            round_label = f"第 {self.current_round + 1} 轮"
+            self._start_memory_round()
+            start_time = time.time()
+            with start_span(self.config, "round", parent=self.job_span, round=self.current_round + 1,
+                            round_mode=self.round_mode) as round_span:
+                with collect_usage() as usage_records:
+                    if self.round_mode == "fanout":
+                        result = await self._run_fanout_round_async()
+                    elif self.round_mode == "dag":
+                        result = await self._run_dag_round_async()
+                    else:
+                        result = await self._run_sequential_round_async()
+                result["usage"] = self._summarize_usage(usage_records, round_label)
+                self._trace_result(round_span, result)
+            ROUNDS.inc(round_mode=self.round_mode, outcome="error" if result.get("error") else "ok")
+            ROUND_DURATION.observe(time.time() - start_time, round_mode=self.round_mode)
+            return result
+    
+    async def _run_sequential_round_async(self):
+        """
+        _run_sequential_round 的异步版本
+        
+        返回:
+            当前轮次的对话结果
+        """
+        print(f"🔄 开始第 {self.current_round + 1} 轮对话（异步）...")
+        round_responses = []
+        
+        try:
+            current_text = self.original_text
             
-            self.history.append(round_result)
-            self.current_round += 1
+            for agent in self.async_agents:
+                print(f"🤖 正在处理: {agent.name}")
+                start_time = time.time()
+                response = self._create_agent_response(agent)
+                current_context = self._get_conversation_context(round_responses, current_text)
+                
+                try:
+                    agent_response = await self._generate_agent_response_async(
+                        agent,
+                        current_text,
+                        self.reference_data,
+                        current_context,
+                        callback=self._make_agent_callback(agent, response),
+                        reasoning_callback=self._make_reasoning_callback(agent, response)
+                    )
+                    current_text = self._handle_agent_output(agent, response, agent_response, current_text)
+                except Exception as e:
+                    notification = self._handle_agent_error(agent, response, e)
+                    if inspect.isawaitable(notification):
+                        await notification
+                
+                round_responses.append(response)
+                
+                elapsed = time.time() - start_time
+                print(f"✅ {agent.name} 响应完成，耗时: {elapsed:.2f}秒，长度: {len(response['content'])} 字符")
             
-            print(f"🎉 第 {self.current_round} 轮对话完成，共 {len(round_responses)} 个响应")
-            return round_result
+            return self._complete_round(round_responses)
         except Exception as e:
-            import traceback
-            print(f"❌ 对话过程中出错: {str(e)}")
-            traceback.print_exc()
+            return self._fail_round(round_responses, e)
+    
+    def _run_fanout_round(self):
+        """
+        扇出模式：除综合评审员外的专家在线程池中并行分析同一篇文章，
+        综合评审员再根据各专家的修改方案合并出本轮的文章
+        
+        一轮的耗时约为两次Agent调用，而不是所有Agent依次调用的总和
+        
+        返回:
+            当前轮次的对话结果
+        """
+        print(f"🔄 开始第 {self.current_round + 1} 轮对话（扇出模式）...")
+        experts, reviewer = self._split_reviewer(self.agents)
+        round_responses = []
+        
+        try:
+            current_text = self.original_text
+            context = self._get_conversation_context([], current_text)
+            
+            start_time = time.time()
+            max_workers = max(1, min(len(experts), self.max_parallel_agents))
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # 每个任务在当前上下文的副本中执行，使用量收集等上下文变量在线程中同样生效
+                futures = [
+                    executor.submit(
+                        contextvars.copy_context().run,
+                        self._execute_agent_task, agent, current_text, self.reference_data, context, True
+                    )
+                    for agent in experts
+                ]
+                round_responses = [future.result() for future in futures]
+            print(f"⚡ {len(experts)} 位专家并行完成，耗时: {time.time() - start_time:.2f}秒")
+            
+            if reviewer:
+                merge_context = self._get_fanout_context(context, round_responses, current_text)
+                round_responses.append(
+                    self._execute_agent_task(reviewer, current_text, self.reference_data, merge_context, True)
+                )
+            
+            return self._complete_round(round_responses)
+        except Exception as e:
+            return self._fail_round(round_responses, e)
+    
+    async def _run_fanout_round_async(self):
+        """
+        _run_fanout_round 的异步版本，各专家在同一个事件循环中并发执行
+        
+        返回:
+            当前轮次的对话结果
+        """
+        print(f"🔄 开始第 {self.current_round + 1} 轮对话（扇出模式，异步）...")
+        experts, reviewer = self._split_reviewer(self.async_agents)
+        round_responses = []
+        
+        try:
+            current_text = self.original_text
+            context = self._get_conversation_context([], current_text)
+            
+            start_time = time.time()
+            semaphore = asyncio.Semaphore(max(1, self.max_parallel_agents))
+            
+            async def run_expert(agent):
+                async with semaphore:
+                    return await self._execute_agent_task_async(agent, current_text, self.reference_data, context)
+            
+            round_responses = list(await asyncio.gather(*[run_expert(agent) for agent in experts]))
+            print(f"⚡ {len(experts)} 位专家并行完成，耗时: {time.time() - start_time:.2f}秒")
+            
+            if reviewer:
+                merge_context = self._get_fanout_context(context, round_responses, current_text)
+                round_responses.append(
+                    await self._execute_agent_task_async(reviewer, current_text, self.reference_data, merge_context)
+                )
+            
+            return self._complete_round(round_responses)
+        except Exception as e:
+            return self._fail_round(round_responses, e)
+    
+    def _run_dag_round(self):
+        """
+        依赖图模式：按各Agent声明的 depends_on 调度，依赖全部完成的Agent立即在线程池中开始执行
+        
+        返回:
+            当前轮次的对话结果，包含调度报告（schedule）
+        """
+        print(f"🔄 开始第 {self.current_round + 1} 轮对话（依赖图模式）...")
+        agents = {agent.name: agent for agent in self.agents}
+        round_responses = []
+        
+        try:
+            current_text = self.original_text
+            context = self._get_conversation_context([], current_text)
+            
+            def execute(name, upstream):
+                text, agent_context = self._prepare_dag_input(upstream, current_text, context)
+                return self._execute_agent_task(agents[name], text, self.reference_data, agent_context, True)
+            
+            round_responses, report = self.scheduler.run(execute)
+            return self._complete_dag_round(round_responses, report)
+        except Exception as e:
+            return self._fail_round(round_responses, e)
+    
+    async def _run_dag_round_async(self):
+        """
+        _run_dag_round 的异步版本
+        
+        返回:
+            当前轮次的对话结果，包含调度报告（schedule）
+        """
+        print(f"🔄 开始第 {self.current_round + 1} 轮对话（依赖图模式，异步）...")
+        agents = {agent.name: agent for agent in self.async_agents}
+        round_responses = []
+        
+        try:
+            current_text = self.original_text
+            context = self._get_conversation_context([], current_text)
+            
+            async def execute(name, upstream):
+                text, agent_context = self._prepare_dag_input(upstream, current_text, context)
+                return await self._execute_agent_task_async(agents[name], text, self.reference_data, agent_context)
+            
+            round_responses, report = await self.scheduler.run_async(execute)
+            return self._complete_dag_round(round_responses, report)
+        except Exception as e:
+            return self._fail_round(round_responses, e)
+    
+    def _prepare_dag_input(self, upstream, round_text, context):
+        """
+        根据上游Agent的输出确定一个Agent的输入文章和上下文
+        
+        没有上游时使用本轮的输入文章；只有一个上游时沿用串行模式的做法，以其修改稿作为输入；
+        有多个上游时与扇出模式的综合评审员相同，在本轮输入文章的基础上合并各上游的修改方案
+        
+        参数:
+            upstream: 上游Agent的响应列表
+            round_text: 本轮的输入文章
+            context: 之前轮次的对话上下文
+            
+        返回:
+            (输入文章, 对话上下文)
+        """
+        if not upstream:
+            return round_text, context
+        if len(upstream) == 1:
+            _, article = split_agent_output(upstream[0]["content"])
+            text = article or round_text
+            return text, self._get_conversation_context(upstream, text)
+        return round_text, self._get_fanout_context(context, upstream, round_text)
+    
+    def _complete_dag_round(self, round_responses, report):
+        """
+        输出关键路径并记录本轮结果
+        """
+        print(f"🧭 第 {self.current_round + 1} 轮{format_critical_path(report)}，总耗时 {report['total']:.2f}秒")
+        round_result = self._complete_round(round_responses)
+        round_result["schedule"] = report
+        return round_result
+    
+    def _split_reviewer(self, agents):
+        """
+        将Agent分为并行执行的专家和负责合并的综合评审员
+        
+        返回:
+            (专家列表, 综合评审员)，没有综合评审员时为None
+        """
+        experts = []
+        reviewer = None
+        for agent in agents:
+            if isinstance(getattr(agent, "agent", agent), ComprehensiveReviewer):
+                reviewer = agent
+            else:
+                experts.append(agent)
+        return experts, reviewer
+    
+    def _get_fanout_context(self, context, expert_responses, current_text):
+        """
+        为综合评审员组装合并用的上下文：之前轮次的上下文加上本轮各专家的修改方案
+        
+        各专家的修改稿以相对本轮文章的差异给出，启用上下文管理器时每个方案平分token预算
+        
+        参数:
+            context: 之前轮次的对话上下文
+            expert_responses: 本轮各专家的响应
+            current_text: 本轮各专家共同的输入文章
+            
+        返回:
+            综合评审员的对话上下文
+        """
+        proposals = "\n本轮各位专家基于同一篇文章分别给出了修改方案，请综合取舍，合并为一篇文章：\n"
+        share = self.context_manager.budget_tokens // len(expert_responses) if self.context_manager and expert_responses else None
+        for response in expert_responses:
+            proposal = compact_agent_output(response["content"], current_text, "diff")
+            if share:
+                proposal = fit_to_tokens(proposal, share)
+            proposals += f"\n{response['agent_name']}: {proposal}\n"
+        return context + proposals
+    
+    def _create_agent_response(self, agent):
+        """
+        创建Agent的响应记录
+        """
+        return {
+            "agent_name": agent.name,
+            "agent_color": agent.color,
+            "content": ""
+        }
+    
+    def _generate_agent_response(self, agent, text, reference_data, context, stream=False, callback=None,
+                                 reasoning_callback=None):
+        """
+        调用Agent生成响应，文章超过分片阈值时分片并行润色
+        
+        参数与 Agent.generate_response 相同，callback 的形式为 callback(agent_name, chunk)。
+        分片润色时各分片的推理过程交错到达，没有单独显示的意义，不传递 reasoning_callback；
+        各分片不单独写入记忆，合并后的润色建议作为该Agent本轮的一条记忆记录
+        
+        返回:
+            Agent的完整输出
+        """
+        with attribute_usage(agent.name), self._track_agent(agent, text):
+            if not self.sharded_polisher.should_shard(text):
+                return agent.generate_response(
+                    text, reference_data, context, stream=stream, callback=callback, reasoning_callback=reasoning_callback
+                )
+        
+            def generate(shard_text, shard_context, shard_callback):
+                return agent.generate_response(
+                    shard_text,
+                    reference_data,
+                    shard_context,
+                    stream=stream,
+                    callback=(lambda name, chunk: shard_callback(chunk)) if shard_callback else None,
+                    remember=False
+                )
+        
+            output = self.sharded_polisher.polish(
+                generate,
+                text,
+                context,
+                create_style_brief(reference_data),
+                callback=(lambda chunk: callback(agent.name, chunk)) if callback else None
+            )
+            agent.memory.add(output)
+            return output
+    
+    async def _generate_agent_response_async(self, agent, text, reference_data, context, callback=None,
+                                             reasoning_callback=None):
+        """
+        _generate_agent_response 的异步版本，始终使用流式输出
+        """
+        with attribute_usage(agent.name), self._track_agent(agent, text):
+            if not self.sharded_polisher.should_shard(text):
+                return await agent.generate_response(
+                    text, reference_data, context, stream=True, callback=callback, reasoning_callback=reasoning_callback
+                )
+        
+            async def generate(shard_text, shard_context, shard_callback):
+                return await agent.generate_response(
+                    shard_text,
+                    reference_data,
+                    shard_context,
+                    stream=True,
+                    callback=(lambda name, chunk: shard_callback(chunk)) if shard_callback else None,
+                    remember=False
+                )
+        
+            output = await self.sharded_polisher.polish_async(
+                generate,
+                text,
+                context,
+                create_style_brief(reference_data),
+                callback=(lambda chunk: callback(agent.name, chunk)) if callback else None
+            )
+            agent.memory.add(output)
+            return output
+    
+    @contextmanager
+    def _track_agent(self, agent, text):
+        """
+        追踪一个Agent在本轮中的完整执行（包括分片润色的各个分片），其各阶段的调用挂在该span下，
+        同时统计该Agent的耗时和成败
+        """
+        start_time = time.time()
+        outcome = "error"
+        try:
+            with start_span(
+                self.config,
+                "agent",
+                agent=agent.name,
+                round=self.current_round + 1,
+                input_chars=len(text),
+                sharded=self.sharded_polisher.should_shard(text)
+            ) as span:
+                yield span
+            outcome = "ok"
+        finally:
+            AGENT_RUNS.inc(agent=agent.name, outcome=outcome)
+            AGENT_DURATION.observe(time.time() - start_time, agent=agent.name)
+    
+    def _make_agent_callback(self, agent, response):
+        """
+        创建流式回调函数，累积内容并通知UI更新
+        
+        参数:
+            agent: 当前执行的Agent
+            response: 当前Agent的响应记录
             
-            # 返回错误响应而不是抛出异常，让程序能够继续运行
-            error_result = {
-                "round": self.current_round + 1,
-                "responses": round_responses,
-                "error": str(e)
-            }
+        返回:
+            回调函数 callback(agent_name, chunk)，返回值为UI回调的返回值
+        """
+        def agent_callback(name, chunk):
+            response["content"] += chunk
+            # 通知UI更新
+            return self._notify_agent_response({
+                "agent_name": name,
+                "agent_color": agent.color,
+                "content": chunk,
+                "is_chunk": True
+            })
+        
+        return agent_callback
+    
+    def _make_reasoning_callback(self, agent, response):
+        """
+        创建推理过程回调：推理内容累积在响应记录的 reasoning 字段中，不混入Agent的输出；
+        show_reasoning 开启时作为单独的通道（is_reasoning 为True）通知UI
+        
+        返回:
+            回调函数 callback(agent_name, chunk)
+        """
+        show_reasoning = get_reasoning_config(self.config)["show_reasoning"]
+        
+        def reasoning_callback(name, chunk):
+            response["reasoning"] = response.get("reasoning", "") + chunk
+            if show_reasoning:
+                return self._notify_agent_response({
+                    "agent_name": name,
+                    "agent_color": agent.color,
+                    "content": chunk,
+                    "is_chunk": True,
+                    "is_reasoning": True
+                })
+        
+        return reasoning_callback
+    
+    def _notify_agent_response(self, data):
+        """
+        调用注册的UI回调，扇出模式下多个Agent的通知串行执行
+        
+        返回:
+            UI回调的返回值，未注册回调时为None
+        """
+        if self.callbacks["on_agent_response"]:
+            with self._callback_lock:
+                return self.callbacks["on_agent_response"](data)
+    
+    def _handle_agent_output(self, agent, response, agent_response, current_text):
+        """
+        处理Agent的完整输出：保存结果文件，并提取修改后的文章
+        
+        参数:
+            agent: 当前执行的Agent
+            response: 当前Agent的响应记录
+            agent_response: Agent的完整输出
+            current_text: 当前待润色的文本
             
-            # 尝试增加当前轮次，以便下次调用能继续
-            self.current_round += 1
+        返回:
+            下一个Agent的输入文本
+        """
+        agent_name = agent.name
+        
+        # 更新响应内容
+        response["content"] = agent_response
+        
+        # 将结果保存为Markdown文件
+        output_dir = "agent_outputs"
+        os.makedirs(output_dir, exist_ok=True)
+        markdown_file = os.path.join(output_dir, f"round_{self.current_round + 1}_{agent_name}.md")
+        with open(markdown_file, "w", encoding="utf-8") as f:
+            f.write(f"# {agent_name} 的润色建议\n\n")
+            f.write(agent_response)
+        
+        print(f"✅ 已保存 {agent_name} 的处理结果到 {markdown_file}")
+        
+        # 提取修改后的文章内容（如果存在），作为下一个Agent的输入
+        modified_text = extract_article(agent_response)
+        if modified_text is not None:
+            print(f"🔄 从 {agent_name} 的输出中提取了修改后的文章内容: {len(modified_text)} 字符")
+            current_text = modified_text
+        else:
+            print(f"⚠️ {agent_name} 的输出中没有找到修改后的文章内容部分")
+        
+        return current_text
+    
+    def _handle_agent_error(self, agent, response, error):
+        """
+        记录Agent执行失败并通知UI
+        
+        返回:
+            UI回调的返回值（异步回调时为协程）
+        """
+        import traceback
+        print(f"❌ Agent {agent.name} 执行失败: {str(error)}")
+        traceback.print_exc()
+        # 添加错误响应
+        response["content"] = f"[处理过程中出错: {str(error)}]"
+        # 通知UI更新错误
+        return self._notify_agent_response({
+            "agent_name": agent.name,
+            "agent_color": agent.color,
+            "content": response["content"],
+            "is_error": True
+        })
+    
+    def _summarize_usage(self, usage_records, label):
+        """
+        汇总一组LLM调用的token用量，并输出提示词缓存命中情况
+        
+        参数:
+            usage_records: collect_usage 收集到的用量记录
+            label: 日志中显示的阶段名称
             
-            return error_result
+        返回:
+            用量汇总字典
+        """
+        prefill_rate = self.config["api"].get("prefill_tokens_per_second", DEFAULT_PREFILL_TOKENS_PER_SECOND)
+        summary = summarize_usage(usage_records, prefill_rate)
+        print(
+            f"📈 {label}用量: {summary['calls']} 次调用，提示词 {summary['prompt_tokens']} tokens"
+            f"（缓存命中率 {summary['cache_hit_rate'] * 100:.1f}%，预计节省 {summary['estimated_saved_seconds']:.2f}秒），"
+            f"输出 {summary['completion_tokens']} tokens"
+            + (f"，其中推理 {summary['reasoning_tokens']} tokens" if summary['reasoning_tokens'] else "")
+            + (f"，推理耗时 {summary['reasoning_seconds']:.1f}秒" if summary['reasoning_seconds'] else "")
+            + (f"，重试 {summary['retries']} 次" if summary['retries'] else "")
+            + f"，提示词组装 {summary['prompt_assembly_seconds'] * 1000:.1f}毫秒"
+        )
+        return summary
+    
+    def _trace_result(self, span, result):
+        """
+        把一轮（或最终润色）的用量汇总写入调用追踪span，本轮出错时标记为失败
+        """
+        usage = result["usage"]
+        span.set_attributes(
+            calls=usage["calls"],
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            cache_hit_rate=usage["cache_hit_rate"],
+            retries=usage["retries"]
+        )
+        if result.get("error"):
+            span.record_error(result["error"])
+    
+    def _complete_job(self, result):
+        """
+        生成最终结果后结束本次润色任务
+        """
+        self.job_span.set_attributes(
+            rounds=len(self.history),
+            final_chars=len(result["final_text"])
+        )
+        self._end_job("completed")
+    
+    def _end_job(self, outcome, error=None):
+        """
+        结束当前润色任务的span并统计结果，没有进行中的任务时不做任何事
+
+        参数:
+            outcome: "completed"、"error" 或 "abandoned"（没有生成最终结果就被新任务取代）
+            error: 任务失败时的异常
+        """
+        if self.job_start_time is None:
+            return
+        JOBS_FINISHED.inc(outcome=outcome)
+        if outcome == "completed":
+            JOB_DURATION.observe(time.time() - self.job_start_time)
+        self.job_start_time = None
+        if error is not None:
+            self.job_span.record_error(error)
+        self.job_span.end(status="abandoned" if outcome == "abandoned" else None)
+    
+    def _complete_round(self, round_responses):
+        """
+        记录本轮结果并推进轮次
+        """
+        round_result = {
+            "round": self.current_round + 1,
+            "responses": round_responses
+        }
+        
+        self.history.append(round_result)
+        self.current_round += 1
+        
+        print(f"🎉 第 {self.current_round} 轮对话完成，共 {len(round_responses)} 个响应")
+        return round_result
+    
+    def _fail_round(self, round_responses, error):
+        """
+        本轮整体出错时返回错误结果而不是抛出异常，让程序能够继续运行
+        """
+        import traceback
+        print(f"❌ 对话过程中出错: {str(error)}")
+        traceback.print_exc()
+        
+        error_result = {
+            "round": self.current_round + 1,
+            "responses": round_responses,
+            "error": str(error)
+        }
+        
+        # 尝试增加当前轮次，以便下次调用能继续
+        self.current_round += 1
+        
+        return error_result
     
     def _execute_agent_task(self, agent, text, reference_data, context, use_stream=False):
         """
-        执行单个Agent任务的辅助函数
+        执行单个Agent任务的辅助函数，扇出模式下在线程池中并发调用
         
         参数:
             agent: Agent对象
@@ -254,64 +862,69 @@ class Conversation:
         print(f"🤖 请求 {agent_name} 生成响应...")
         start_time = time.time()
         
-        # 创建中间结果，用于流式输出时记录
-        result = {
-            "agent_name": agent_name,
-            "agent_color": agent.color,
-            "content": ""
-        }
-        
-        # 流式输出的回调函数
-        def agent_callback(agent_name, chunk):
-            result["content"] += chunk
-            
-            # 如果已注册回调函数，通知UI更新
-            if self.callbacks["on_agent_response"]:
-                self.callbacks["on_agent_response"]({
-                    "agent_name": agent_name,
-                    "agent_color": agent.color,
-                    "content": chunk,
-                    "is_chunk": True  # 标记这是一个流式块
-                })
+        # 创建响应记录，用于流式输出时累积内容
+        result = self._create_agent_response(agent)
         
         try:
             # 调用Agent生成响应，根据需要使用流式输出
             if use_stream:
-                response = agent.generate_response(
+                response = self._generate_agent_response(
+                    agent,
                     text, 
                     reference_data, 
                     context,
                     stream=True,
-                    callback=agent_callback
+                    callback=self._make_agent_callback(agent, result),
+                    reasoning_callback=self._make_reasoning_callback(agent, result)
                 )
             else:
-                response = agent.generate_response(text, reference_data, context)
-                result["content"] = response
+                response = self._generate_agent_response(
+                    agent,
+                    text,
+                    reference_data,
+                    context,
+                    reasoning_callback=self._make_reasoning_callback(agent, result)
+                )
+            self._handle_agent_output(agent, result, response, text)
             
-            elapsed = time.time() - start_time
-            print(f"✅ {agent_name} 响应完成，耗时: {elapsed:.2f}秒，长度: {len(result['content'])} 字符")
-        
+            # 如果未使用流式输出，通知UI完整结果
+            if not use_stream:
+                self._notify_agent_response(result)
         except Exception as e:
-            import traceback
-            print(f"❌ Agent {agent_name} 执行出错: {str(e)}")
-            traceback.print_exc()
-            
-            # 出错时返回错误信息
-            result["content"] = f"[生成过程中出错: {str(e)}]"
-            
-            # 如果已注册回调函数，通知UI更新错误信息
-            if self.callbacks["on_agent_response"]:
-                self.callbacks["on_agent_response"]({
-                    "agent_name": agent_name,
-                    "agent_color": agent.color,
-                    "content": result["content"],
-                    "is_error": True
-                })
+            self._handle_agent_error(agent, result, e)
         
-        # 如果未使用流式输出但有回调函数，通知UI完整结果
-        if not use_stream and self.callbacks["on_agent_response"]:
-            self.callbacks["on_agent_response"](result)
+        elapsed = time.time() - start_time
+        print(f"✅ {agent_name} 响应完成，耗时: {elapsed:.2f}秒，长度: {len(result['content'])} 字符")
+        return result
+    
+    async def _execute_agent_task_async(self, agent, text, reference_data, context):
+        """
+        _execute_agent_task 的异步版本，始终使用流式输出
+        
+        返回:
+            格式化的Agent响应字典
+        """
+        print(f"🤖 请求 {agent.name} 生成响应...")
+        start_time = time.time()
+        result = self._create_agent_response(agent)
+        
+        try:
+            response = await self._generate_agent_response_async(
+                agent,
+                text,
+                reference_data,
+                context,
+                callback=self._make_agent_callback(agent, result),
+                reasoning_callback=self._make_reasoning_callback(agent, result)
+            )
+            self._handle_agent_output(agent, result, response, text)
+        except Exception as e:
+            notification = self._handle_agent_error(agent, result, e)
+            if inspect.isawaitable(notification):
+                await notification
         
+        elapsed = time.time() - start_time
+        print(f"✅ {agent.name} 响应完成，耗时: {elapsed:.2f}秒，长度: {len(result['content'])} 字符")
         return result
     
     def generate_final_text(self):
@@ -324,86 +937,203 @@ class Conversation:
         print("🏆 生成最终润色结果...")
         
         try:
-            # 收集所有Agent的建议
-            expert_suggestions = ""
-            for round_data in self.history:
-                expert_suggestions += f"\n轮次 {round_data['round']}:\n"
-                for response in round_data["responses"]:
-                    expert_suggestions += f"{response['agent_name']}: {response['content']}\n"
-            
-            print(f"📋 汇总了 {len(self.history)} 轮对话的建议")
+            # 收集所有Agent的建议，分片润色时最新修改稿按分片另行附上
+            sharded = self.sharded_polisher.should_shard(self.original_text)
+            expert_suggestions = self._collect_expert_suggestions(include_article=not sharded)
             
             # 使用综合评审员生成最终文章
             reviewer = self.agents[-1]
             print(f"🤖 请求 {reviewer.name} 生成最终文章...")
             start_time = time.time()
             
-            self.final_text = reviewer.generate_final_text(
-                self.original_text,
-                expert_suggestions,
-                self.reference_data.get("style_analysis", "")
-            )
-            
-            elapsed = time.time() - start_time
-            print(f"✅ 最终文章生成完成，耗时: {elapsed:.2f}秒，长度: {len(self.final_text)} 字符")
-            
-            # 确保输出目录存在
-            output_dir = "agent_outputs"
-            os.makedirs(output_dir, exist_ok=True)
-            
-            # 将最终结果保存为文件
-            final_file = os.path.join(output_dir, "final_result.md")
-            with open(final_file, "w", encoding="utf-8") as f:
-                f.write(self.final_text)
-            
-            print(f"💾 已保存最终润色结果到 {final_file}")
-            
-            # 检查是否包含了所需的两个部分
-            if "# 综合评审员的润色建议" not in self.final_text or "# 最终润色结果" not in self.final_text:
-                print("⚠️ 警告: 最终结果可能格式不正确，缺少必要的部分")
+            with start_span(self.config, "final", parent=self.job_span, agent=reviewer.name) as final_span:
+                with collect_usage() as usage_records, attribute_usage(reviewer.name):
+                    style_analysis = self.reference_data.get("style_analysis", "")
+                    if sharded:
+                        final_text = self.sharded_polisher.polish(
+                            lambda shard_text, shard_suggestions, _: reviewer.generate_final_text(
+                                shard_text, shard_suggestions, style_analysis
+                            ),
+                            self.original_text,
+                            expert_suggestions,
+                            marker=FINAL_RESULT_MARKER,
+                            article=find_latest_article(self.history)
+                        )
+                    else:
+                        final_text = reviewer.generate_final_text(
+                            self.original_text,
+                            expert_suggestions,
+                            style_analysis
+                        )
                 
-                # 如果格式不正确，尝试修复
-                if "# 综合评审员的润色建议" not in self.final_text and "# 最终润色结果" not in self.final_text:
-                    # 两个部分都缺失，创建一个基本结构
-                    fixed_text = f"# 综合评审员的润色建议\n\n[综合建议未正确格式化]\n\n# 最终润色结果\n\n{self.final_text}"
-                    self.final_text = fixed_text
-                elif "# 综合评审员的润色建议" in self.final_text and "# 最终润色结果" not in self.final_text:
-                    # 缺少最终结果部分
-                    parts = self.final_text.split("# 综合评审员的润色建议")
-                    suggestions = parts[1].strip() if len(parts) > 1 else ""
-                    fixed_text = f"# 综合评审员的润色建议\n\n{suggestions}\n\n# 最终润色结果\n\n{self.original_text}"
-                    self.final_text = fixed_text
+                result = self._finalize_text(final_text, start_time)
+                result["usage"] = self._summarize_usage(usage_records, "最终润色")
+                self._trace_result(final_span, result)
+            self._complete_job(result)
+            return result
+        except Exception as e:
+            import traceback
+            self._end_job("error", e)
+            print(f"❌ 生成最终文章时出错: {str(e)}")
+            traceback.print_exc()
+            raise
+    
+    async def generate_final_text_async(self):
+        """
+        generate_final_text 的异步版本
+        
+        返回:
+            最终润色后的文章和对话历史
+        """
+        print("🏆 生成最终润色结果（异步）...")
+        
+        try:
+            sharded = self.sharded_polisher.should_shard(self.original_text)
+            expert_suggestions = self._collect_expert_suggestions(include_article=not sharded)
             
-            # 标记为最终结果
-            result = {
-                "final_text": self.final_text,
-                "history": self.history,
-                "is_final": True
-            }
+            reviewer = self.async_agents[-1]
+            print(f"🤖 请求 {reviewer.name} 生成最终文章...")
+            start_time = time.time()
             
-            print("🎉 对话流程全部完成")
+            with start_span(self.config, "final", parent=self.job_span, agent=reviewer.name) as final_span:
+                with collect_usage() as usage_records, attribute_usage(reviewer.name):
+                    style_analysis = self.reference_data.get("style_analysis", "")
+                    if sharded:
+                        final_text = await self.sharded_polisher.polish_async(
+                            lambda shard_text, shard_suggestions, _: reviewer.generate_final_text(
+                                shard_text, shard_suggestions, style_analysis
+                            ),
+                            self.original_text,
+                            expert_suggestions,
+                            marker=FINAL_RESULT_MARKER,
+                            article=find_latest_article(self.history)
+                        )
+                    else:
+                        final_text = await reviewer.generate_final_text(
+                            self.original_text,
+                            expert_suggestions,
+                            style_analysis
+                        )
+                
+                result = self._finalize_text(final_text, start_time)
+                result["usage"] = self._summarize_usage(usage_records, "最终润色")
+                self._trace_result(final_span, result)
+            self._complete_job(result)
             return result
         except Exception as e:
             import traceback
+            self._end_job("error", e)
             print(f"❌ 生成最终文章时出错: {str(e)}")
             traceback.print_exc()
             raise
     
-    def _get_conversation_context(self):
+    def _collect_expert_suggestions(self, include_article=True):
+        """
+        汇总所有轮次中各Agent的建议，启用上下文管理器时同样受token预算约束
+        
+        参数:
+            include_article: 是否包含修改稿，分片润色时修改稿按分片另行附上，这里只汇总润色建议
+        """
+        if self.context_manager:
+            print(f"📋 汇总了 {len(self.history)} 轮对话的建议")
+            return self.context_manager.build_context(self.history, include_article=include_article)
+        
+        expert_suggestions = ""
+        for round_data in self.history:
+            expert_suggestions += f"\n轮次 {round_data['round']}:\n"
+            for response in round_data["responses"]:
+                content = response["content"] if include_article else split_agent_output(response["content"])[0]
+                expert_suggestions += f"{response['agent_name']}: {content}\n"
+        
+        print(f"📋 汇总了 {len(self.history)} 轮对话的建议")
+        return expert_suggestions
+    
+    def _finalize_text(self, final_text, start_time):
+        """
+        保存最终文章，必要时修复格式，并组装最终结果
+        
+        参数:
+            final_text: 综合评审员生成的最终文章
+            start_time: 开始生成的时间，用于统计耗时
+            
+        返回:
+            最终润色后的文章和对话历史
+        """
+        self.final_text = final_text
+        
+        elapsed = time.time() - start_time
+        print(f"✅ 最终文章生成完成，耗时: {elapsed:.2f}秒，长度: {len(self.final_text)} 字符")
+        
+        # 确保输出目录存在
+        output_dir = "agent_outputs"
+        os.makedirs(output_dir, exist_ok=True)
+        
+        # 将最终结果保存为文件
+        final_file = os.path.join(output_dir, "final_result.md")
+        with open(final_file, "w", encoding="utf-8") as f:
+            f.write(self.final_text)
+        
+        print(f"💾 已保存最终润色结果到 {final_file}")
+        
+        # 检查是否包含了所需的两个部分
+        if "# 综合评审员的润色建议" not in self.final_text or "# 最终润色结果" not in self.final_text:
+            print("⚠️ 警告: 最终结果可能格式不正确，缺少必要的部分")
+            
+            # 如果格式不正确，尝试修复
+            if "# 综合评审员的润色建议" not in self.final_text and "# 最终润色结果" not in self.final_text:
+                # 两个部分都缺失，创建一个基本结构
+                fixed_text = f"# 综合评审员的润色建议\n\n[综合建议未正确格式化]\n\n# 最终润色结果\n\n{self.final_text}"
+                self.final_text = fixed_text
+            elif "# 综合评审员的润色建议" in self.final_text and "# 最终润色结果" not in self.final_text:
+                # 缺少最终结果部分
+                parts = self.final_text.split("# 综合评审员的润色建议")
+                suggestions = parts[1].strip() if len(parts) > 1 else ""
+                fixed_text = f"# 综合评审员的润色建议\n\n{suggestions}\n\n# 最终润色结果\n\n{self.original_text}"
+                self.final_text = fixed_text
+        
+        # 标记为最终结果
+        result = {
+            "final_text": self.final_text,
+            "history": self.history,
+            "is_final": True
+        }
+        
+        print("🎉 对话流程全部完成")
+        return result
+    
+    def _get_conversation_context(self, round_responses=None, current_text=None):
         """
         获取当前对话上下文
         
+        启用上下文管理器时，上下文在token预算内组装：保留最新修改稿，
+        较早轮次压缩为按Agent的摘要；未启用时拼接全部历史。
+        当前待润色的文本已作为用户消息发送，上下文中的修改稿按 article_mode
+        替换为引用或相对当前文本的差异，避免同一篇文章重复出现
+        
+        参数:
+            round_responses: 当前轮次中已完成的Agent响应
+            current_text: 当前待润色的文本
+            
         返回:
             格式化的对话历史字符串
         """
-        context = ""
-        for round_data in self.history:
-            context += f"\n轮次 {round_data['round']}:\n"
-            for response in round_data["responses"]:
-                context += f"{response['agent_name']}: {response['content']}\n"
+        round_responses = round_responses or []
+        
+        if self.context_manager:
+            context = self.context_manager.build_context(self.history, round_responses, current_text)
+        else:
+            context = ""
+            for round_data in self.history:
+                context += f"\n轮次 {round_data['round']}:\n"
+                for response in round_data["responses"]:
+                    content = compact_agent_output(response['content'], current_text, self.article_mode)
+                    context += f"{response['agent_name']}: {content}\n"
+            for response in round_responses:
+                content = compact_agent_output(response['content'], current_text, self.article_mode)
+                context += f"\n{response['agent_name']}: {content}"
         
         context_length = len(context)
-        print(f"📜 获取对话上下文，长度: {context_length} 字符")
+        print(f"📜 获取对话上下文，长度: {context_length} 字符，约 {estimate_tokens(context)} tokens")
         return context
     
     def get_progress(self):
@@ -0,0 +1,281 @@
+import os
+import re
+import copy
+import json
+import time
+import tempfile
+import threading
+import contextvars
+from config import load_config, DRY_RUN_CONFIG, DEFAULT_PREFILL_TOKENS_PER_SECOND
+from context_manager import ARTICLE_MARKER, FINAL_RESULT_MARKER
+from conversation import Conversation
+from document_processor import DocumentProcessor
+from edit_script import EDITS_MARKER
+from llm_client import intercept_calls
+from prompt_templates import take_prompt_assembly_seconds
+from sharding import SEAM_DIVIDER, ShardedPolisher, split_into_shards
+from usage_stats import record_usage
+from utils import estimate_tokens, estimate_messages_tokens
+
+# 当前调用链正在处理的文章（两次请求模式下，第二次请求的消息中只有思考结果，没有文章）
+_current_text = contextvars.ContextVar("dry_run_current_text", default=None)
+
+# 模拟输出使用的填充字符，按中文字符估算token
+FILLER_CHAR = "文"
+
+# 最终润色提示词中原始文章所在的槽位（专家建议中也可能带有文章，不在其中查找）
+ORIGINAL_TEXT_SLOT = re.compile(r'原始文章：\n(.*?)\n\n专家建议：', re.DOTALL)
+
+
+def get_dry_run_config(config):
+    """
+    合并默认 dry run 配置和配置文件中的 dry run 配置
+    """
+    dry_run_config = dict(DRY_RUN_CONFIG)
+    dry_run_config.update(config.get("dry_run", {}))
+    return dry_run_config
+
+
+def _create_filler(tokens):
+    """
+    生成约 tokens 个token的填充文本
+    """
+    return FILLER_CHAR * max(1, int(tokens / estimate_tokens(FILLER_CHAR * 100) * 100))
+
+
+class DryRunEstimator:
+    """
+    dry run 调用拦截器：记录每次调用实际会发送的提示词，估算提示词和输出的token数及耗时，
+    并返回格式正确的模拟输出，使整个润色流程可以在不调用API的情况下走完
+
+    模拟输出中的修改稿与输入的文章相同，因此各轮的提示词长度按文章不变估算
+    """
+    def __init__(self, config, article):
+        """
+        参数:
+            config: 系统配置
+            article: 待润色的文章
+        """
+        self.settings = get_dry_run_config(config)
+        self.prefill_rate = config["api"].get("prefill_tokens_per_second", DEFAULT_PREFILL_TOKENS_PER_SECOND)
+        self.stage = ""
+        self.calls = []
+        self._lock = threading.Lock()
+
+        # 调用中可能出现的文章：全文，以及分片润色时的各个分片
+        texts = [article]
+        sharded_polisher = ShardedPolisher(config)
+        if sharded_polisher.should_shard(article):
+            texts += [shard["text"] for shard in split_into_shards(article, sharded_polisher.settings["shard_chars"])]
+        self.texts = sorted(texts, key=len, reverse=True)
+
+    def complete(self, model, messages, params):
+        """
+        估算一次调用并返回 (模拟输出, 模拟耗时秒数)
+        """
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        text = self._find_text(messages)
+        kind, content = self._create_output(system, messages[-1]["content"], text)
+
+        prompt_tokens = estimate_messages_tokens(messages)
+        completion_tokens = estimate_tokens(content)
+        latency = (
+            self.settings["request_overhead"]
+            + prompt_tokens / self.prefill_rate
+            + completion_tokens / self.settings["decode_tokens_per_second"]
+        )
+        agent = re.search(r'名为"(.+?)"', system)
+
+        with self._lock:
+            self.calls.append({
+                "index": len(self.calls) + 1,
+                "stage": self.stage,
+                "agent": agent.group(1) if agent else "",
+                "kind": kind,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "latency": latency
+            })
+
+        record_usage({
+            "model": model,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cache_hit_tokens": 0,
+            "cache_miss_tokens": prompt_tokens,
+            "elapsed": latency,
+            "first_token_latency": None,
+            "response_cache_hit": False,
+            "prompt_assembly_seconds": take_prompt_assembly_seconds()
+        })
+        return content, latency * self.settings["time_scale"]
+
+    def _find_text(self, messages):
+        """
+        找出本次调用处理的文章，消息中没有时沿用同一调用链上一次调用的文章
+
+        只在文章所在的位置查找：最后一条用户消息和最终润色提示词中的原始文章槽位。
+        上下文和专家建议中可能带有整篇文章或其他分片，不能据此判断。
+        优先取与该位置完全相同的文章，其次取该位置中包含的最长的文章
+        """
+        sources = [messages[-1]["content"]] if messages and messages[-1]["role"] == "user" else []
+        if messages and messages[0]["role"] == "system":
+            sources += ORIGINAL_TEXT_SLOT.findall(messages[0]["content"])
+
+        for source in sources:
+            text = next((text for text in self.texts if text.strip() == source.strip()), None)
+            text = text or next((text for text in self.texts if text in source), None)
+            if text:
+                _current_text.set(text)
+                return text
+        return _current_text.get() or self.texts[-1]
+
+    def _create_output(self, system, user_content, text):
+        """
+        按提示词要求的输出格式生成模拟输出
+
+        返回:
+            (调用类型, 模拟输出)
+        """
+        heading = re.search(r'^\s*(#[^\n]*润色建议)\s*$', system, re.MULTILINE)
+        suggestions = (heading.group(1) if heading else "# 润色建议") + "\n" + _create_filler(self.settings["suggestion_tokens"])
+        if SEAM_DIVIDER in system:
+            return "seam", user_content
+        if FINAL_RESULT_MARKER in system:
+            return "final", f"{suggestions}\n\n{FINAL_RESULT_MARKER}\n{text}"
+        if EDITS_MARKER in system:
+            # 锚点为空的修改操作会被忽略，文章保持不变，只按比例模拟输出长度
+            edits = [{"anchor": "", "replacement": _create_filler(estimate_tokens(text) * self.settings["edit_ratio"])}]
+            return "edits", f"{suggestions}\n\n{EDITS_MARKER}\n{json.dumps(edits, ensure_ascii=False)}"
+        if ARTICLE_MARKER in system:
+            return "article", f"{suggestions}\n\n{ARTICLE_MARKER}\n{text}"
+        return "analysis", _create_filler(self.settings["thinking_tokens"])
+
+    def build_report(self, elapsed_by_stage):
+        """
+        汇总估算结果
+
+        参数:
+            elapsed_by_stage: 各阶段模拟运行的实际耗时（秒），按 time_scale 还原为预计耗时
+
+        返回:
+            报告字典，包括每次调用的估算、各阶段小计和总计
+        """
+        time_scale = self.settings["time_scale"]
+        stages = []
+        for stage, elapsed in elapsed_by_stage.items():
+            calls = [call for call in self.calls if call["stage"] == stage]
+            stages.append({
+                "stage": stage,
+                "calls": len(calls),
+                "prompt_tokens": sum(call["prompt_tokens"] for call in calls),
+                "completion_tokens": sum(call["completion_tokens"] for call in calls),
+                "serial_seconds": sum(call["latency"] for call in calls),
+                "estimated_seconds": elapsed / time_scale if time_scale else sum(call["latency"] for call in calls)
+            })
+        return {
+            "calls": self.calls,
+            "stages": stages,
+            "total": {
+                "calls": len(self.calls),
+                "prompt_tokens": sum(stage["prompt_tokens"] for stage in stages),
+                "completion_tokens": sum(stage["completion_tokens"] for stage in stages),
+                "serial_seconds": sum(stage["serial_seconds"] for stage in stages),
+                "estimated_seconds": sum(stage["estimated_seconds"] for stage in stages)
+            }
+        }
+
+
+def run_dry_run(article, reference_text="", ref_type="article", max_rounds=None, config=None):
+    """
+    不调用API走完一次完整的润色流程，估算每次调用的提示词token、输出token和耗时
+
+    流程与界面中的润色相同：处理参考资料、按配置的轮次执行方式完成各轮润色、生成最终结果。
+    所有调用都被拦截，提示词按实际会发送的内容渲染；输出文件写在临时目录中，运行结束后删除
+
+    参数:
+        article: 待润色的文章
+        reference_text: 参考资料文本，为空时以原文作为参考
+        ref_type: 参考类型，"document"(文档) 或 "article"(文章)
+        max_rounds: 润色轮次，为None时使用配置中的轮次
+        config: 系统配置，为None时加载配置文件
+
+    返回:
+        估算报告
+    """
+    config = copy.deepcopy(config or load_config())
+    # 不会发出请求，但创建客户端需要非空的密钥
+    config["api"]["deepseek_key"] = config["api"]["deepseek_key"] or "dry-run"
+    # 被拦截的调用没有真实耗时，不写入调用追踪
+    config["tracing"] = dict(config.get("tracing", {}), enabled=False)
+    max_rounds = max_rounds or config["max_rounds"]
+
+    estimator = DryRunEstimator(config, article)
+    elapsed_by_stage = {}
+    work_dir = os.getcwd()
+
+    print(f"🧮 开始 dry run：文章 {len(article)} 字符，约 {estimate_tokens(article)} tokens，{max_rounds} 轮")
+    with tempfile.TemporaryDirectory() as temp_dir, intercept_calls(estimator):
+        conversation = Conversation(config)
+        os.chdir(temp_dir)
+        try:
+            references = {
+                "content": article,
+                "style_analysis": "未提供参考资料，将基于原始文章进行润色。",
+                "ref_type": "self"
+            }
+            if reference_text.strip():
+                estimator.stage = "参考资料分析"
+                start_time = time.time()
+                references = DocumentProcessor(config).process_reference_text(reference_text, ref_type)
+                references["ref_type"] = ref_type
+                elapsed_by_stage[estimator.stage] = time.time() - start_time
+
+            estimator.stage = "第 1 轮"
+            start_time = time.time()
+            result = conversation.start_conversation(article, references, max_rounds)
+            elapsed_by_stage[estimator.stage] = time.time() - start_time
+
+            while not result.get("is_final"):
+                if conversation.current_round >= conversation.max_rounds:
+                    estimator.stage = "最终润色"
+                else:
+                    estimator.stage = f"第 {conversation.current_round + 1} 轮"
+                start_time = time.time()
+                result = conversation.next_round()
+                elapsed_by_stage[estimator.stage] = time.time() - start_time
+        finally:
+            os.chdir(work_dir)
+
+    return estimator.build_report(elapsed_by_stage)
+
+
+def format_dry_run_report(report):
+    """
+    将估算报告格式化为便于阅读的文本
+    """
+    lines = ["", "🧮 dry run 估算结果", "", "每次调用:"]
+    for call in report["calls"]:
+        agent = call["agent"] or "-"
+        lines.append(
+            f"  #{call['index']:<3} {call['stage']:<8} {agent:<8} {call['kind']:<8} "
+            f"提示词 {call['prompt_tokens']:>6} tokens  输出 {call['completion_tokens']:>6} tokens  "
+            f"约 {call['latency']:.1f}秒"
+        )
+
+    lines += ["", "各阶段:"]
+    for stage in report["stages"]:
+        lines.append(
+            f"  {stage['stage']:<8} {stage['calls']:>3} 次调用  提示词 {stage['prompt_tokens']:>7} tokens  "
+            f"输出 {stage['completion_tokens']:>7} tokens  约 {stage['estimated_seconds']:.1f}秒"
+            f"（串行 {stage['serial_seconds']:.1f}秒）"
+        )
+
+    total = report["total"]
+    lines += [
+        "",
+        f"合计: {total['calls']} 次调用，提示词 {total['prompt_tokens']} tokens，输出 {total['completion_tokens']} tokens，"
+        f"预计耗时 {total['estimated_seconds']:.1f}秒（全部串行 {total['serial_seconds']:.1f}秒）"
+    ]
+    return "\n".join(lines)
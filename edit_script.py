@@ -0,0 +1,156 @@
+import re
+import json
+import difflib
+from context_manager import ARTICLE_MARKER
+
+# edits 输出格式中修改操作部分的标题
+EDITS_MARKER = "# 修改操作"
+
+# 模糊匹配锚点时要求的最低相似度
+DEFAULT_MATCH_THRESHOLD = 0.8
+
+
+def parse_edits(content):
+    """
+    从Agent输出中解析修改操作
+
+    参数:
+        content: Agent的完整输出
+
+    返回:
+        (润色建议, 修改操作列表)，没有修改操作部分或无法解析时列表为None
+    """
+    if EDITS_MARKER not in content:
+        return content.strip(), None
+    suggestions, edits_text = content.split(EDITS_MARKER, 1)
+
+    # 兼容包在 ```json 代码块中或前后带有说明文字的输出
+    start = edits_text.find("[")
+    end = edits_text.rfind("]")
+    if start == -1 or end <= start:
+        return suggestions.strip(), None
+    try:
+        raw_edits = json.loads(edits_text[start:end + 1])
+    except json.JSONDecodeError:
+        return suggestions.strip(), None
+
+    edits = []
+    for edit in raw_edits:
+        if not isinstance(edit, dict) or not isinstance(edit.get("anchor"), str) or not edit["anchor"].strip():
+            continue
+        edits.append({
+            "anchor": edit["anchor"],
+            "replacement": str(edit.get("replacement") or ""),
+            "rationale": str(edit.get("rationale") or "")
+        })
+    return suggestions.strip(), edits
+
+
+def find_anchor(text, anchor, threshold=DEFAULT_MATCH_THRESHOLD):
+    """
+    在文章中定位锚点，先精确匹配，找不到时做模糊匹配
+
+    模糊匹配以文章和锚点的最长公共片段对齐出候选区间，再在区间两端的小范围内调整，
+    取与锚点相似度最高且不低于 threshold 的区间
+
+    参数:
+        text: 文章
+        anchor: 模型摘录的锚点文字
+        threshold: 最低相似度
+
+    返回:
+        (起始位置, 结束位置)，找不到时返回None
+    """
+    position = text.find(anchor)
+    if position != -1:
+        return position, position + len(anchor)
+
+    stripped = anchor.strip()
+    position = text.find(stripped)
+    if stripped and position != -1:
+        return position, position + len(stripped)
+
+    matcher = difflib.SequenceMatcher(None, text, stripped, autojunk=False)
+    match = matcher.find_longest_match(0, len(text), 0, len(stripped))
+    if match.size == 0:
+        return None
+
+    base_start = max(0, match.a - match.b)
+    base_end = min(len(text), base_start + len(stripped))
+    slack = max(2, len(stripped) // 10)
+
+    best = None
+    best_ratio = threshold
+    scorer = difflib.SequenceMatcher(None, autojunk=False)
+    scorer.set_seq2(stripped)
+    for start in range(max(0, base_start - slack), min(len(text), base_start + slack) + 1):
+        for end in range(max(start + 1, base_end - slack), min(len(text), base_end + slack) + 1):
+            scorer.set_seq1(text[start:end])
+            if scorer.real_quick_ratio() < best_ratio or scorer.quick_ratio() < best_ratio:
+                continue
+            ratio = scorer.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = (start, end), ratio
+    return best
+
+
+def apply_edits(text, edits, threshold=DEFAULT_MATCH_THRESHOLD):
+    """
+    把修改操作应用到文章上
+
+    所有锚点都在原文中定位，与前面已定位的修改重叠的操作会被跳过，然后从后向前替换，
+    保证前面的替换不会影响后面的位置
+
+    参数:
+        text: 当前文章
+        edits: 修改操作列表
+        threshold: 模糊匹配的最低相似度
+
+    返回:
+        (修改后的文章, 应用结果)，应用结果包含 applied（已应用的修改操作）和 failed（未能定位或重叠的修改操作），
+        均为修改操作在 edits 中的下标，锚点相同的多处修改也能分别对应
+    """
+    located = []
+    failed = []
+    for index, edit in enumerate(edits):
+        span = find_anchor(text, edit["anchor"], threshold)
+        if span is None or any(span[0] < end and start < span[1] for start, end, _ in located):
+            failed.append(index)
+            continue
+        located.append((span[0], span[1], index))
+
+    for start, end, index in sorted(located, key=lambda item: item[0], reverse=True):
+        text = text[:start] + edits[index]["replacement"] + text[end:]
+
+    return text, {"applied": sorted(index for _, _, index in located), "failed": failed}
+
+
+def apply_edit_output(content, text, threshold=DEFAULT_MATCH_THRESHOLD):
+    """
+    把 edits 格式的Agent输出转换为标准格式：润色建议、修改说明，以及应用修改后的完整文章
+
+    输出中没有可解析的修改操作时原样返回（例如模型仍然输出了完整文章）
+
+    参数:
+        content: Agent的完整输出
+        text: Agent收到的待润色文章
+
+    返回:
+        与 article 格式相同的输出
+    """
+    suggestions, edits = parse_edits(content)
+    if edits is None:
+        print("⚠️ 输出中没有可解析的修改操作，保留原始输出")
+        return content
+
+    new_text, result = apply_edits(text, edits, threshold)
+    print(f"✂️ 已应用 {len(result['applied'])}/{len(edits)} 处修改")
+    if result["failed"]:
+        anchors = "；".join(edits[index]["anchor"][:20] for index in result["failed"])
+        print(f"⚠️ 以下锚点未能定位或与其他修改重叠: {anchors}")
+
+    changes = "\n".join(
+        f"- 「{edit['anchor']}」→「{edit['replacement']}」" + (f"：{edit['rationale']}" if edit["rationale"] else "")
+        for edit in (edits[index] for index in result["applied"])
+    )
+    return f"{suggestions}\n\n修改说明：\n{changes}\n\n{ARTICLE_MARKER}\n{new_text}"
@@ -3,13 +3,18 @@ import threading
 from document_processor import DocumentProcessor
 from conversation import Conversation
 from config import load_config, update_mechanical_words
+from metrics import track_operation
 
 class Engine:
     """
     交互引擎 - 管理整个文章润色流程
     """
-    def __init__(self):
-        self.config = load_config()
+    def __init__(self, config=None):
+        """
+        参数:
+            config: 系统配置（可选），默认从配置文件加载；基准测试和压测用它指定后端
+        """
+        self.config = config or load_config()
         self.document_processor = DocumentProcessor(self.config)
         self.conversation = Conversation(self.config)
         self.reference_docs = {}
@@ -30,6 +35,7 @@ class Engine:
         # 同时注册到conversation对象
         self.conversation.register_callback("on_agent_response", callback_fn)
     
+    @track_operation("process_reference_documents")
     def process_reference_documents(self, file_paths, ref_type="document"):
         """
         处理参考文档或参考文章
@@ -69,6 +75,7 @@ class Engine:
             with self.lock:
                 self.processing = False
     
+    @track_operation("process_reference_text")
     def process_reference_text(self, text, ref_type="article"):
         """
         处理参考文本内容
@@ -108,6 +115,7 @@ class Engine:
             with self.lock:
                 self.processing = False
     
+    @track_operation("start_polishing")
     def start_polishing(self, original_text, max_rounds=None):
         """
         开始文章润色流程
@@ -123,6 +131,7 @@ class Engine:
             if self.processing:
                 return {
                     "success": False,
+                    "busy": True,
                     "message": "系统正在处理其他任务，请稍后再试"
                 }
             
@@ -200,6 +209,7 @@ class Engine:
             with self.lock:
                 self.processing = False
     
+    @track_operation("next_round")
     def next_round(self):
         """
         进行下一轮润色
@@ -211,6 +221,7 @@ class Engine:
             if self.processing:
                 return {
                     "success": False,
+                    "busy": True,
                     "message": "系统正在处理其他任务，请稍后再试"
                 }
             
@@ -1,9 +1,13 @@
 import os
 import gradio as gr
 from engine import Engine
-from utils import save_upload_file, format_round_result, count_words
+from utils import save_upload_file, format_round_result, count_words, render_agent_progress_html, render_progress_bar
 from config import load_config
 
+# 请求队列设置：同时处理的事件数和排队等待的事件数上限（load_test.py 按同样的设置模拟队列）
+QUEUE_CONCURRENCY_COUNT = 5
+QUEUE_MAX_SIZE = 20
+
 # 全局变量
 final_result_data = {
     "status": "idle",
@@ -30,7 +34,7 @@ def create_interface(config=None):
         config = load_config()
     
     # 创建引擎实例
-    engine = Engine()
+    engine = Engine(config)
     
     # 用于存储上传文件的路径
     reference_doc_paths = []
@@ -38,7 +42,7 @@ def create_interface(config=None):
     # 创建处理队列
     with gr.Blocks(title="LiteraSageAI", theme=gr.themes.Default()) as demo:
         # 启用队列功能，支持流式更新
-        demo.queue(concurrency_count=5, max_size=20)
+        demo.queue(concurrency_count=QUEUE_CONCURRENCY_COUNT, max_size=QUEUE_MAX_SIZE)
         
         # CSS样式
         css = """
@@ -57,6 +61,12 @@ def create_interface(config=None):
         .purple-bg { background-color: rgba(111, 66, 193, 0.1); border-left: 5px solid #6f42c1; }
         .red-bg { background-color: rgba(220, 53, 69, 0.1); border-left: 5px solid #dc3545; }
         .error-bg { background-color: rgba(220, 53, 69, 0.05); border: 1px dashed #dc3545; }
+        .agent-reasoning {
+            margin-bottom: 8px;
+            color: #6c757d;
+            font-size: 0.9em;
+            white-space: pre-wrap;
+        }
         .loading-spinner {
             display: inline-block;
             width: 15px;
@@ -261,18 +271,22 @@ def create_interface(config=None):
             content = data["content"]
             is_chunk = data.get("is_chunk", False)
             is_error = data.get("is_error", False)
+            is_reasoning = data.get("is_reasoning", False)
             
             # 更新Agent状态
             if agent_name not in agent_responses:
                 agent_responses[agent_name] = {
                     "color": agent_color,
                     "content": "",
+                    "reasoning": "",
                     "completed": False,
                     "error": False
                 }
             
-            # 更新内容
-            if is_chunk:
+            # 更新内容，推理模型的推理过程单独累积
+            if is_reasoning:
+                agent_responses[agent_name]["reasoning"] += content
+            elif is_chunk:
                 agent_responses[agent_name]["content"] += content
             else:
                 agent_responses[agent_name]["content"] = content
@@ -308,41 +322,7 @@ def create_interface(config=None):
             返回:
                 HTML字符串
             """
-            html = "<h3>当前润色进度</h3>"
-            
-            # 添加已响应的Agent
-            for agent_name, data in agent_responses.items():
-                color = data["color"]
-                content = data["content"]
-                completed = data["completed"]
-                is_error = data["error"]
-                
-                # 生成状态指示器
-                status_indicator = ""
-                if not completed:
-                    status_indicator = '<div class="loading-spinner"></div>'
-                
-                # 错误样式
-                extra_class = " error-bg" if is_error else ""
-                
-                html += f"""
-                <div class="agent-response {color}-bg{extra_class}">
-                    <div class="agent-name">{agent_name} {status_indicator}</div>
-                    <div>{content}</div>
-                </div>
-                """
-            
-            # 添加等待中的Agent
-            for agent_name in processing_agents:
-                if agent_name not in agent_responses:
-                    html += f"""
-                    <div class="agent-response" style="background-color: #f8f9fa; border-left: 5px solid #6c757d;">
-                        <div class="agent-name">{agent_name} <div class="loading-spinner"></div></div>
-                        <div>正在生成响应...</div>
-                    </div>
-                    """
-            
-            return html
+            return render_agent_progress_html(agent_responses, processing_agents)
         
         def calculate_progress_percentage():
             """
@@ -370,9 +350,7 @@ def create_interface(config=None):
             返回:
                 更新后的HTML字符串
             """
-            return f'<div style="width: 100%; height: 30px; background-color: #f3f3f3; border-radius: 5px; overflow: hidden; margin: 10px 0;">' \
-                   f'<div id="progress-bar" style="width: {percentage}%; height: 100%; background-color: #4CAF50; text-align: center; line-height: 30px; color: white;">{percentage}%</div>' \
-                   f'</div>'
+            return render_progress_bar(percentage)
         
         # 启动润色流程
         def start_polishing(text, max_rounds, style_analysis_text):
@@ -389,9 +367,8 @@ def create_interface(config=None):
             """
             nonlocal agent_responses, processing_agents, polishing_status
             
-            # 检查API密钥
-            current_config = load_config()
-            api_key = current_config["api"]["deepseek_key"]
+            # 检查API密钥（更新API设置时会保存配置并重新创建引擎，引擎的配置即为当前配置）
+            api_key = engine.config["api"]["deepseek_key"]
             
             if not api_key:
                 error_html = "<div style='padding: 15px; background-color: #ffebee; border-left: 5px solid #f44336; margin-bottom: 15px;'>" \
@@ -433,11 +410,12 @@ def create_interface(config=None):
             processing_agents = [agent.name for agent in engine.conversation.agents]
             polishing_status = "running"
             
-            # 注册回调函数
-            engine.register_agent_callback(lambda data: (
-                gr.update(value=on_agent_response(data)[0]),  # 更新对话显示
-                gr.update(value=on_agent_response(data)[1])   # 更新进度条
-            ))
+            # 注册回调函数，每段内容只处理一次（流式内容是累加的，重复处理会使内容重复）
+            def on_engine_response(data):
+                html, progress = on_agent_response(data)
+                return gr.update(value=html), gr.update(value=progress)
+            
+            engine.register_agent_callback(on_engine_response)
             
             # 启动润色流程
             try:
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from config import CACHE_CONFIG
+
+# 进程级缓存实例，按数据库路径区分
+_caches = {}
+_lock = threading.Lock()
+
+
+class ResponseCache:
+    """
+    基于SQLite的LLM响应缓存
+
+    以服务地址、模型、消息和采样参数的哈希作为键，保存完整回复、流式分块和推理模型的推理过程，
+    总大小超过上限时按最近最少使用（LRU）的顺序淘汰
+    """
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                content TEXT NOT NULL,
+                chunks TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses (last_access)")
+        # 早期版本的缓存文件没有 reasoning 列
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(responses)")]
+        if "reasoning" not in columns:
+            self._conn.execute("ALTER TABLE responses ADD COLUMN reasoning TEXT NOT NULL DEFAULT ''")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, messages, params=None, base_url=None):
+        """
+        计算请求的缓存键
+
+        参数:
+            model: 模型名称
+            messages: 消息列表
+            params: 采样参数（temperature、max_tokens等）
+            base_url: 服务地址，切换到其他兼容服务（例如本地模拟服务）后不会命中原服务的缓存
+
+        返回:
+            十六进制的SHA-256摘要
+        """
+        payload = json.dumps(
+            {"base_url": base_url, "model": model, "messages": messages, "params": params or {}},
+            ensure_ascii=False,
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        读取缓存条目，并刷新其最近访问时间
+
+        返回:
+            包含 content、chunks 和 reasoning 的字典，未命中时返回None
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, chunks, reasoning FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return {"content": row[0], "chunks": json.loads(row[1]), "reasoning": row[2]}
+
+    def put(self, key, content, chunks=None, reasoning=""):
+        """
+        写入缓存条目，写入后按LRU淘汰超出上限的条目
+
+        参数:
+            key: 缓存键
+            content: 完整回复文本
+            chunks: 流式输出的分块列表，非流式请求时为整段回复
+            reasoning: 推理模型的推理过程，命中缓存时一并回放
+        """
+        chunks = chunks or [content]
+        chunks_json = json.dumps(chunks, ensure_ascii=False)
+        size = len(content.encode("utf-8")) + len(chunks_json.encode("utf-8")) + len(reasoning.encode("utf-8"))
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, chunks, reasoning, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, content, chunks_json, reasoning, size, now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """
+        按最近访问时间从旧到新删除条目，直到总大小不超过上限
+        """
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        evicted = 0
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+
+        print(f"🧹 缓存超出上限，已淘汰 {evicted} 条最久未使用的响应")
+
+    def clear(self):
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def get_stats(self):
+        """
+        获取缓存统计信息
+        """
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "entries": entries,
+            "size_bytes": total,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+def get_cache_config(config):
+    """
+    合并默认缓存配置和配置文件中的缓存配置
+    """
+    cache_config = dict(CACHE_CONFIG)
+    cache_config.update(config.get("cache", {}))
+    return cache_config
+
+
+def get_response_cache(config):
+    """
+    获取进程内共享的响应缓存，缓存未启用时返回None
+
+    参数:
+        config: 系统配置，使用其中的 cache 字段
+
+    返回:
+        ResponseCache 实例或None
+    """
+    cache_config = get_cache_config(config)
+    if not cache_config["enabled"]:
+        return None
+
+    path = cache_config["path"]
+    with _lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = ResponseCache(path, cache_config["max_bytes"])
+            _caches[path] = cache
+        return cache
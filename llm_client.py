@@ -0,0 +1,956 @@
+import asyncio
+import contextlib
+import contextvars
+import inspect
+import random
+import time
+import threading
+import weakref
+from email.utils import parsedate_to_datetime
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+from config import POOL_CONFIG, RETRY_CONFIG, REASONING_CONFIG
+from llm_cache import get_response_cache, get_cache_config
+from usage_stats import extract_usage, record_usage, current_agent
+from prompt_templates import take_prompt_assembly_seconds
+from rate_limiter import get_rate_limiter, estimate_request_tokens
+from tracing import start_span, current_span, SPAN_KIND_CLIENT
+from metrics import (
+    observe_llm_call, LLM_IN_FLIGHT, LLM_REQUESTS, LLM_RETRIES, RATE_LIMIT_QUEUE, RATE_LIMIT_WAIT
+)
+
+# 调用拦截器，设置后请求不再发送到服务端（用于 dry run 等离线估算）
+_call_interceptor = contextvars.ContextVar("call_interceptor", default=None)
+
+# 进程级客户端注册表，按 (base_url, api_key) 区分
+_clients = {}
+_http_client = None
+_lock = threading.Lock()
+
+# 异步客户端注册表：异步连接绑定在事件循环上，因此每个事件循环各有一个连接池
+_async_registries = weakref.WeakKeyDictionary()
+# 每个事件循环中正在使用异步客户端的范围数，最后一个范围结束时关闭该事件循环的连接池
+_async_scopes = weakref.WeakKeyDictionary()
+
+# 值得重试的HTTP状态码（5xx之外）
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+# 流式输出中断后要求模型继续输出的提示
+RESUME_PROMPT = "你的回复在传输中断了。请紧接着上面已输出内容的最后一个字继续输出，不要重复已输出的内容，也不要添加任何说明。"
+
+# 进程级重试计数
+_retry_stats = {
+    "attempts": 0,
+    "retries": 0,
+    "rate_limited": 0,
+    "retry_after_honored": 0,
+    "resumed_streams": 0,
+    "stalls": 0,
+    "fallbacks": 0,
+    "exhausted": 0
+}
+
+
+class AttemptTimeoutError(Exception):
+    """
+    单次尝试超过 attempt_timeout 时抛出，会被重试
+    """
+    pass
+
+
+class StreamStallError(Exception):
+    """
+    流式输出在首个token之前或中途停滞超过设定时间时抛出，会被重试或交给备用模型
+    """
+    pass
+
+
+class _StreamWatchdog:
+    """
+    同步流式请求的看门狗线程
+
+    服务端排队时会持续发送keep-alive注释，连接上有数据但没有任何内容，
+    读超时不会触发。看门狗按内容到达的时间检查首token超时、停滞超时和单次尝试超时，
+    超时后关闭流，使阻塞在读取上的迭代以异常结束
+    """
+    def __init__(self, stream, retry_config):
+        self.stream = stream
+        self.first_token_timeout = retry_config["first_token_timeout"]
+        self.idle_timeout = retry_config["idle_timeout"]
+        self.attempt_timeout = retry_config["attempt_timeout"]
+        self.started_at = time.monotonic()
+        self.last_progress = None
+        self.error = None
+        self._stopped = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def progress(self, has_token):
+        """
+        收到一个分块时调用，has_token 表示分块中包含内容或推理内容
+        """
+        if has_token or self.last_progress is not None:
+            self.last_progress = time.monotonic()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(0.5):
+            self.error = self._check()
+            if self.error:
+                self.stream.close()
+                return
+
+    def _check(self):
+        """
+        检查是否超时，超时时返回对应的异常
+        """
+        now = time.monotonic()
+        if now - self.started_at > self.attempt_timeout:
+            return AttemptTimeoutError(f"单次尝试超过 {self.attempt_timeout} 秒")
+        if self.last_progress is None:
+            if now - self.started_at > self.first_token_timeout:
+                return StreamStallError(f"首个token超过 {self.first_token_timeout} 秒未到达")
+        elif now - self.last_progress > self.idle_timeout:
+            return StreamStallError(f"流式输出停滞超过 {self.idle_timeout} 秒")
+        return None
+
+
+def _get_pool_config(config):
+    """
+    合并默认连接池参数和配置中的连接池参数
+    """
+    pool_config = dict(POOL_CONFIG)
+    pool_config.update(config["api"].get("pool", {}))
+    return pool_config
+
+
+def _create_limits(config):
+    """
+    根据配置创建连接池限制
+    """
+    pool_config = _get_pool_config(config)
+    return httpx.Limits(
+        max_connections=pool_config["max_connections"],
+        max_keepalive_connections=pool_config["max_keepalive_connections"],
+        keepalive_expiry=pool_config["keepalive_expiry"]
+    )
+
+
+def _get_http_client(config):
+    """
+    获取进程内共享的HTTP连接池，首次调用时创建
+
+    所有OpenAI客户端共用这一个连接池，因此max_connections是整个进程的连接上限
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.Client(limits=_create_limits(config))
+        print(f"🔌 已创建共享连接池，最大连接数: {_get_pool_config(config)['max_connections']}")
+    return _http_client
+
+
+def get_client(config):
+    """
+    从注册表中借用一个OpenAI客户端，不存在时创建
+
+    参数:
+        config: 系统配置，使用其中的 deepseek_base_url 和 deepseek_key
+
+    返回:
+        与同一 base_url 和 api_key 的所有调用方共享的OpenAI客户端
+    """
+    base_url = config["api"]["deepseek_base_url"]
+    api_key = config["api"]["deepseek_key"]
+    key = (base_url, api_key)
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=_get_http_client(config),
+                max_retries=0
+            )
+            _clients[key] = client
+        return client
+
+
+def get_async_client(config):
+    """
+    获取当前事件循环中共享的AsyncOpenAI客户端，必须在协程中调用
+
+    参数:
+        config: 系统配置，使用其中的 deepseek_base_url 和 deepseek_key
+
+    返回:
+        与当前事件循环中同一 base_url 和 api_key 的所有调用方共享的AsyncOpenAI客户端
+    """
+    loop = asyncio.get_running_loop()
+    base_url = config["api"]["deepseek_base_url"]
+    api_key = config["api"]["deepseek_key"]
+    key = (base_url, api_key)
+
+    with _lock:
+        registry = _async_registries.get(loop)
+        if registry is None:
+            registry = {
+                "http_client": httpx.AsyncClient(limits=_create_limits(config)),
+                "clients": {}
+            }
+            _async_registries[loop] = registry
+
+        client = registry["clients"].get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=registry["http_client"],
+                max_retries=0
+            )
+            registry["clients"][key] = client
+        return client
+
+
+async def aclose_clients():
+    """
+    关闭当前事件循环的异步连接池，需要在事件循环结束前调用，否则连接不会被正常关闭
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        registry = _async_registries.pop(loop, None)
+    if registry is not None:
+        await registry["http_client"].aclose()
+
+
+@contextlib.asynccontextmanager
+async def async_client_scope():
+    """
+    在当前事件循环中使用异步客户端的范围，可以嵌套，也可以由同一事件循环中的多个会话同时进入；
+    最后一个范围结束时关闭该事件循环的连接池，之后再次使用时重新创建
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        _async_scopes[loop] = _async_scopes.get(loop, 0) + 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _async_scopes[loop] -= 1
+            last = _async_scopes[loop] == 0
+            if last:
+                del _async_scopes[loop]
+        if last:
+            await aclose_clients()
+
+
+def chat_completion(client, model, messages, stream=False, callback=None, params=None, config=None,
+                    reasoning_callback=None):
+    """
+    发送一次对话补全请求，返回完整的回复文本
+
+    每次调用的token用量（包括DeepSeek的提示词缓存命中情况）都会通过 usage_stats 记录。
+    限流、5xx、连接中断和超时按抖动的指数退避重试，遵守服务端的Retry-After；
+    流式输出中途断开时，把已收到的内容作为前文请求模型继续输出，回调不会收到重复内容
+
+    参数:
+        client: OpenAI客户端
+        model: 模型名称
+        messages: 消息列表
+        stream: 是否使用流式输出
+        callback: 流式输出时每收到一段内容调用 callback(chunk)
+        params: 额外的采样参数（temperature、max_tokens等）
+        config: 系统配置，用于启用响应缓存、重试等调用层功能
+        reasoning_callback: 推理模型输出推理过程时调用 reasoning_callback(chunk)，推理内容不计入返回的回复文本
+
+    返回:
+        完整的回复文本
+    """
+    with start_span(config, "llm_call", kind=SPAN_KIND_CLIENT, model=model, stream=stream,
+                    prompt_chars=_count_prompt_chars(messages)), LLM_IN_FLIGHT.track_in_progress(model=model):
+        try:
+            return _chat_completion(client, model, messages, stream, callback, params, config, reasoning_callback)
+        except Exception:
+            LLM_REQUESTS.inc(model=model, agent=current_agent(), outcome="error")
+            raise
+
+
+def _chat_completion(client, model, messages, stream, callback, params, config, reasoning_callback):
+    """
+    chat_completion 的实现，在调用追踪的 span 内执行
+    """
+    params = params or {}
+    interceptor = _call_interceptor.get()
+    if interceptor is not None:
+        current_span().set_attributes(intercepted=True)
+        content, delay = interceptor.complete(model, messages, params)
+        if delay:
+            time.sleep(delay)
+        if stream and callback:
+            callback(content)
+        return content
+
+    start_time = time.time()
+    cache, cache_key = _lookup_cache(config, client, model, messages, params)
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"💾 命中响应缓存: {cache_key[:12]}")
+            delay = get_cache_config(config)["replay_chunk_delay"]
+            if cached["reasoning"] and reasoning_callback:
+                reasoning_callback(cached["reasoning"])
+            if stream and callback:
+                for piece in cached["chunks"]:
+                    callback(piece)
+                    if delay:
+                        time.sleep(delay)
+            _finish_call(_create_usage_record(model, None, start_time, None, response_cache_hit=True))
+            return cached["content"]
+
+    retry_config = get_retry_config(config)
+    limiter = get_rate_limiter(config)
+    state = _create_call_state(model)
+    attempt = 1
+    while True:
+        _count_retry_stat("attempts")
+        reservation = None
+        if limiter:
+            tokens = estimate_request_tokens(_create_resume_messages(messages, state["content"]), params, config)
+            with RATE_LIMIT_QUEUE.track_in_progress():
+                reservation = limiter.acquire(tokens)
+            _note_rate_limit_wait(state["model"], reservation, state)
+        try:
+            if stream:
+                _stream_once(client, state["model"], messages, callback, params, retry_config, state, reasoning_callback)
+            else:
+                _complete_once(client, state["model"], messages, params, retry_config, state, reasoning_callback)
+            break
+        except Exception as e:
+            _settle_rate_limit(limiter, reservation, None, e)
+            delay = _get_retry_delay(e, attempt, retry_config)
+            if delay is None:
+                raise
+            _log_retry(state["model"], e, attempt, delay, state)
+            _switch_to_fallback_if_stalled(e, state, retry_config)
+            time.sleep(delay)
+            attempt += 1
+
+    _settle_rate_limit(limiter, reservation, state["usage"])
+    record = _create_usage_record(state["model"], state["usage"], start_time, state["first_token_time"])
+    record["retries"] = attempt - 1
+    record["rate_limit_wait"] = state["rate_limit_wait"]
+    _record_reasoning(record, state, start_time)
+    _finish_call(record)
+    # 备用模型的回复不写入主模型的缓存
+    if cache_key and state["content"] and state["model"] == model:
+        cache.put(cache_key, state["content"], state["chunks"] if stream else None, state["reasoning"])
+    return state["content"]
+
+
+def _complete_once(client, model, messages, params, retry_config, state, reasoning_callback=None):
+    """
+    非流式请求的一次尝试
+    """
+    response = client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=False,
+        timeout=retry_config["attempt_timeout"],
+        **params
+    )
+    _consume_message(response, state)
+    if state["reasoning"] and reasoning_callback:
+        reasoning_callback(state["reasoning"])
+
+
+def _stream_once(client, model, messages, callback, params, retry_config, state, reasoning_callback=None):
+    """
+    流式请求的一次尝试，已收到的内容累积在 state 中，重试时从中断处继续
+    """
+    _reset_reasoning_if_restarting(state)
+    stream = client.chat.completions.create(
+        model=model,
+        messages=_create_resume_messages(messages, state["content"]),
+        stream=True,
+        stream_options={"include_usage": True},
+        timeout=_create_stream_timeout(retry_config),
+        **params
+    )
+    watchdog = _StreamWatchdog(stream, retry_config)
+    try:
+        for chunk in stream:
+            reasoning = _consume_reasoning(chunk, state)
+            if reasoning and reasoning_callback:
+                reasoning_callback(reasoning)
+            _consume_chunk(chunk, state, callback)
+            watchdog.progress(_has_token(chunk))
+    except Exception:
+        # 看门狗关闭流导致的异常，换成对应的超时异常
+        if watchdog.error:
+            raise watchdog.error
+        raise
+    finally:
+        watchdog.stop()
+        stream.close()
+    if watchdog.error:
+        raise watchdog.error
+
+
+async def async_chat_completion(client, model, messages, stream=False, callback=None, params=None, config=None,
+                                reasoning_callback=None):
+    """
+    chat_completion 的异步版本
+
+    参数:
+        client: AsyncOpenAI客户端
+        model: 模型名称
+        messages: 消息列表
+        stream: 是否使用流式输出
+        callback: 流式输出时每收到一段内容调用 callback(chunk)，可以返回协程
+        params: 额外的采样参数（temperature、max_tokens等）
+        config: 系统配置，用于启用响应缓存、重试等调用层功能
+        reasoning_callback: 推理模型输出推理过程时调用 reasoning_callback(chunk)，推理内容不计入返回的回复文本
+
+    返回:
+        完整的回复文本
+    """
+    with start_span(config, "llm_call", kind=SPAN_KIND_CLIENT, model=model, stream=stream,
+                    prompt_chars=_count_prompt_chars(messages)), LLM_IN_FLIGHT.track_in_progress(model=model):
+        try:
+            return await _async_chat_completion(client, model, messages, stream, callback, params, config,
+                                                reasoning_callback)
+        except Exception:
+            LLM_REQUESTS.inc(model=model, agent=current_agent(), outcome="error")
+            raise
+
+
+async def _async_chat_completion(client, model, messages, stream, callback, params, config, reasoning_callback):
+    """
+    async_chat_completion 的实现，在调用追踪的 span 内执行
+    """
+    params = params or {}
+    interceptor = _call_interceptor.get()
+    if interceptor is not None:
+        current_span().set_attributes(intercepted=True)
+        content, delay = interceptor.complete(model, messages, params)
+        if delay:
+            await asyncio.sleep(delay)
+        if stream and callback:
+            await _invoke_callback(callback, content)
+        return content
+
+    start_time = time.time()
+    cache, cache_key = _lookup_cache(config, client, model, messages, params)
+    if cache_key:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            print(f"💾 命中响应缓存: {cache_key[:12]}")
+            delay = get_cache_config(config)["replay_chunk_delay"]
+            if cached["reasoning"] and reasoning_callback:
+                await _invoke_callback(reasoning_callback, cached["reasoning"])
+            if stream and callback:
+                for piece in cached["chunks"]:
+                    await _invoke_callback(callback, piece)
+                    if delay:
+                        await asyncio.sleep(delay)
+            _finish_call(_create_usage_record(model, None, start_time, None, response_cache_hit=True))
+            return cached["content"]
+
+    retry_config = get_retry_config(config)
+    limiter = get_rate_limiter(config)
+    state = _create_call_state(model)
+    attempt = 1
+    while True:
+        _count_retry_stat("attempts")
+        reservation = None
+        if limiter:
+            tokens = estimate_request_tokens(_create_resume_messages(messages, state["content"]), params, config)
+            with RATE_LIMIT_QUEUE.track_in_progress():
+                reservation = await limiter.acquire_async(tokens)
+            _note_rate_limit_wait(state["model"], reservation, state)
+        try:
+            if stream:
+                attempt_task = _async_stream_once(
+                    client, state["model"], messages, callback, params, retry_config, state, reasoning_callback
+                )
+            else:
+                attempt_task = _async_complete_once(client, state["model"], messages, params, state, reasoning_callback)
+            try:
+                await asyncio.wait_for(attempt_task, retry_config["attempt_timeout"])
+            except asyncio.TimeoutError:
+                raise AttemptTimeoutError(f"单次尝试超过 {retry_config['attempt_timeout']} 秒")
+            break
+        except Exception as e:
+            _settle_rate_limit(limiter, reservation, None, e)
+            delay = _get_retry_delay(e, attempt, retry_config)
+            if delay is None:
+                raise
+            _log_retry(state["model"], e, attempt, delay, state)
+            _switch_to_fallback_if_stalled(e, state, retry_config)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    _settle_rate_limit(limiter, reservation, state["usage"])
+    record = _create_usage_record(state["model"], state["usage"], start_time, state["first_token_time"])
+    record["retries"] = attempt - 1
+    record["rate_limit_wait"] = state["rate_limit_wait"]
+    _record_reasoning(record, state, start_time)
+    _finish_call(record)
+    # 备用模型的回复不写入主模型的缓存
+    if cache_key and state["content"] and state["model"] == model:
+        cache.put(cache_key, state["content"], state["chunks"] if stream else None, state["reasoning"])
+    return state["content"]
+
+
+async def _async_complete_once(client, model, messages, params, state, reasoning_callback=None):
+    """
+    异步非流式请求的一次尝试
+    """
+    response = await client.chat.completions.create(
+        model=model,
+        messages=messages,
+        stream=False,
+        **params
+    )
+    _consume_message(response, state)
+    if state["reasoning"] and reasoning_callback:
+        await _invoke_callback(reasoning_callback, state["reasoning"])
+
+
+async def _async_stream_once(client, model, messages, callback, params, retry_config, state, reasoning_callback=None):
+    """
+    异步流式请求的一次尝试，已收到的内容累积在 state 中，重试时从中断处继续
+
+    每个分块的等待时间受首token超时（第一个内容到达前）或停滞超时（之后）限制
+    """
+    _reset_reasoning_if_restarting(state)
+    stream = await client.chat.completions.create(
+        model=model,
+        messages=_create_resume_messages(messages, state["content"]),
+        stream=True,
+        stream_options={"include_usage": True},
+        **params
+    )
+    chunks = stream.__aiter__()
+    received_token = False
+    try:
+        while True:
+            if received_token:
+                timeout, message = retry_config["idle_timeout"], "流式输出停滞超过 {} 秒"
+            else:
+                timeout, message = retry_config["first_token_timeout"], "首个token超过 {} 秒未到达"
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), timeout)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                raise StreamStallError(message.format(timeout))
+
+            received_token = received_token or _has_token(chunk)
+            reasoning = _consume_reasoning(chunk, state)
+            if reasoning and reasoning_callback:
+                await _invoke_callback(reasoning_callback, reasoning)
+            piece = _consume_chunk(chunk, state)
+            if piece and callback:
+                await _invoke_callback(callback, piece)
+    finally:
+        await stream.close()
+
+
+def _create_call_state(model):
+    """
+    一次调用（包括所有重试）的累积状态，model 为当前使用的模型，切换到备用模型后随之改变
+    """
+    return {
+        "model": model,
+        "content": "",
+        "chunks": [],
+        "usage": None,
+        "first_token_time": None,
+        "reasoning": "",
+        "first_reasoning_time": None,
+        "rate_limit_wait": 0.0,
+        "stalls": 0
+    }
+
+
+def _has_token(chunk):
+    """
+    判断流式分块中是否包含内容或推理内容（推理模型在输出正文之前先输出推理过程）
+    """
+    if not chunk.choices:
+        return False
+    delta = chunk.choices[0].delta
+    return bool(delta.content or getattr(delta, "reasoning_content", None))
+
+
+def _create_stream_timeout(retry_config):
+    """
+    同步流式请求的HTTP超时
+
+    连接完全没有数据时看门狗无法打断阻塞的读取，由读超时兜底
+    """
+    read_timeout = max(retry_config["first_token_timeout"], retry_config["idle_timeout"])
+    return httpx.Timeout(retry_config["attempt_timeout"], read=read_timeout)
+
+
+def _switch_to_fallback_if_stalled(error, state, retry_config):
+    """
+    当前模型停滞的次数达到 fallback_after_stalls 后，后续重试改用备用模型
+    """
+    if not isinstance(error, (StreamStallError, openai.APITimeoutError)):
+        return
+    state["stalls"] += 1
+    fallback_model = retry_config["fallback_model"]
+    if not fallback_model or fallback_model == state["model"]:
+        return
+    if state["stalls"] >= retry_config["fallback_after_stalls"]:
+        print(f"🔀 {state['model']} 停滞 {state['stalls']} 次，改用备用模型 {fallback_model}")
+        _count_retry_stat("fallbacks")
+        state["model"] = fallback_model
+
+
+def _note_rate_limit_wait(model, reservation, state):
+    """
+    累计在本地限流队列中等待的时间，等待明显时输出日志
+    """
+    state["rate_limit_wait"] += reservation["waited"]
+    RATE_LIMIT_WAIT.observe(reservation["waited"], model=model)
+    if reservation["waited"] >= 1:
+        print(f"🚦 {model} 在本地限流队列中等待了 {reservation['waited']:.1f}秒")
+
+
+def _settle_rate_limit(limiter, reservation, usage, error=None):
+    """
+    按实际用量结算限流预留
+
+    被服务端拒绝的请求（返回了错误状态码）没有消耗token，全部退还；
+    连接中断等情况无法得知实际用量，保留全部预留
+    """
+    if limiter is None or reservation is None:
+        return
+    if error is not None:
+        actual_tokens = 0 if isinstance(error, openai.APIStatusError) else None
+    elif usage is not None:
+        usage_record = extract_usage(usage)
+        actual_tokens = usage_record["prompt_tokens"] + usage_record["completion_tokens"]
+    else:
+        actual_tokens = None
+    limiter.settle(reservation, actual_tokens)
+
+
+def _consume_chunk(chunk, state, callback=None):
+    """
+    处理流式输出的一个分块，返回其中的文本内容（没有内容时为None）
+    """
+    if getattr(chunk, "usage", None):
+        state["usage"] = chunk.usage
+    if not (chunk.choices and chunk.choices[0].delta.content):
+        return None
+
+    piece = chunk.choices[0].delta.content
+    if state["first_token_time"] is None:
+        state["first_token_time"] = time.time()
+    state["content"] += piece
+    state["chunks"].append(piece)
+    if callback:
+        callback(piece)
+    return piece
+
+
+def _consume_message(response, state):
+    """
+    处理非流式请求的完整回复
+    """
+    message = response.choices[0].message
+    state["content"] = message.content
+    state["reasoning"] = getattr(message, "reasoning_content", None) or ""
+    state["usage"] = response.usage
+
+
+def _consume_reasoning(chunk, state):
+    """
+    处理流式分块中的推理内容，返回其中的推理文本（没有时为None）
+
+    正文开始输出后收到的推理内容（续写重试时模型会重新推理）不再记录
+    """
+    if not chunk.choices or state["content"]:
+        return None
+    piece = getattr(chunk.choices[0].delta, "reasoning_content", None)
+    if not piece:
+        return None
+    if state["first_reasoning_time"] is None:
+        state["first_reasoning_time"] = time.time()
+    state["reasoning"] += piece
+    return piece
+
+
+def _reset_reasoning_if_restarting(state):
+    """
+    正文输出之前中断的请求会从头重新推理，丢弃上一次尝试的推理内容
+    """
+    if not state["content"]:
+        state["reasoning"] = ""
+
+
+def _record_reasoning(record, state, start_time):
+    """
+    在用量记录中加入推理阶段的耗时：从第一段推理内容到第一段正文（或请求结束）的时间
+    """
+    if state["first_reasoning_time"] is None:
+        return
+    reasoning_end = state["first_token_time"] or time.time()
+    record["first_reasoning_latency"] = state["first_reasoning_time"] - start_time
+    record["reasoning_seconds"] = reasoning_end - state["first_reasoning_time"]
+    print(
+        f"🧠 {record['model']} 推理耗时 {record['reasoning_seconds']:.1f}秒"
+        + (f"，推理 {record['reasoning_tokens']} tokens" if record.get("reasoning_tokens") else "")
+    )
+
+
+def _create_resume_messages(messages, partial_content):
+    """
+    流式输出中途断开后重试时，把已输出的内容作为助手消息，要求模型从中断处继续
+    """
+    if not partial_content:
+        return messages
+    return list(messages) + [
+        {"role": "assistant", "content": partial_content},
+        {"role": "user", "content": RESUME_PROMPT}
+    ]
+
+
+def get_reasoning_config(config):
+    """
+    合并默认推理模型配置和配置中的推理模型配置
+    """
+    reasoning_config = dict(REASONING_CONFIG)
+    if config:
+        reasoning_config.update(config.get("reasoning", {}))
+    return reasoning_config
+
+
+def is_reasoning_model(config, model):
+    """
+    判断模型是否为会输出推理过程的推理模型
+    """
+    return model in get_reasoning_config(config)["reasoning_models"]
+
+
+def get_retry_config(config):
+    """
+    合并默认重试配置和配置中的重试配置
+    """
+    retry_config = dict(RETRY_CONFIG)
+    if config:
+        retry_config.update(config["api"].get("retry", {}))
+    return retry_config
+
+
+def _is_retryable(error):
+    """
+    判断错误是否值得重试：限流、服务端错误、连接问题和超时
+    """
+    if isinstance(error, (AttemptTimeoutError, StreamStallError, openai.APIConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def _parse_retry_after(error):
+    """
+    从错误响应头中读取服务端要求的等待时间（秒），没有时返回None
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _get_retry_delay(error, attempt, retry_config):
+    """
+    计算第 attempt 次尝试失败后的等待时间，不应重试时返回None
+
+    服务端给出Retry-After时以它为准（不超过 max_retry_after），
+    否则使用全抖动的指数退避：在 [0, min(max_delay, base_delay * 2^(attempt-1))] 中随机取值
+    """
+    if not _is_retryable(error):
+        return None
+    if attempt >= retry_config["max_attempts"]:
+        _count_retry_stat("exhausted")
+        return None
+
+    retry_after = _parse_retry_after(error)
+    if retry_after is not None:
+        _count_retry_stat("retry_after_honored")
+        return min(retry_after, retry_config["max_retry_after"])
+
+    ceiling = min(retry_config["max_delay"], retry_config["base_delay"] * 2 ** (attempt - 1))
+    return random.uniform(0, ceiling)
+
+
+def _log_retry(model, error, attempt, delay, state):
+    """
+    记录一次重试并输出日志
+    """
+    _count_retry_stat("retries")
+    LLM_RETRIES.inc(model=model, reason=type(error).__name__)
+    current_span().set_attributes(retries=attempt, last_error=f"{type(error).__name__}: {error}")
+    if isinstance(error, openai.RateLimitError):
+        _count_retry_stat("rate_limited")
+    if isinstance(error, (StreamStallError, openai.APITimeoutError)):
+        _count_retry_stat("stalls")
+    resume_note = ""
+    if state["content"]:
+        _count_retry_stat("resumed_streams")
+        resume_note = f"，将从已输出的 {len(state['content'])} 个字符处继续"
+    print(f"🔁 {model} 第 {attempt} 次尝试失败（{type(error).__name__}: {error}），{delay:.1f}秒后重试{resume_note}")
+
+
+def _count_retry_stat(name):
+    """
+    累加一个重试计数
+    """
+    with _lock:
+        _retry_stats[name] += 1
+
+
+def get_retry_stats():
+    """
+    获取进程启动以来的重试计数
+    """
+    with _lock:
+        return dict(_retry_stats)
+
+
+def _create_usage_record(model, usage, start_time, first_token_time, response_cache_hit=False):
+    """
+    组装一次调用的用量记录
+
+    参数:
+        model: 模型名称
+        usage: 响应中的usage对象
+        start_time: 请求开始时间
+        first_token_time: 收到第一段内容的时间（非流式请求为None）
+        response_cache_hit: 是否命中本地响应缓存
+    """
+    record = extract_usage(usage)
+    record["model"] = model
+    record["elapsed"] = time.time() - start_time
+    record["first_token_latency"] = first_token_time - start_time if first_token_time else None
+    record["response_cache_hit"] = response_cache_hit
+    # 本次调用之前在同一上下文中组装提示词的耗时，与请求耗时分开统计
+    record["prompt_assembly_seconds"] = take_prompt_assembly_seconds()
+    return record
+
+
+def _finish_call(record):
+    """
+    记录一次调用的用量并更新调用层指标，同时把耗时和token数写入当前调用的追踪span
+    """
+    record_usage(record)
+    observe_llm_call(record)
+    span = current_span()
+    if not span.recording:
+        return
+    completion_tokens = record.get("completion_tokens") or 0
+    # 输出速度按首个token之后的时间计算，不含排队和提示词处理
+    decode_seconds = record["elapsed"] - (record["first_token_latency"] or 0)
+    span.set_attributes(
+        model=record["model"],
+        agent=record.get("agent"),
+        prompt_tokens=record.get("prompt_tokens"),
+        completion_tokens=record.get("completion_tokens"),
+        reasoning_tokens=record.get("reasoning_tokens"),
+        cache_hit_tokens=record.get("cache_hit_tokens"),
+        cache_miss_tokens=record.get("cache_miss_tokens"),
+        response_cache_hit=record["response_cache_hit"],
+        ttft=record["first_token_latency"],
+        tokens_per_second=completion_tokens / decode_seconds if completion_tokens and decode_seconds > 0 else None,
+        retries=record.get("retries", 0),
+        queue_wait=record.get("rate_limit_wait", 0.0),
+        prompt_assembly_seconds=record["prompt_assembly_seconds"]
+    )
+
+
+def _count_prompt_chars(messages):
+    """
+    统计消息列表中提示词的字符数
+    """
+    return sum(len(message.get("content") or "") for message in messages)
+
+
+def _lookup_cache(config, client, model, messages, params):
+    """
+    获取响应缓存和本次请求的缓存键，未启用缓存时返回 (None, None)
+
+    缓存键包含客户端的服务地址，不同的服务（例如切换到本地模拟服务）各自缓存
+    """
+    cache = get_response_cache(config) if config else None
+    if cache is None:
+        return None, None
+    return cache, cache.make_key(model, messages, params, str(client.base_url))
+
+
+async def _invoke_callback(callback, piece):
+    """
+    调用流式回调，兼容普通函数和协程函数
+    """
+    result = callback(piece)
+    if inspect.isawaitable(result):
+        await result
+
+
+@contextlib.contextmanager
+def intercept_calls(interceptor):
+    """
+    在当前上下文（以及从中派生的线程和协程）内拦截所有对话补全调用
+
+    被拦截的请求不会发送到服务端，也不经过缓存、限流和重试，
+    而是返回 interceptor.complete(model, messages, params) 给出的 (回复文本, 模拟耗时秒数)
+
+    参数:
+        interceptor: 拦截器对象
+    """
+    token = _call_interceptor.set(interceptor)
+    try:
+        yield interceptor
+    finally:
+        _call_interceptor.reset(token)
+
+
+def close_clients():
+    """
+    关闭共享连接池并清空注册表，通常只在进程退出时调用
+
+    异步连接池需要在各自的事件循环中通过 aclose_clients 关闭，这里只清空注册表
+    """
+    global _http_client
+    with _lock:
+        _clients.clear()
+        _async_registries.clear()
+        if _http_client is not None:
+            _http_client.close()
+            _http_client = None
@@ -0,0 +1,391 @@
+import io
+import os
+import re
+import json
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+from datetime import datetime
+from benchmark import create_benchmark_config, load_corpus, summarize_latencies
+from interface import create_interface, QUEUE_CONCURRENCY_COUNT, QUEUE_MAX_SIZE
+from mock_server import start_mock_server
+
+# 压测调用的界面事件处理函数
+HANDLERS = ("start_polishing", "next_polishing_round", "check_polishing_status")
+
+# 引擎正忙时返回的提示
+REJECTION_MESSAGE = "系统正在处理其他任务"
+
+# 每个会话在文章开头加上的标记，用于判断会话拿到的最终结果属于哪个会话
+SESSION_TAG = "【压测会话{index:03d}】"
+SESSION_TAG_PATTERN = re.compile(r"【压测会话(\d+)】")
+
+# 界面定时检查润色状态的间隔（秒），与 demo.load(..., every=3) 一致
+DEFAULT_POLL_INTERVAL = 3.0
+
+# 默认使用的模拟服务设置，与真实服务的速度处于同一量级，使会话之间有足够的重叠
+DEFAULT_MOCK_SETTINGS = {
+    "first_token_latency": 0.3,
+    "tokens_per_second": 400.0
+}
+
+# 队列已满、事件被拒绝时 SimulatedQueue.submit 返回的输出
+QUEUE_FULL = object()
+
+
+class SimulatedQueue:
+    """
+    模拟 Gradio 的请求队列：所有会话的事件共用 concurrency_count 个执行位置，
+    排队等待的事件达到 max_size 时新事件被直接拒绝
+    """
+    def __init__(self, concurrency_count=QUEUE_CONCURRENCY_COUNT, max_size=QUEUE_MAX_SIZE):
+        self.max_size = max_size
+        self.waiting = 0
+        self.max_waiting = 0
+        self._slots = threading.Semaphore(concurrency_count)
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """
+        排队执行事件处理函数
+
+        返回:
+            (输出, 排队时间, 执行时间)，队列已满时输出为 QUEUE_FULL，处理函数抛出异常时输出为该异常
+        """
+        with self._lock:
+            if self.waiting >= self.max_size:
+                return QUEUE_FULL, 0.0, 0.0
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+        enqueue_time = time.perf_counter()
+        self._slots.acquire()
+        start_time = time.perf_counter()
+        with self._lock:
+            self.waiting -= 1
+
+        try:
+            output = fn(*args)
+        except Exception as e:
+            output = e
+        finally:
+            self._slots.release()
+        return output, start_time - enqueue_time, time.perf_counter() - start_time
+
+
+def get_event_handlers(demo):
+    """
+    从 Gradio 界面中取出压测调用的事件处理函数
+
+    返回:
+        {函数名: 函数}
+    """
+    handlers = {}
+    for block_function in demo.fns:
+        name = getattr(block_function.fn, "__name__", "")
+        if name in HANDLERS:
+            handlers[name] = block_function.fn
+    missing = [name for name in HANDLERS if name not in handlers]
+    if missing:
+        raise RuntimeError(f"界面中没有找到事件处理函数: {', '.join(missing)}")
+    return handlers
+
+
+def classify_output(handler, output):
+    """
+    根据事件处理函数的输出判断事件的结果
+
+    返回:
+        "ok"、"pending"（状态检查时润色尚未完成）、"completed"、"rejected"（引擎正忙）、
+        "queue_full"（队列已满）或 "error"
+    """
+    if output is QUEUE_FULL:
+        return "queue_full"
+    if isinstance(output, Exception):
+        return "error"
+
+    message = output[0] or ""
+    if REJECTION_MESSAGE in message:
+        return "rejected"
+    if handler == "start_polishing":
+        return "ok" if message == "润色进行中..." else "error"
+    if handler == "next_polishing_round":
+        return "error" if "错误" in (output[1] or "") else "ok"
+    # check_polishing_status：润色进行中时所有输出均为None
+    if output[0] is None:
+        return "pending"
+    return "error" if message.startswith("错误") else "completed"
+
+
+def _check_leakage(index, final_content):
+    """
+    根据会话标记判断最终结果属于哪个会话
+
+    返回:
+        "own"（本会话的结果）、"leaked"（包含其他会话的标记）或
+        "unattributed"（没有任何会话的标记，例如由被其他会话重置后的空会话生成）
+    """
+    tags = {int(tag) for tag in SESSION_TAG_PATTERN.findall(final_content or "")}
+    if not tags:
+        return "unattributed"
+    return "own" if tags == {index} else "leaked"
+
+
+def run_session(index, handlers, queue, text, max_rounds, next_rounds, poll_interval, timeout):
+    """
+    模拟一个浏览器会话：开始润色，点击若干次"进行下一轮润色"，然后定时检查润色状态直到出现结果或超时
+
+    返回:
+        {"index", "events": [事件记录], "outcome", "elapsed"}
+    """
+    session = {"index": index, "events": [], "outcome": "timeout", "elapsed": 0.0}
+    start_time = time.perf_counter()
+
+    def call(handler, *args):
+        output, queue_wait, duration = queue.submit(handlers[handler], *args)
+        result = classify_output(handler, output)
+        session["events"].append({
+            "handler": handler,
+            "queue_wait": queue_wait,
+            "duration": duration,
+            "result": result,
+            "error": str(output) if isinstance(output, Exception) else None
+        })
+        return output, result
+
+    tagged_text = f"{SESSION_TAG.format(index=index)}\n\n{text}"
+    _, result = call("start_polishing", tagged_text, max_rounds, "")
+    if result != "ok":
+        session["outcome"] = result
+        session["elapsed"] = time.perf_counter() - start_time
+        return session
+
+    for _ in range(next_rounds):
+        call("next_polishing_round")
+
+    deadline = start_time + timeout
+    while time.perf_counter() < deadline:
+        time.sleep(poll_interval)
+        output, result = call("check_polishing_status")
+        if result == "completed":
+            session["outcome"] = _check_leakage(index, output[3])
+            break
+        if result == "error":
+            session["outcome"] = "error"
+            break
+
+    session["elapsed"] = time.perf_counter() - start_time
+    return session
+
+
+def run_load_test(config, text, sessions=20, max_rounds=1, next_rounds=1, ramp_up=0.0,
+                  poll_interval=DEFAULT_POLL_INTERVAL, timeout=600.0,
+                  concurrency_count=QUEUE_CONCURRENCY_COUNT, max_size=QUEUE_MAX_SIZE, verbose=False):
+    """
+    并发运行多个模拟会话，所有会话共用同一个界面实例（即同一个引擎和同一份全局结果）
+
+    参数:
+        config: 系统配置（见 benchmark.create_benchmark_config）
+        text: 每个会话润色的文章
+        sessions: 会话数量
+        max_rounds: 每个会话设置的润色轮次
+        next_rounds: 每个会话点击"进行下一轮润色"的次数
+        ramp_up: 在这段时间（秒）内均匀地启动各会话，为0时同时启动
+        poll_interval: 检查润色状态的间隔（秒）
+        timeout: 每个会话等待结果的最长时间（秒）
+        concurrency_count: 队列同时处理的事件数
+        max_size: 队列排队等待的事件数上限
+        verbose: 是否显示润色过程的输出
+
+    返回:
+        结果字典
+    """
+    queue = SimulatedQueue(concurrency_count, max_size)
+    results = [None] * sessions
+
+    # 引擎在当前目录下清理和写入 agent_outputs，在临时目录中运行以免影响工作目录
+    original_dir = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="load_test_"))
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with output:
+            handlers = get_event_handlers(create_interface(config))
+
+            def worker(index):
+                time.sleep(ramp_up * index / sessions)
+                results[index] = run_session(
+                    index, handlers, queue, text, max_rounds, next_rounds, poll_interval, timeout
+                )
+
+            wall_start = time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(index,), daemon=True) for index in range(sessions)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            wall_seconds = time.perf_counter() - wall_start
+    finally:
+        os.chdir(original_dir)
+
+    return summarize_load_test(results, wall_seconds, queue, {
+        "backend": config["api"]["deepseek_base_url"],
+        "sessions": sessions,
+        "max_rounds": max_rounds,
+        "next_rounds": next_rounds,
+        "ramp_up": ramp_up,
+        "poll_interval": poll_interval,
+        "concurrency_count": concurrency_count,
+        "max_size": max_size
+    })
+
+
+def summarize_load_test(sessions, wall_seconds, queue, settings):
+    """
+    汇总各会话的事件记录：吞吐量、排队时间、错误率、拒绝率和跨会话串号情况
+    """
+    events = [event for session in sessions for event in session["events"]]
+    outcomes = {}
+    for session in sessions:
+        outcomes[session["outcome"]] = outcomes.get(session["outcome"], 0) + 1
+
+    handlers = {}
+    for handler in HANDLERS:
+        handler_events = [event for event in events if event["handler"] == handler]
+        results = {}
+        for event in handler_events:
+            results[event["result"]] = results.get(event["result"], 0) + 1
+        handlers[handler] = {
+            "count": len(handler_events),
+            "queue_wait": summarize_latencies([event["queue_wait"] for event in handler_events]),
+            "duration": summarize_latencies([event["duration"] for event in handler_events]),
+            "results": results
+        }
+
+    def rate(count, total):
+        return count / total if total else 0.0
+
+    finished = sum(outcomes.get(key, 0) for key in ("own", "leaked", "unattributed"))
+    errors = sum(1 for event in events if event["result"] == "error")
+    rejections = sum(1 for event in events if event["result"] in ("rejected", "queue_full"))
+
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "settings": settings,
+        "wall_seconds": wall_seconds,
+        "events": len(events),
+        "events_per_second": rate(len(events), wall_seconds),
+        "sessions_per_minute": rate(finished, wall_seconds / 60),
+        "max_queue_waiting": queue.max_waiting,
+        "queue_wait": summarize_latencies([event["queue_wait"] for event in events]),
+        "error_rate": rate(errors, len(events)),
+        "rejection_rate": rate(rejections, len(events)),
+        "leakage_rate": rate(outcomes.get("leaked", 0), finished),
+        "unattributed_rate": rate(outcomes.get("unattributed", 0), finished),
+        "session_outcomes": outcomes,
+        "session_latency": summarize_latencies([session["elapsed"] for session in sessions if session["outcome"] == "own"]),
+        "handlers": handlers,
+        "errors": sorted({event["error"] for event in events if event["error"]})
+    }
+
+
+def format_load_test_report(results):
+    """
+    把压测结果格式化为便于阅读的文本
+    """
+    settings = results["settings"]
+    outcomes = results["session_outcomes"]
+    queue_wait = results["queue_wait"]
+    lines = [
+        f"📊 压测结果（{settings['sessions']} 个会话，队列 {settings['concurrency_count']} 并发 / {settings['max_size']} 排队，"
+        f"后端 {settings['backend']}）",
+        f"   总耗时: {results['wall_seconds']:.2f}秒，事件 {results['events']} 个（{results['events_per_second']:.2f}/秒），"
+        f"完成会话 {results['sessions_per_minute']:.2f}/分钟",
+        f"   排队时间: p50 {queue_wait['p50'] or 0:.3f}s  p95 {queue_wait['p95'] or 0:.3f}s  p99 {queue_wait['p99'] or 0:.3f}s，"
+        f"最多 {results['max_queue_waiting']} 个事件同时排队",
+        f"   错误率: {results['error_rate']:.1%}，拒绝率: {results['rejection_rate']:.1%}，串号率: {results['leakage_rate']:.1%}，"
+        f"无法归属: {results['unattributed_rate']:.1%}",
+        "   会话结果: " + "，".join(f"{key} {count}" for key, count in sorted(outcomes.items()))
+    ]
+    for handler, summary in results["handlers"].items():
+        if not summary["count"]:
+            continue
+        counts = "，".join(f"{key} {count}" for key, count in sorted(summary["results"].items()))
+        lines.append(
+            f"   {handler}: {summary['count']} 次（{counts}），排队 p95 {summary['queue_wait']['p95']:.3f}s，"
+            f"执行 p95 {summary['duration']['p95']:.3f}s"
+        )
+    for error in results["errors"]:
+        lines.append(f"   ❌ {error}")
+    return "\n".join(lines)
+
+
+def parse_args():
+    """
+    解析命令行参数
+    """
+    parser = argparse.ArgumentParser(description="模拟多个用户同时使用界面的压测工具")
+    parser.add_argument("--sessions", type=int, default=20, help="同时使用的会话数量")
+    parser.add_argument("--article", default="short", help="每个会话润色的语料（short、medium、long）")
+    parser.add_argument("--rounds", type=int, default=1, help="每个会话设置的润色轮次")
+    parser.add_argument("--next-rounds", type=int, default=1, help="每个会话点击\"进行下一轮润色\"的次数")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="在这段时间（秒）内均匀地启动各会话")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="检查润色状态的间隔（秒）")
+    parser.add_argument("--timeout", type=float, default=600.0, help="每个会话等待结果的最长时间（秒）")
+    parser.add_argument("--concurrency-count", type=int, default=QUEUE_CONCURRENCY_COUNT, help="队列同时处理的事件数")
+    parser.add_argument("--max-size", type=int, default=QUEUE_MAX_SIZE, help="队列排队等待的事件数上限")
+    parser.add_argument("--backend", choices=("mock", "config"), default="mock",
+                        help="mock: 进程内的模拟服务（默认）；config: 配置文件中的真实服务")
+    parser.add_argument("--first-token-latency", type=float, default=DEFAULT_MOCK_SETTINGS["first_token_latency"],
+                        help="模拟服务的首token延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=DEFAULT_MOCK_SETTINGS["tokens_per_second"],
+                        help="模拟服务的输出速度")
+    parser.add_argument("--output", help="把结果保存为 JSON 文件")
+    parser.add_argument("--verbose", action="store_true", help="显示润色过程的输出")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    text = load_corpus([args.article])[args.article]
+
+    server = None
+    base_url = None
+    if args.backend == "mock":
+        server, base_url = start_mock_server({
+            "first_token_latency": args.first_token_latency,
+            "tokens_per_second": args.tokens_per_second
+        })
+        print(f"🧪 使用模拟LLM服务: {base_url}")
+
+    print(f"🚀 启动 {args.sessions} 个会话...")
+    try:
+        config = create_benchmark_config(base_url)
+        results = run_load_test(
+            config,
+            text,
+            sessions=args.sessions,
+            max_rounds=args.rounds,
+            next_rounds=args.next_rounds,
+            ramp_up=args.ramp_up,
+            poll_interval=args.poll_interval,
+            timeout=args.timeout,
+            concurrency_count=args.concurrency_count,
+            max_size=args.max_size,
+            verbose=args.verbose
+        )
+    finally:
+        if server:
+            server.shutdown()
+
+    print(format_load_test_report(results))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"💾 结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 import gradio as gr
 import os
+import json
 import shutil
+import argparse
 from interface import create_interface
 from config import load_config
+from dry_run import run_dry_run, format_dry_run_report
+from metrics import start_metrics_server
 
 def clean_output_files():
     """
@@ -27,17 +31,61 @@ def clean_output_files():
         os.makedirs(output_dir, exist_ok=True)
         print(f"📁 已创建输出目录: {output_dir}")
 
+def parse_args():
+    """
+    解析命令行参数
+    """
+    parser = argparse.ArgumentParser(description="LiteraSageAI - 多Agent协同文章润色系统")
+    parser.add_argument("--dry-run", action="store_true", help="不调用API，估算润色一篇文章的token用量和耗时")
+    parser.add_argument("--article", help="dry run 使用的待润色文章文件")
+    parser.add_argument("--reference", help="dry run 使用的参考资料文件（可选）")
+    parser.add_argument("--ref-type", choices=["article", "document"], default="article", help="参考资料类型")
+    parser.add_argument("--rounds", type=int, help="润色轮次，默认使用配置中的轮次")
+    parser.add_argument("--report", help="将 dry run 估算报告保存为JSON文件")
+    return parser.parse_args()
+
+def dry_run(args):
+    """
+    执行 dry run 并输出估算报告
+    """
+    if not args.article:
+        print("❌ dry run 需要通过 --article 指定待润色的文章文件")
+        return
+    
+    with open(args.article, 'r', encoding='utf-8') as f:
+        article = f.read()
+    reference_text = ""
+    if args.reference:
+        with open(args.reference, 'r', encoding='utf-8') as f:
+            reference_text = f.read()
+    
+    report = run_dry_run(article, reference_text, args.ref_type, args.rounds, load_config())
+    print(format_dry_run_report(report))
+    
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"💾 已保存估算报告到 {args.report}")
+
 def main():
     """
     LiteraSageAI 主程序入口
     文学智慧AI - 多Agent协同文章润色系统
     """
+    args = parse_args()
+    if args.dry_run:
+        dry_run(args)
+        return
+    
     # 清理旧的输出文件
     clean_output_files()
     
     # 加载配置
     config = load_config()
     
+    # 在后台线程中启动 /metrics 指标接口
+    start_metrics_server(config)
+    
     # 创建并启动Gradio界面
     demo = create_interface(config)
     demo.launch(share=True)
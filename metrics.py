@@ -0,0 +1,385 @@
+import math
+import time
+import threading
+import functools
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from config import METRICS_CONFIG
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 单次LLM调用、首token延迟的直方图分桶（秒）
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+# Agent、轮次和整个任务耗时的直方图分桶（秒）
+DURATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+# 本地限流排队时间的直方图分桶（秒）
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2, 5, 10, 30, 60)
+
+
+def get_metrics_config(config):
+    """
+    合并默认指标接口配置和配置文件中的指标接口配置
+    """
+    metrics_config = dict(METRICS_CONFIG)
+    metrics_config.update(config.get("metrics", {}))
+    return metrics_config
+
+
+def _format_value(value):
+    """
+    按 Prometheus 文本格式输出数值
+    """
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    """
+    指标的基类，按标签值分别记录
+    """
+    type_name = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，收到 {tuple(labels)}")
+        # 未知的Agent等缺失值统一记为空字符串
+        return tuple("" if labels[name] is None else str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        """
+        返回 [(名称后缀, [(标签名, 标签值)], 数值)]
+        """
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0)]
+        return [("", list(zip(self.labelnames, key)), value) for key, value in items]
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {_escape_help(self.description)}",
+            f"# TYPE {self.name} {self.type_name}"
+        ]
+        for suffix, labels, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """
+    只增不减的计数器
+    """
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError(f"计数器 {self.name} 不能减少")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    可增可减的当前值；设置了取值函数时在导出时调用函数取值
+    """
+    type_name = "gauge"
+
+    def __init__(self, name, description, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_in_progress(self, **labels):
+        """
+        在 with 代码块执行期间把当前值加一
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def set_function(self, function):
+        """
+        导出时调用 function() 取值，仅用于没有标签的指标
+        """
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            return [("", [], self._function())]
+        return super()._samples()
+
+
+class Histogram(_Metric):
+    """
+    按分桶统计观测值的分布，导出 _bucket、_sum 和 _count
+    """
+    type_name = "histogram"
+
+    def __init__(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * len(self.buckets), "sum": 0.0}
+                self._values[key] = state
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, {"counts": list(state["counts"]), "sum": state["sum"]})
+                           for key, state in self._values.items())
+        samples = []
+        for key, state in items:
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                samples.append(("_bucket", labels + [("le", _format_value(bound))], cumulative))
+            samples.append(("_sum", labels, state["sum"]))
+            samples.append(("_count", labels, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    进程内的指标注册表，按注册顺序导出为 Prometheus 文本格式
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为 {metric.type_name}")
+            return metric
+
+    def counter(self, name, description, labelnames=()):
+        return self._register(Counter, name, description, labelnames)
+
+    def gauge(self, name, description, labelnames=()):
+        return self._register(Gauge, name, description, labelnames)
+
+    def histogram(self, name, description, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram, name, description, labelnames, buckets)
+
+    def render(self):
+        """
+        导出所有指标
+
+        返回:
+            Prometheus 文本格式的字符串
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+PROCESS_START_TIME = REGISTRY.gauge("literasage_process_start_time_seconds", "进程启动时间（Unix时间戳）")
+PROCESS_START_TIME.set(time.time())
+
+# 引擎：界面触发的各项操作
+ENGINE_IN_PROGRESS = REGISTRY.gauge(
+    "literasage_engine_operations_in_progress", "正在执行的引擎操作数", ["operation"]
+)
+ENGINE_OPERATIONS = REGISTRY.counter(
+    "literasage_engine_operations_total", "引擎操作次数，outcome 为 ok、error 或 rejected（引擎正忙）",
+    ["operation", "outcome"]
+)
+ENGINE_DURATION = REGISTRY.histogram(
+    "literasage_engine_operation_duration_seconds", "引擎操作耗时（不含被拒绝的操作）", ["operation"], DURATION_BUCKETS
+)
+
+# 对话：润色任务、轮次和Agent
+JOBS_IN_FLIGHT = REGISTRY.gauge("literasage_jobs_in_flight", "已开始但尚未生成最终结果的润色任务数")
+JOBS_STARTED = REGISTRY.counter("literasage_jobs_started_total", "开始的润色任务数")
+JOBS_FINISHED = REGISTRY.counter(
+    "literasage_jobs_finished_total", "结束的润色任务数，outcome 为 completed、error 或 abandoned（被新任务取代）",
+    ["outcome"]
+)
+JOB_DURATION = REGISTRY.histogram(
+    "literasage_job_duration_seconds", "完成的润色任务从开始到生成最终结果的耗时（包括等待用户进行下一轮的时间）",
+    buckets=DURATION_BUCKETS
+)
+ROUNDS = REGISTRY.counter("literasage_rounds_total", "润色轮次数，outcome 为 ok 或 error", ["round_mode", "outcome"])
+ROUND_DURATION = REGISTRY.histogram(
+    "literasage_round_duration_seconds", "每轮润色的耗时", ["round_mode"], DURATION_BUCKETS
+)
+AGENT_RUNS = REGISTRY.counter("literasage_agent_runs_total", "Agent执行次数，outcome 为 ok 或 error", ["agent", "outcome"])
+AGENT_DURATION = REGISTRY.histogram(
+    "literasage_agent_duration_seconds", "Agent在一轮中的执行耗时（包括思考和整理输出）", ["agent"], DURATION_BUCKETS
+)
+
+# 调用层：LLM请求、token、重试和限流
+LLM_IN_FLIGHT = REGISTRY.gauge("literasage_llm_requests_in_flight", "正在进行的LLM调用数（包括重试和限流排队）", ["model"])
+LLM_REQUESTS = REGISTRY.counter(
+    "literasage_llm_requests_total", "LLM调用次数，outcome 为 ok、response_cache（命中本地响应缓存）或 error（重试后仍失败）",
+    ["model", "agent", "outcome"]
+)
+LLM_DURATION = REGISTRY.histogram(
+    "literasage_llm_request_duration_seconds", "LLM调用的耗时（包括重试和限流排队）", ["model", "agent"]
+)
+LLM_TTFT = REGISTRY.histogram(
+    "literasage_llm_time_to_first_token_seconds", "流式LLM调用的首token延迟", ["model", "agent"]
+)
+LLM_TOKENS = REGISTRY.counter(
+    "literasage_llm_tokens_total", "LLM调用的token数，type 为 prompt、completion、reasoning 或 cache_hit",
+    ["model", "agent", "type"]
+)
+LLM_RETRIES = REGISTRY.counter("literasage_llm_retries_total", "LLM调用的重试次数，reason 为失败的异常类型", ["model", "reason"])
+RATE_LIMIT_QUEUE = REGISTRY.gauge("literasage_rate_limit_queue_depth", "正在本地限流队列中等待的LLM请求数")
+RATE_LIMIT_WAIT = REGISTRY.histogram(
+    "literasage_rate_limit_wait_seconds", "LLM请求在本地限流队列中的等待时间", ["model"], WAIT_BUCKETS
+)
+
+
+def track_operation(operation):
+    """
+    统计引擎操作的装饰器：进行中的数量、耗时和结果
+
+    被装饰的方法返回 {"success": ...} 形式的结果，引擎正忙而拒绝时结果中带有 "busy": True
+
+    参数:
+        operation: 操作名称，作为指标的 operation 标签
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            start_time = time.time()
+            ENGINE_IN_PROGRESS.inc(operation=operation)
+            outcome = "error"
+            try:
+                result = method(*args, **kwargs)
+                if result.get("busy"):
+                    outcome = "rejected"
+                elif result.get("success"):
+                    outcome = "ok"
+                return result
+            finally:
+                ENGINE_IN_PROGRESS.dec(operation=operation)
+                ENGINE_OPERATIONS.inc(operation=operation, outcome=outcome)
+                if outcome != "rejected":
+                    ENGINE_DURATION.observe(time.time() - start_time, operation=operation)
+        return wrapper
+    return decorator
+
+
+def observe_llm_call(record):
+    """
+    按一次LLM调用的用量记录更新调用层指标
+
+    参数:
+        record: llm_client 组装的用量记录
+    """
+    model, agent = record["model"], record.get("agent")
+    LLM_REQUESTS.inc(model=model, agent=agent, outcome="response_cache" if record["response_cache_hit"] else "ok")
+    LLM_DURATION.observe(record["elapsed"], model=model, agent=agent)
+    if record["first_token_latency"] is not None:
+        LLM_TTFT.observe(record["first_token_latency"], model=model, agent=agent)
+    for token_type, key in (("prompt", "prompt_tokens"), ("completion", "completion_tokens"),
+                            ("reasoning", "reasoning_tokens"), ("cache_hit", "cache_hit_tokens")):
+        if record.get(key):
+            LLM_TOKENS.inc(record[key], model=model, agent=agent, type=token_type)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """
+    GET /metrics 返回 Prometheus 文本格式的指标
+    """
+    def do_GET(self):
+        if self.path.split("?", 1)[0].rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Prometheus 每隔几秒抓取一次，不输出访问日志
+        pass
+
+
+def start_metrics_server(config):
+    """
+    在后台线程中启动 /metrics 接口
+
+    参数:
+        config: 系统配置，使用其中的 metrics 字段
+
+    返回:
+        服务实例，未启用或端口不可用时返回None
+    """
+    metrics_config = get_metrics_config(config)
+    if not metrics_config["enabled"]:
+        return None
+    try:
+        server = ThreadingHTTPServer((metrics_config["host"], metrics_config["port"]), _MetricsHandler)
+    except OSError as e:
+        print(f"⚠️ 无法启动指标接口 {metrics_config['host']}:{metrics_config['port']}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    print(f"📊 指标接口已启动: http://{metrics_config['host']}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,284 @@
+import io
+import os
+import sys
+import copy
+import json
+import timeit
+import argparse
+import platform
+import statistics
+import contextlib
+import subprocess
+from datetime import datetime
+from config import load_config
+from context_manager import ARTICLE_MARKER, extract_article
+from conversation import Conversation
+from utils import count_words, detect_format, render_agent_progress_html
+
+# 基准测试目录，相对于程序所在目录
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+CORPUS_FILE = os.path.join(BENCHMARK_DIR, "corpus", "long.txt")
+HISTORY_FILE = os.path.join(BENCHMARK_DIR, "microbench_history.jsonl")
+
+# 默认的文章长度（字符）和对话历史轮次
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_ROUNDS = (1, 5, 10)
+
+# 与上一次记录相比变慢超过该比例时提示（微基准的波动较大，阈值比端到端基准宽松）
+DEFAULT_THRESHOLD = 0.25
+
+# 估算每轮本地开销时假设的流式输出分块大小（字符），DeepSeek 大约每个token一个分块
+STREAM_CHUNK_CHARS = 2
+
+# 模拟润色建议的长度（字符）
+SUGGESTION_CHARS = 600
+
+
+def create_text(size):
+    """
+    用基准语料循环拼接出指定字符数的文章
+    """
+    with open(CORPUS_FILE, "r", encoding="utf-8") as f:
+        corpus = f.read()
+    return (corpus * (size // len(corpus) + 1))[:size]
+
+
+def create_agent_output(agent_name, article):
+    """
+    生成与真实格式相同的Agent输出：润色建议加修改后的文章
+    """
+    suggestions = ("建议调整第二段的句式节奏，替换平淡的用词。" * (SUGGESTION_CHARS // 20 + 1))[:SUGGESTION_CHARS]
+    return f"# {agent_name} 的润色建议\n{suggestions}\n\n{ARTICLE_MARKER}\n{article}"
+
+
+def create_conversation(config, text, rounds):
+    """
+    创建带有 rounds 轮对话历史的会话，每轮每个Agent的修改稿都与上一版略有不同
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        conversation = Conversation(config)
+    article = text
+    for round_number in range(1, rounds + 1):
+        responses = []
+        for index, agent in enumerate(conversation.agents):
+            # 每个Agent改动一处，上下文中的差异不为空
+            position = (round_number * len(conversation.agents) + index) * 97 % max(1, len(article) - 10)
+            article = article[:position] + "修改" + article[position + 2:]
+            responses.append({
+                "agent_name": agent.name,
+                "agent_color": agent.color,
+                "content": create_agent_output(agent.name, article)
+            })
+        conversation.history.append({"round": round_number, "responses": responses})
+    conversation.current_round = rounds
+    return conversation, article
+
+
+def create_progress_state(conversation, text):
+    """
+    生成流式输出进行到一半时的界面进度状态：前几个Agent已完成，当前Agent输出到一半，其余等待中
+    """
+    agents = conversation.agents
+    agent_responses = {}
+    for index, agent in enumerate(agents[:3]):
+        content = create_agent_output(agent.name, text)
+        agent_responses[agent.name] = {
+            "color": agent.color,
+            "content": content if index < 2 else content[:len(content) // 2],
+            "reasoning": "",
+            "completed": index < 2,
+            "error": False
+        }
+    processing_agents = [agent.name for agent in agents[2:]]
+    return agent_responses, processing_agents
+
+
+def measure(fn, repeat=5):
+    """
+    测量一次调用的耗时：自动确定每组调用次数（每组至少0.2秒），重复 repeat 组
+
+    返回:
+        {"median": 中位数（秒）, "min": 最小值（秒）, "number": 每组调用次数}
+    """
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    times = [total / number for total in timer.repeat(repeat=repeat, number=number)]
+    return {"median": statistics.median(times), "min": min(times), "number": number}
+
+
+def run_microbenchmarks(config, sizes=DEFAULT_SIZES, rounds_list=DEFAULT_ROUNDS, repeat=5):
+    """
+    运行各项微基准
+
+    参数:
+        config: 系统配置
+        sizes: 文章长度列表（字符）
+        rounds_list: 对话历史轮次列表
+        repeat: 每项重复的组数
+
+    返回:
+        {用例名称: 测量结果}，用例名称形如 "context_manager/size=10000/rounds=5"
+    """
+    full_history_config = copy.deepcopy(config)
+    full_history_config["context"] = dict(config.get("context", {}), enabled=False)
+    reference_data = {"content": "", "style_analysis": "注重细节描写，语言含蓄。", "ref_type": "article"}
+    results = {}
+
+    def run(name, fn):
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = measure(fn, repeat)
+        print(f"⏱️ {name}: {results[name]['median'] * 1000:.3f}毫秒")
+
+    for size in sizes:
+        text = create_text(size)
+        output = create_agent_output("文学专家", text)
+
+        run(f"extract_article/size={size}", lambda: extract_article(output))
+        run(f"count_words/size={size}", lambda: count_words(text))
+        run(f"detect_format/size={size}", lambda: detect_format(text))
+
+        for rounds in rounds_list:
+            suffix = f"size={size}/rounds={rounds}"
+            conversation, current_text = create_conversation(config, text, rounds)
+            full_history, _ = create_conversation(full_history_config, text, rounds)
+            agent = conversation.agents[0]
+            with contextlib.redirect_stdout(io.StringIO()):
+                context = conversation._get_conversation_context([], current_text)
+
+            run(f"context_manager/{suffix}", lambda: conversation._get_conversation_context([], current_text))
+            run(f"context_full_history/{suffix}", lambda: full_history._get_conversation_context([], current_text))
+            run(f"prompt_assembly/{suffix}",
+                lambda: agent._create_single_pass_messages(current_text, reference_data, context))
+
+        agent_responses, processing_agents = create_progress_state(conversation, text)
+        run(f"progress_html/size={size}", lambda: render_agent_progress_html(agent_responses, processing_agents))
+
+    return results
+
+
+def estimate_round_overhead(results, size, rounds, agents=5):
+    """
+    估算一轮润色中本项目自身的本地开销（秒）：每个Agent组装上下文和提示词、提取修改稿，
+    以及流式输出的每个分块都重新生成一次进度HTML
+
+    返回:
+        {"per_agent": 每个Agent的上下文、提示词和提取耗时, "progress_html": 一轮中重新生成进度HTML的耗时, "total": 合计}，
+        缺少所需的测量结果时返回None
+    """
+    suffix = f"size={size}/rounds={rounds}"
+    keys = (f"context_manager/{suffix}", f"prompt_assembly/{suffix}", f"extract_article/size={size}",
+            f"progress_html/size={size}")
+    if any(key not in results for key in keys):
+        return None
+    per_agent = sum(results[key]["median"] for key in keys[:3])
+    chunks = agents * (size + SUGGESTION_CHARS) / STREAM_CHUNK_CHARS
+    progress_html = chunks * results[keys[3]]["median"]
+    return {"per_agent": per_agent, "progress_html": progress_html, "total": agents * per_agent + progress_html}
+
+
+def _get_commit():
+    """
+    获取当前代码的 git 提交，不在 git 仓库中时返回None
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path=HISTORY_FILE):
+    """
+    读取历史记录，文件不存在时返回空列表
+    """
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(results, path=HISTORY_FILE):
+    """
+    把本次结果追加到历史记录（每行一条 JSON）
+    """
+    entry = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "commit": _get_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": {name: result["median"] for name, result in results.items()}
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return entry
+
+
+def compare_with_previous(results, previous, threshold=DEFAULT_THRESHOLD):
+    """
+    与之前的一条历史记录比较
+
+    返回:
+        变慢超过 threshold 的用例列表，每项为 {"case", "previous", "current", "change"}
+    """
+    regressions = []
+    for name, result in results.items():
+        before = previous["results"].get(name)
+        if not before:
+            continue
+        change = result["median"] / before - 1
+        if change > threshold:
+            regressions.append({"case": name, "previous": before, "current": result["median"], "change": change})
+    return regressions
+
+
+def parse_args():
+    """
+    解析命令行参数
+    """
+    parser = argparse.ArgumentParser(description="润色流程中非LLM部分的微基准")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="文章长度（字符）")
+    parser.add_argument("--rounds", type=int, nargs="+", default=list(DEFAULT_ROUNDS), help="对话历史轮次")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复的组数")
+    parser.add_argument("--history", default=HISTORY_FILE, help="历史记录文件")
+    parser.add_argument("--no-save", action="store_true", help="不写入历史记录")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="视为变慢的比例")
+    parser.add_argument("--fail-on-regression", action="store_true", help="与上一次记录相比变慢时以非零状态退出")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = copy.deepcopy(load_config())
+    # 只组装提示词，不发送请求，但创建客户端要求密钥非空
+    config["api"]["deepseek_key"] = config["api"].get("deepseek_key") or "microbench"
+
+    results = run_microbenchmarks(config, args.sizes, args.rounds, args.repeat)
+
+    print("📊 每轮本地开销估计（5个Agent）:")
+    for size in args.sizes:
+        estimate = estimate_round_overhead(results, size, max(args.rounds))
+        if estimate:
+            print(f"   {size}字/{max(args.rounds)}轮历史: 合计 {estimate['total']:.3f}秒，"
+                  f"其中进度HTML {estimate['progress_html']:.3f}秒，每个Agent的上下文和提示词 {estimate['per_agent'] * 1000:.2f}毫秒")
+
+    history = load_history(args.history)
+    regressions = compare_with_previous(results, history[-1], args.threshold) if history else []
+    for item in regressions:
+        print(f"⚠️ {item['case']} 比上一次记录慢: {item['previous'] * 1000:.3f} → {item['current'] * 1000:.3f}毫秒 "
+              f"(+{item['change']:.0%})")
+    if history and not regressions:
+        print(f"✅ 与上一次记录（{history[-1]['created']}，{history[-1].get('commit')}）相比没有变慢超过 {args.threshold:.0%} 的用例")
+
+    if not args.no_save:
+        append_history(results, args.history)
+        print(f"💾 已追加到历史记录: {args.history}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
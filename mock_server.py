@@ -0,0 +1,358 @@
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from context_manager import ARTICLE_MARKER, FINAL_RESULT_MARKER
+from edit_script import EDITS_MARKER
+from sharding import SEAM_DIVIDER
+from utils import estimate_tokens, estimate_messages_tokens
+
+# 模拟服务的默认设置，命令行参数和 start_mock_server 的 settings 可以覆盖
+DEFAULT_SETTINGS = {
+    "first_token_latency": 0.3,   # 收到请求到输出第一个token的时间（秒）
+    "tokens_per_second": 50.0,    # 输出速度
+    "chunk_chars": 8,             # 流式输出每个分块的字符数
+    "error_rate": 0.0,            # 返回 500 错误的概率
+    "rate_limit_rate": 0.0,       # 返回 429 限流的概率
+    "retry_after": 1.0,           # 429 响应的 Retry-After（秒）
+    "disconnect_rate": 0.0,       # 流式输出中途断开连接的概率
+    "suggestion_chars": 120,      # 模拟润色建议的字符数
+    "reasoning_chars": 0,         # 推理模型（模型名包含 reasoner）输出的推理过程字符数
+    "seed": 0                     # 错误注入使用的随机数种子
+}
+
+# 模拟分析输出中附带原文的标记，整理输出阶段据此取回文章
+SOURCE_MARKER = "【原文】"
+
+# 模拟建议使用的文字，按需要的长度循环截取
+FILLER_TEXT = "建议调整句式节奏，替换平淡的用词，使段落之间的衔接更加自然。"
+
+# 记录的已见系统提示词数量上限，用于模拟服务端的前缀缓存
+MAX_SEEN_PROMPTS = 1024
+
+
+def _create_filler(chars):
+    """
+    生成指定字符数的模拟文字
+    """
+    repeats = chars // len(FILLER_TEXT) + 1
+    return (FILLER_TEXT * repeats)[:chars]
+
+
+def _find_section(text, start, end=None):
+    """
+    取出 text 中 start 标记之后、end 标记之前的内容，找不到 start 时返回None
+    """
+    if start not in text:
+        return None
+    section = text.split(start, 1)[1]
+    if end and end in section:
+        section = section.split(end, 1)[0]
+    return section.strip()
+
+
+def create_canned_output(messages, suggestion_chars=DEFAULT_SETTINGS["suggestion_chars"]):
+    """
+    按提示词要求的输出格式生成确定性的模拟输出：相同的请求总是得到相同的输出，
+    修改后的文章与收到的文章相同，因此多轮润色后文章保持不变
+
+    参数:
+        messages: 请求的消息列表
+        suggestion_chars: 润色建议部分的字符数
+
+    返回:
+        模拟输出
+    """
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    user = messages[-1]["content"] if messages else ""
+    agent = re.search(r'名为"(.+?)"', system)
+    name = agent.group(1) if agent else "综合评审员"
+    # 使用提示词中要求的润色建议标题
+    heading = re.search(r'^\s*(#[^\n]*润色建议)\s*$', system, re.MULTILINE)
+    suggestions = (heading.group(1) if heading else f"# {name} 的润色建议") + "\n" + _create_filler(suggestion_chars)
+
+    if SEAM_DIVIDER in system:
+        return user
+    if FINAL_RESULT_MARKER in system:
+        article = _find_section(system, "原始文章：", "专家建议：") or user
+        return f"{suggestions}\n\n{FINAL_RESULT_MARKER}\n{article}"
+
+    # 整理输出阶段的用户消息是思考结果，从中取回模拟分析附带的原文
+    article = _find_section(user, "当前文章：") or _find_section(user, SOURCE_MARKER) or user
+    if EDITS_MARKER in system:
+        # 把第一句替换为其本身，修改操作可以定位并应用，文章保持不变
+        anchor = re.split(r'(?<=[。！？!?\n])', article.strip(), 1)[0]
+        edits = [{"anchor": anchor, "replacement": anchor, "rationale": "模拟修改"}]
+        return f"{suggestions}\n\n{EDITS_MARKER}\n{json.dumps(edits, ensure_ascii=False)}"
+    if ARTICLE_MARKER in system:
+        return f"{suggestions}\n\n{ARTICLE_MARKER}\n{article}"
+    if "提取所有的机械用语" in system:
+        return "总之\n因此\n众所周知"
+    if "重写以下文本" in system:
+        return user
+    # 思考阶段和风格分析等分析类请求
+    return f"模拟分析：{_create_filler(suggestion_chars)}\n\n{SOURCE_MARKER}\n{user}"
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """
+    本地模拟的 OpenAI 兼容对话补全服务
+
+    支持流式（SSE）和非流式输出，按设置模拟首token延迟、输出速度、500 错误、429 限流和流式中途断开，
+    输出为确定性的模拟内容。服务端记录请求统计，可通过 GET /stats 查看
+    """
+    daemon_threads = True
+
+    def __init__(self, address, settings=None):
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.settings.update(settings or {})
+        self.random = random.Random(self.settings["seed"])
+        self.lock = threading.Lock()
+        self.seen_prompts = set()
+        self.stats = {
+            "requests": 0,
+            "streamed": 0,
+            "errors": 0,
+            "rate_limited": 0,
+            "disconnects": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0
+        }
+        super().__init__(address, MockRequestHandler)
+
+    def draw_fault(self, stream):
+        """
+        按设置的概率决定本次请求注入的故障：None、"error"、"rate_limit" 或 "disconnect"
+        """
+        with self.lock:
+            value = self.random.random()
+        for fault, rate in (("error", self.settings["error_rate"]),
+                            ("rate_limit", self.settings["rate_limit_rate"]),
+                            ("disconnect", self.settings["disconnect_rate"] if stream else 0.0)):
+            if value < rate:
+                return fault
+            value -= rate
+        return None
+
+    def create_usage(self, messages, content):
+        """
+        估算本次请求的用量，之前出现过的系统提示词按命中前缀缓存计算
+        """
+        prompt_tokens = estimate_messages_tokens(messages)
+        completion_tokens = estimate_tokens(content)
+        system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+        key = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        with self.lock:
+            hit_tokens = estimate_tokens(system) if key in self.seen_prompts else 0
+            if len(self.seen_prompts) >= MAX_SEEN_PROMPTS:
+                self.seen_prompts.clear()
+            self.seen_prompts.add(key)
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["completion_tokens"] += completion_tokens
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": hit_tokens,
+            "prompt_cache_miss_tokens": prompt_tokens - hit_tokens
+        }
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def handle_error(self, request, client_address):
+        """
+        客户端断开连接（例如关闭空闲的 keep-alive 连接或超时重试）时不打印异常，其他异常照常输出
+        """
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError, ConnectionAbortedError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """
+    处理 /chat/completions（也接受 /v1/chat/completions）、/models 和 /stats 请求
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path in ("/models", "/v1/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": "deepseek-chat", "object": "model", "owned_by": "mock"},
+                {"id": "deepseek-reasoner", "object": "model", "owned_by": "mock"}
+            ]})
+        elif path == "/stats":
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}", "type": "not_found"}})
+
+    def do_POST(self):
+        if self.path.rstrip("/") not in ("/chat/completions", "/v1/chat/completions"):
+            self._send_json(404, {"error": {"message": f"未知路径: {self.path}", "type": "not_found"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        stream = bool(body.get("stream"))
+        self.server.count("requests")
+
+        fault = self.server.draw_fault(stream)
+        if fault == "error":
+            self.server.count("errors")
+            self._send_json(500, {"error": {"message": "模拟的服务端错误", "type": "server_error"}})
+            return
+        if fault == "rate_limit":
+            self.server.count("rate_limited")
+            self._send_json(
+                429,
+                {"error": {"message": "模拟的限流", "type": "rate_limit_error"}},
+                {"Retry-After": str(self.server.settings["retry_after"])}
+            )
+            return
+
+        settings = self.server.settings
+        messages = body.get("messages", [])
+        model = body.get("model", "deepseek-chat")
+        content = create_canned_output(messages, settings["suggestion_chars"])
+        reasoning = _create_filler(settings["reasoning_chars"]) if "reasoner" in model else ""
+        usage = self.server.create_usage(messages, reasoning + content)
+
+        if stream:
+            self.server.count("streamed")
+            self._stream(model, content, reasoning, usage, fault == "disconnect")
+            return
+
+        time.sleep(settings["first_token_latency"] + estimate_tokens(reasoning + content) / settings["tokens_per_second"])
+        message = {"role": "assistant", "content": content}
+        if reasoning:
+            message["reasoning_content"] = reasoning
+        self._send_json(200, {
+            "id": "mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    def _stream(self, model, content, reasoning, usage, disconnect):
+        """
+        以 SSE 分块输出：先等待首token延迟，再按输出速度逐块发送推理过程和正文，最后发送用量
+        """
+        settings = self.server.settings
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        pieces = [("reasoning_content", reasoning[i:i + settings["chunk_chars"]])
+                  for i in range(0, len(reasoning), settings["chunk_chars"])]
+        pieces += [("content", content[i:i + settings["chunk_chars"]])
+                   for i in range(0, len(content), settings["chunk_chars"])]
+
+        time.sleep(settings["first_token_latency"])
+        try:
+            for index, (field, piece) in enumerate(pieces):
+                if disconnect and index >= len(pieces) // 2:
+                    # 直接关闭连接，不发送结束分块，模拟流式输出中途断开
+                    self.server.count("disconnects")
+                    self.close_connection = True
+                    return
+                self._write_event({"delta": {field: piece}, "finish_reason": None}, model)
+                time.sleep(estimate_tokens(piece) / settings["tokens_per_second"])
+            self._write_event({"delta": {}, "finish_reason": "stop"}, model)
+            self._write_chunk(f"data: {json.dumps(self._create_chunk(model, [], usage), ensure_ascii=False)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端提前断开（例如超时重试），不影响服务
+            self.close_connection = True
+
+    def _write_event(self, choice, model):
+        chunk = self._create_chunk(model, [dict(choice, index=0)])
+        self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+
+    @staticmethod
+    def _create_chunk(model, choices, usage=None):
+        return {
+            "id": "mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": choices,
+            "usage": usage
+        }
+
+    def _write_chunk(self, data):
+        payload = data.encode("utf-8")
+        self.wfile.write(f"{len(payload):x}\r\n".encode("ascii") + payload + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_mock_server(settings=None, host="127.0.0.1", port=0):
+    """
+    在后台线程中启动模拟服务，供基准测试和压测使用
+
+    参数:
+        settings: 覆盖 DEFAULT_SETTINGS 的设置
+        host: 监听地址
+        port: 监听端口，为0时自动选择空闲端口
+
+    返回:
+        (服务实例, 服务地址)，地址可直接作为 api.deepseek_base_url，用完后调用 server.shutdown()
+    """
+    server = MockLLMServer((host, port), settings)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def parse_args():
+    """
+    解析命令行参数
+    """
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容对话补全服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址")
+    parser.add_argument("--port", type=int, default=8765, help="监听端口")
+    for key, value in DEFAULT_SETTINGS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    settings = {key: getattr(args, key) for key in DEFAULT_SETTINGS}
+    server = MockLLMServer((args.host, args.port), settings)
+    print(f"🧪 模拟LLM服务已启动: http://{args.host}:{server.server_address[1]}")
+    print(f"   将 api.deepseek_base_url 设置为该地址即可离线运行（密钥可以是任意非空字符串）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("👋 模拟LLM服务已停止")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
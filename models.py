@@ -7,6 +7,10 @@ class AgentConfig:
     name: str
     description: str
     color: str
+    mode: str = "two_pass"
+    output_format: str = "article"
+    depends_on: List[str] = field(default_factory=list)
+    routing: Dict[str, Dict[str, Any]] = field(default_factory=dict)
 
 @dataclass
 class ApiConfig:
@@ -14,6 +18,7 @@ class ApiConfig:
     deepseek_key: str
     deepseek_base_url: str
     model: str
+    routing: Dict[str, Dict[str, Any]] = field(default_factory=dict)
 
 @dataclass
 class Config:
@@ -22,6 +27,8 @@ class Config:
     agents: List[AgentConfig]
     max_rounds: int
     mechanical_words: List[str]
+    round_mode: str = "sequential"
+    max_parallel_agents: int = 4
 
 @dataclass
 class AgentResponse:
@@ -0,0 +1,222 @@
+import os
+import re
+import time
+import string
+import threading
+import contextvars
+from config import PROMPT_CONFIG
+
+# 模板文件中的分节标题，例如 [static]，标题到下一个标题之间为该节的内容
+SECTION_HEADER = re.compile(r"^\[([a-z_]+)\]$", re.MULTILINE)
+
+# 预渲染结果的数量上限，超出后清空重建（机械用语等配置频繁变化时避免无限增长）
+MAX_PRERENDERED = 256
+
+# 当前上下文中尚未计入调用记录的提示词组装耗时（秒），由下一次LLM调用的用量记录取走
+_pending_assembly_seconds = contextvars.ContextVar("prompt_assembly_seconds", default=0.0)
+
+# 进程级模板注册表，按模板目录区分
+_registries = {}
+_lock = threading.Lock()
+
+
+def _format_value(value):
+    """
+    把槽位的值转换为文本，列表和元组（如机械用语）用逗号连接
+    """
+    if isinstance(value, (list, tuple)):
+        return ", ".join(str(item) for item in value)
+    return str(value)
+
+
+def parse_sections(text):
+    """
+    把模板文件解析为 {节名: string.Template}
+
+    每节内容去掉首尾空白，槽位使用 ${name} 语法，字面的 $ 写作 $$
+    """
+    headers = list(SECTION_HEADER.finditer(text))
+    sections = {}
+    for index, header in enumerate(headers):
+        end = headers[index + 1].start() if index + 1 < len(headers) else len(text)
+        sections[header.group(1)] = string.Template(text[header.end():end].strip())
+    return sections
+
+
+def prerender(template, values):
+    """
+    只填入 values 中给出的槽位，其余槽位和 $$ 原样保留，返回仍可继续填充的模板
+    """
+    def replace(match):
+        name = match.group("named") or match.group("braced")
+        if name in values:
+            return _format_value(values[name]).replace("$", "$$")
+        return match.group(0)
+
+    return string.Template(template.pattern.sub(replace, template.template))
+
+
+def take_prompt_assembly_seconds():
+    """
+    取出当前上下文中累计的提示词组装耗时并清零，用于写入下一次调用的用量记录
+    """
+    seconds = _pending_assembly_seconds.get()
+    if seconds:
+        _pending_assembly_seconds.set(0.0)
+    return seconds
+
+
+class PromptRegistry:
+    """
+    提示词模板注册表
+
+    模板以数据文件的形式存放在模板目录中，每个文件只解析一次。渲染分两步：
+    静态槽位（Agent名称、描述、机械用语等随配置变化的内容）按模板版本和静态槽位的值预渲染并缓存，
+    每次调用只填充对话上下文等动态槽位。模板文件修改后（按 reload_interval 检查修改时间）自动重新加载，
+    旧版本的预渲染结果随之失效
+    """
+    def __init__(self, directory, reload_interval=1.0):
+        """
+        参数:
+            directory: 模板目录
+            reload_interval: 检查模板文件是否修改的最小间隔（秒），为0时每次渲染都检查
+        """
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._templates = {}
+        self._prerendered = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            "renders": 0,
+            "prerender_hits": 0,
+            "prerender_misses": 0,
+            "reloads": 0,
+            "assembly_seconds": 0.0
+        }
+
+    def render(self, name, section, static=None, **slots):
+        """
+        渲染模板中的一节
+
+        参数:
+            name: 模板名称，对应模板目录下的 <name>.txt
+            section: 节名
+            static: 静态槽位，按其值缓存预渲染结果，值须可哈希（列表请转换为元组）
+            slots: 动态槽位，每次调用填充
+
+        返回:
+            渲染后的文本
+        """
+        start_time = time.perf_counter()
+        static = static or {}
+        entry = self._get_template(name)
+        key = (name, section, tuple(sorted(static.items())))
+
+        cached = self._prerendered.get(key)
+        if cached is not None and cached[0] == entry["version"]:
+            _, template, text = cached
+            self.stats["prerender_hits"] += 1
+        else:
+            if section not in entry["sections"]:
+                raise KeyError(f"提示词模板 {name} 中没有 [{section}] 节")
+            template = prerender(entry["sections"][section], static)
+            # 没有动态槽位的节直接缓存最终文本
+            text = None if template.get_identifiers() else template.substitute()
+            with self._lock:
+                if len(self._prerendered) >= MAX_PRERENDERED:
+                    self._prerendered.clear()
+                self._prerendered[key] = (entry["version"], template, text)
+            self.stats["prerender_misses"] += 1
+
+        if text is None:
+            try:
+                text = template.substitute({slot: _format_value(value) for slot, value in slots.items()})
+            except KeyError as e:
+                raise KeyError(f"提示词模板 {name} 的 [{section}] 节缺少槽位 {e}") from None
+
+        elapsed = time.perf_counter() - start_time
+        self.stats["renders"] += 1
+        self.stats["assembly_seconds"] += elapsed
+        _pending_assembly_seconds.set(_pending_assembly_seconds.get() + elapsed)
+        return text
+
+    def _get_template(self, name):
+        """
+        获取已解析的模板，首次使用时加载，超过检查间隔时检查文件是否修改
+        """
+        entry = self._templates.get(name)
+        now = time.time()
+        if entry is not None and now - entry["checked"] < self.reload_interval:
+            return entry
+
+        with self._lock:
+            entry = self._templates.get(name)
+            path = os.path.join(self.directory, f"{name}.txt")
+            if entry is None:
+                entry = self._load(path)
+                self._templates[name] = entry
+                return entry
+
+            try:
+                stat = os.stat(path)
+                version = (stat.st_mtime_ns, stat.st_size)
+                if version != entry["version"]:
+                    entry = self._load(path)
+                    self._templates[name] = entry
+                    self.stats["reloads"] += 1
+                    print(f"🔄 提示词模板已重新加载: {name}")
+            except (OSError, UnicodeDecodeError) as e:
+                # 文件正在被编辑器替换或暂时不可读时继续使用已加载的版本
+                print(f"⚠️ 重新加载提示词模板 {name} 失败，继续使用已加载的版本: {str(e)}")
+            entry["checked"] = now
+            return entry
+
+    @staticmethod
+    def _load(path):
+        """
+        读取并解析模板文件，版本为文件的修改时间和大小
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+            stat = os.fstat(f.fileno())
+        return {
+            "version": (stat.st_mtime_ns, stat.st_size),
+            "sections": parse_sections(text),
+            "checked": time.time()
+        }
+
+    def get_stats(self):
+        """
+        获取渲染次数、预渲染缓存命中情况、重新加载次数和累计组装耗时
+        """
+        return dict(self.stats)
+
+
+def get_prompt_config(config):
+    """
+    合并默认提示词模板配置和配置文件中的提示词模板配置
+    """
+    prompt_config = dict(PROMPT_CONFIG)
+    prompt_config.update(config.get("prompts", {}))
+    return prompt_config
+
+
+def get_prompt_registry(config=None):
+    """
+    获取进程内共享的提示词模板注册表
+
+    参数:
+        config: 系统配置，使用其中的 prompts 字段；相对路径的模板目录相对于程序所在目录
+
+    返回:
+        PromptRegistry 实例
+    """
+    prompt_config = get_prompt_config(config or {})
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), prompt_config["directory"])
+
+    with _lock:
+        registry = _registries.get(directory)
+        if registry is None:
+            registry = PromptRegistry(directory, prompt_config["reload_interval"])
+            _registries[directory] = registry
+        return registry
@@ -0,0 +1,215 @@
+import time
+import asyncio
+import threading
+from config import RATE_LIMIT_CONFIG
+from utils import estimate_messages_tokens
+
+# 进程级限流器，按 (base_url, api_key) 区分，同一账号的所有会话共用
+_limiters = {}
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    令牌桶：容量为每分钟的额度，按每秒 capacity / 60 的速度匀速补充
+
+    桶内余额可以暂时为负（实际用量超过预留时），此时后续请求需要等待额度补回
+    """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.available = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        """
+        按经过的时间补充额度，不超过容量
+        """
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """
+        获取 amount 额度还需要等待的秒数，额度足够时为0
+        """
+        # 单次请求超过桶容量时按满桶处理，否则永远无法获取
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate
+
+    def take(self, amount):
+        """
+        扣除额度，调用前需确认 wait_time 为0
+        """
+        self.available -= min(amount, self.capacity)
+
+    def give_back(self, amount):
+        """
+        退还额度，不超过容量
+        """
+        self.available = min(self.capacity, self.available + amount)
+
+
+class RateLimiter:
+    """
+    客户端限流器，同时限制每分钟请求数（RPM）和每分钟token数（TPM）
+
+    发送请求前按估算的token数预留额度，两个桶都有余额时才放行，否则在本地排队等待；
+    收到响应后根据实际用量退还多预留的部分（或补扣不足的部分）
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._lock = threading.Lock()
+        self.stats = {
+            "acquired": 0,
+            "waited": 0,
+            "wait_seconds": 0.0,
+            "refunded_tokens": 0,
+            "charged_tokens": 0
+        }
+
+    def _try_acquire(self, tokens):
+        """
+        尝试一次预留，成功返回0，否则返回建议的等待秒数
+        """
+        with self._lock:
+            self.request_bucket.refill()
+            self.token_bucket.refill()
+            wait = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+            if wait > 0:
+                return wait
+            self.request_bucket.take(1)
+            self.token_bucket.take(tokens)
+            self.stats["acquired"] += 1
+            return 0.0
+
+    def _create_reservation(self, tokens, waited):
+        with self._lock:
+            if waited:
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += waited
+        return {"tokens": tokens, "waited": waited}
+
+    def acquire(self, tokens):
+        """
+        预留一次请求和 tokens 个token的额度，额度不足时阻塞等待
+
+        参数:
+            tokens: 本次请求估算的token数（提示词加预期输出）
+
+        返回:
+            预留记录，请求完成后传给 settle
+        """
+        start_time = None
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                waited = time.monotonic() - start_time if start_time else 0.0
+                return self._create_reservation(tokens, waited)
+            start_time = start_time or time.monotonic()
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        """
+        acquire 的异步版本，等待时不阻塞事件循环
+        """
+        start_time = None
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                waited = time.monotonic() - start_time if start_time else 0.0
+                return self._create_reservation(tokens, waited)
+            start_time = start_time or time.monotonic()
+            await asyncio.sleep(wait)
+
+    def settle(self, reservation, actual_tokens):
+        """
+        根据实际用量结算预留的额度
+
+        参数:
+            reservation: acquire 返回的预留记录
+            actual_tokens: 实际消耗的token数，未知时为None（保留全部预留）
+        """
+        if actual_tokens is None:
+            return
+        difference = reservation["tokens"] - actual_tokens
+        with self._lock:
+            self.token_bucket.refill()
+            if difference > 0:
+                self.token_bucket.give_back(difference)
+                self.stats["refunded_tokens"] += difference
+            elif difference < 0:
+                self.token_bucket.available += difference
+                self.stats["charged_tokens"] -= difference
+
+    def get_stats(self):
+        """
+        获取限流统计信息
+        """
+        with self._lock:
+            self.request_bucket.refill()
+            self.token_bucket.refill()
+            stats = dict(self.stats)
+            stats["available_requests"] = self.request_bucket.available
+            stats["available_tokens"] = self.token_bucket.available
+        return stats
+
+
+def get_rate_limit_config(config):
+    """
+    合并默认限流配置和配置中的限流配置
+    """
+    rate_limit_config = dict(RATE_LIMIT_CONFIG)
+    if config:
+        rate_limit_config.update(config["api"].get("rate_limit", {}))
+    return rate_limit_config
+
+
+def get_rate_limiter(config):
+    """
+    获取进程内共享的限流器，未启用时返回None
+
+    参数:
+        config: 系统配置，使用其中的 api.rate_limit 字段
+
+    返回:
+        RateLimiter 实例或None
+    """
+    rate_limit_config = get_rate_limit_config(config)
+    if not config or not rate_limit_config["enabled"]:
+        return None
+
+    key = (config["api"]["deepseek_base_url"], config["api"]["deepseek_key"])
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = RateLimiter(
+                rate_limit_config["requests_per_minute"],
+                rate_limit_config["tokens_per_minute"]
+            )
+            _limiters[key] = limiter
+            print(
+                f"🚦 已创建限流器: {rate_limit_config['requests_per_minute']} 次请求/分钟，"
+                f"{rate_limit_config['tokens_per_minute']} tokens/分钟"
+            )
+        return limiter
+
+
+def estimate_request_tokens(messages, params, config):
+    """
+    估算一次请求需要预留的token数：提示词估算值加上预期的输出长度
+
+    参数:
+        messages: 消息列表
+        params: 采样参数，设置了 max_tokens 时以它作为预期输出长度
+        config: 系统配置
+
+    返回:
+        预留的token数
+    """
+    prompt_tokens = estimate_messages_tokens(messages)
+    completion_tokens = (params or {}).get("max_tokens") or get_rate_limit_config(config)["expected_completion_tokens"]
+    return prompt_tokens + completion_tokens
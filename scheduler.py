@@ -0,0 +1,165 @@
+import time
+import asyncio
+import contextvars
+import concurrent.futures
+
+
+class DagScheduler:
+    """
+    按依赖关系调度Agent
+
+    每个Agent在其依赖的上游Agent全部完成后立即开始执行，同时执行的数量不超过 max_workers。
+    执行结束后给出每个Agent的就绪、开始、结束时间和本轮的关键路径
+    """
+    def __init__(self, dependencies, max_workers=4):
+        """
+        参数:
+            dependencies: 有序的 {Agent名称: 上游Agent名称列表}，顺序即结果的返回顺序
+            max_workers: 同时执行的Agent数量上限
+        """
+        self.order = list(dependencies)
+        self.dependencies = {name: list(deps) for name, deps in dependencies.items()}
+        self.max_workers = max(1, max_workers)
+        self.topological_order = self._sort()
+
+    def _sort(self):
+        """
+        检查依赖关系并返回拓扑顺序，依赖不存在或存在环时抛出 ValueError
+        """
+        for name, deps in self.dependencies.items():
+            for dep in deps:
+                if dep not in self.dependencies:
+                    raise ValueError(f"Agent {name} 依赖的 {dep} 不存在")
+
+        remaining = {name: set(deps) for name, deps in self.dependencies.items()}
+        topological_order = []
+        while remaining:
+            ready = [name for name in self.order if name in remaining and not remaining[name]]
+            if not ready:
+                raise ValueError(f"Agent依赖关系中存在环: {', '.join(remaining)}")
+            for name in ready:
+                topological_order.append(name)
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return topological_order
+
+    def run(self, execute):
+        """
+        在线程池中执行所有Agent
+
+        参数:
+            execute: execute(name, upstream_results) -> result，upstream_results 按依赖声明的顺序排列
+
+        返回:
+            (按配置顺序排列的结果列表, 调度报告)
+        """
+        results = {}
+        timings = {}
+        start_time = time.time()
+        pending = list(self.topological_order)
+        running = {}
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in [n for n in pending if all(dep in results for dep in self.dependencies[n])]:
+                    pending.remove(name)
+                    timings[name] = {"ready": time.time() - start_time}
+                    upstream = [results[dep] for dep in self.dependencies[name]]
+                    # 每个任务在当前上下文的副本中执行，使用量收集等上下文变量在线程中同样生效
+                    future = executor.submit(
+                        contextvars.copy_context().run,
+                        self._run_timed, execute, name, upstream, timings[name], start_time
+                    )
+                    running[future] = name
+
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+
+        return [results[name] for name in self.order], self._build_report(timings, time.time() - start_time)
+
+    async def run_async(self, execute):
+        """
+        run 的异步版本，execute 为协程函数
+
+        返回:
+            (按配置顺序排列的结果列表, 调度报告)
+        """
+        semaphore = asyncio.Semaphore(self.max_workers)
+        timings = {}
+        tasks = {}
+        start_time = time.time()
+
+        async def run_node(name):
+            upstream = [await tasks[dep] for dep in self.dependencies[name]]
+            timing = timings[name] = {"ready": time.time() - start_time}
+            async with semaphore:
+                timing["start"] = time.time() - start_time
+                result = await execute(name, upstream)
+                timing["end"] = time.time() - start_time
+            return result
+
+        # 按拓扑顺序创建任务，保证每个任务等待的上游任务已经存在
+        for name in self.topological_order:
+            tasks[name] = asyncio.ensure_future(run_node(name))
+        results = await asyncio.gather(*[tasks[name] for name in self.order])
+
+        return list(results), self._build_report(timings, time.time() - start_time)
+
+    @staticmethod
+    def _run_timed(execute, name, upstream, timing, start_time):
+        timing["start"] = time.time() - start_time
+        try:
+            return execute(name, upstream)
+        finally:
+            timing["end"] = time.time() - start_time
+
+    def _build_report(self, timings, total):
+        """
+        生成调度报告
+
+        关键路径从最后结束的Agent开始，沿着结束最晚的上游依赖向前回溯。
+        路径上每个Agent的 queued 为依赖就绪后因 max_workers 限制而排队的时间
+        """
+        nodes = {}
+        for name in self.order:
+            timing = timings[name]
+            deps = self.dependencies[name]
+            nodes[name] = {
+                "ready": timing["ready"],
+                "start": timing["start"],
+                "end": timing["end"],
+                "elapsed": timing["end"] - timing["start"],
+                "queued": timing["start"] - timing["ready"],
+                "blocked_by": max(deps, key=lambda dep: timings[dep]["end"]) if deps else None
+            }
+
+        critical_path = []
+        name = max(nodes, key=lambda n: nodes[n]["end"]) if nodes else None
+        while name:
+            critical_path.append(name)
+            name = nodes[name]["blocked_by"]
+        critical_path.reverse()
+
+        return {
+            "total": total,
+            "max_workers": self.max_workers,
+            "critical_path": critical_path,
+            "critical_path_seconds": nodes[critical_path[-1]]["end"] if critical_path else 0.0,
+            "nodes": nodes
+        }
+
+
+def format_critical_path(report):
+    """
+    将调度报告中的关键路径格式化为一行日志
+    """
+    steps = []
+    for name in report["critical_path"]:
+        node = report["nodes"][name]
+        step = f"{name} {node['elapsed']:.2f}秒"
+        if node["queued"] >= 0.01:
+            step += f"（排队 {node['queued']:.2f}秒）"
+        steps.append(step)
+    return f"关键路径 {report['critical_path_seconds']:.2f}秒: " + " → ".join(steps)
@@ -0,0 +1,459 @@
+import re
+import difflib
+import asyncio
+import inspect
+import threading
+import contextvars
+import concurrent.futures
+from config import SHARDING_CONFIG, resolve_route
+from context_manager import ARTICLE_MARKER, FINAL_RESULT_MARKER, split_sentences, fit_to_tokens
+from llm_client import get_client, get_async_client, chat_completion, async_chat_completion
+from prompt_templates import get_prompt_registry
+
+# 接缝润色输出中分隔前后两段的标记
+SEAM_DIVIDER = "===分界==="
+
+# 接缝润色使用的提示词模板
+SEAM_TEMPLATE = "seam"
+
+# 分片说明中对输出内容的要求，按输出中修改稿部分的标题选择
+SHARD_OUTPUT_NOTES = {
+    ARTICLE_MARKER: "修改后的文章内容只包含这一部分。",
+    FINAL_RESULT_MARKER: "最终润色结果只包含这一部分润色后的文字，不要输出整篇文章。"
+}
+
+
+def get_sharding_config(config):
+    """
+    合并默认分片配置和配置文件中的分片配置
+    """
+    sharding_config = dict(SHARDING_CONFIG)
+    sharding_config.update(config.get("sharding", {}))
+    return sharding_config
+
+
+def create_style_brief(reference_data, max_tokens=300):
+    """
+    从参考资料的风格分析中提取各分片共享的风格要点
+    """
+    style_analysis = (reference_data or {}).get("style_analysis", "")
+    return fit_to_tokens(style_analysis.strip(), max_tokens) if style_analysis else ""
+
+
+def split_into_shards(text, shard_chars):
+    """
+    在段落和句子边界把文章切分为若干分片，每个分片不超过 shard_chars 个字符（单句超长时除外）
+
+    参数:
+        text: 文章
+        shard_chars: 每个分片的目标字符数
+
+    返回:
+        分片列表，每项包含 text 和 separator（拼接时放在该分片之后的分隔符）
+    """
+    separator = "\n\n" if "\n\n" in text else "\n"
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n' if separator == "\n\n" else r'\n', text) if p.strip()]
+
+    # 超长的段落按句子切开，切开的各部分之间不加分隔符
+    pieces = []
+    for paragraph in paragraphs:
+        if len(paragraph) <= shard_chars:
+            pieces.append((paragraph, separator))
+            continue
+        part = ""
+        for sentence in split_sentences(paragraph):
+            if part and len(part) + len(sentence) > shard_chars:
+                pieces.append((part, ""))
+                part = ""
+            part += sentence
+        pieces.append((part, separator))
+
+    shards = []
+    for piece, piece_separator in pieces:
+        if shards and len(shards[-1]["text"]) + len(piece) <= shard_chars:
+            shards[-1]["text"] += shards[-1]["separator"] + piece
+            shards[-1]["separator"] = piece_separator
+        else:
+            shards.append({"text": piece, "separator": piece_separator})
+    return shards
+
+
+def _split_article_sentences(text):
+    """
+    按句子切分文章，句间的空白（包括段落分隔）并入前一句，拼接后可还原原文
+    """
+    sentences = []
+    for piece in re.split(r'(?<=[。！？；!?\n])', text):
+        if piece.strip() or not sentences:
+            sentences.append(piece)
+        else:
+            sentences[-1] += piece
+    return [sentence for sentence in sentences if sentence.strip()]
+
+
+def slice_article(article, shards):
+    """
+    把修改稿按句子与原文对齐，切分为与各分片对应的部分
+
+    分片边界按原文句子和修改稿句子的匹配结果映射到修改稿中；边界落在被改写的区域内时按比例估计，
+    新增的句子归入其后的分片
+
+    参数:
+        article: 修改稿（整篇文章）
+        shards: split_into_shards 切分出的原文分片
+
+    返回:
+        与 shards 一一对应的修改稿片段列表
+    """
+    boundaries = []
+    original = []
+    for shard in shards:
+        boundaries.append(len(original))
+        original.extend(sentence.strip() for sentence in split_sentences(shard["text"]) if sentence.strip())
+    revised = _split_article_sentences(article)
+
+    opcodes = difflib.SequenceMatcher(
+        None, original, [sentence.strip() for sentence in revised], autojunk=False
+    ).get_opcodes()
+
+    def map_boundary(position):
+        for tag, i1, i2, j1, j2 in opcodes:
+            if position <= i1:
+                return j1
+            if position < i2:
+                if tag == "equal":
+                    return j1 + position - i1
+                return j1 + round((position - i1) * (j2 - j1) / (i2 - i1))
+        return len(revised)
+
+    starts = [map_boundary(position) for position in boundaries] + [len(revised)]
+    starts[0] = 0
+    return ["".join(revised[starts[index]:starts[index + 1]]).strip() for index in range(len(shards))]
+
+
+def _take_tail(text, max_chars):
+    """
+    从文本末尾按整句截取不超过 max_chars 个字符，至少保留一句
+    """
+    tail = ""
+    for sentence in reversed(split_sentences(text)):
+        if tail and len(tail) + len(sentence) > max_chars:
+            break
+        tail = sentence + tail
+    return tail
+
+
+def _take_head(text, max_chars):
+    """
+    从文本开头按整句截取不超过 max_chars 个字符，至少保留一句
+    """
+    head = ""
+    for sentence in split_sentences(text):
+        if head and len(head) + len(sentence) > max_chars:
+            break
+        head += sentence
+    return head
+
+
+class _OrderedEmitter:
+    """
+    按分片顺序转发并发产生的流式输出：排在前面的分片完成之前，后面分片的输出先缓存起来
+    """
+    def __init__(self, count):
+        self.buffers = [[] for _ in range(count)]
+        self.done = [False] * count
+        self.current = 0
+
+    def write(self, index, chunk):
+        self.buffers[index].append(chunk)
+        return self._flush()
+
+    def finish(self, index):
+        self.done[index] = True
+        return self._flush()
+
+    def _flush(self):
+        """
+        返回现在可以按顺序输出的内容
+        """
+        ready = ""
+        while self.current < len(self.buffers):
+            ready += "".join(self.buffers[self.current])
+            self.buffers[self.current] = []
+            if not self.done[self.current]:
+                break
+            self.current += 1
+        return ready
+
+
+class ShardedPolisher:
+    """
+    分片并行润色长文章
+
+    文章按段落分组为多个分片，每个分片带上共享的风格要点和相邻分片的首尾作为衔接参考，
+    并发调用Agent润色；各分片的修改稿按原顺序拼接后，对每个拼接处做一次小范围的接缝润色。
+    单次调用的输出长度与分片大小成正比，不会因为整篇文章过长而被截断
+    """
+    def __init__(self, config):
+        self.config = config
+        self.settings = get_sharding_config(config)
+        self.prompts = get_prompt_registry(config)
+
+    def should_shard(self, text):
+        """
+        判断文章是否需要分片润色
+        """
+        return self.settings["enabled"] and len(text) >= self.settings["min_chars"]
+
+    def polish(self, generate, text, context, style_brief="", callback=None, marker=ARTICLE_MARKER, article=None):
+        """
+        分片并行润色
+
+        参数:
+            generate: generate(shard_text, shard_context, shard_callback) -> 该分片的完整输出
+            text: 整篇文章
+            context: 对话上下文
+            style_brief: 全文共享的风格要点
+            callback: 流式回调 callback(chunk)，各分片的输出按顺序转发
+            marker: Agent输出中修改后文章部分的标题
+            article: 上下文中的最新修改稿，不放在 context 中，而是按分片对齐后每个分片只附上对应的部分，
+                避免每个分片的提示词都包含整篇文章
+
+        返回:
+            与单次调用格式相同的输出：合并的润色建议加上拼接后的完整文章
+        """
+        shards = split_into_shards(text, self.settings["shard_chars"])
+        print(f"🧩 文章共 {len(text)} 字符，分为 {len(shards)} 个分片并行润色")
+        article_slices = slice_article(article, shards) if article else [None] * len(shards)
+        emitter = _OrderedEmitter(len(shards))
+        lock = threading.Lock()
+
+        def emit(ready):
+            if ready and callback:
+                callback(ready)
+
+        def run_shard(index):
+            def shard_callback(chunk):
+                with lock:
+                    emit(emitter.write(index, chunk))
+
+            with lock:
+                emit(emitter.write(index, self._create_shard_heading(index, len(shards))))
+            try:
+                return generate(
+                    shards[index]["text"],
+                    self._create_shard_context(context, shards, index, style_brief, article_slices[index], marker),
+                    shard_callback if callback else None
+                )
+            finally:
+                with lock:
+                    emit(emitter.finish(index))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.settings["max_workers"]) as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, run_shard, index)
+                for index in range(len(shards))
+            ]
+            outputs = [future.result() for future in futures]
+
+        suggestions, articles = self._split_outputs(outputs, shards, marker)
+        if self.settings["smooth_seams"] and len(articles) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.settings["max_workers"]) as executor:
+                futures = [
+                    executor.submit(contextvars.copy_context().run, self._smooth_seam, articles, index)
+                    for index in range(len(articles) - 1)
+                ]
+                seams = [future.result() for future in futures]
+            articles = self._apply_seams(articles, seams)
+        return self._assemble(suggestions, articles, shards, marker)
+
+    async def polish_async(self, generate, text, context, style_brief="", callback=None, marker=ARTICLE_MARKER,
+                           article=None):
+        """
+        polish 的异步版本，generate 和 callback 可以是协程函数
+        """
+        shards = split_into_shards(text, self.settings["shard_chars"])
+        print(f"🧩 文章共 {len(text)} 字符，分为 {len(shards)} 个分片并行润色（异步）")
+        article_slices = slice_article(article, shards) if article else [None] * len(shards)
+        emitter = _OrderedEmitter(len(shards))
+        semaphore = asyncio.Semaphore(self.settings["max_workers"])
+
+        async def emit(ready):
+            if ready and callback:
+                result = callback(ready)
+                if inspect.isawaitable(result):
+                    await result
+
+        async def run_shard(index):
+            async def shard_callback(chunk):
+                await emit(emitter.write(index, chunk))
+
+            async with semaphore:
+                await emit(emitter.write(index, self._create_shard_heading(index, len(shards))))
+                try:
+                    return await generate(
+                        shards[index]["text"],
+                        self._create_shard_context(context, shards, index, style_brief, article_slices[index], marker),
+                        shard_callback if callback else None
+                    )
+                finally:
+                    await emit(emitter.finish(index))
+
+        outputs = await asyncio.gather(*[run_shard(index) for index in range(len(shards))])
+
+        suggestions, articles = self._split_outputs(outputs, shards, marker)
+        if self.settings["smooth_seams"] and len(articles) > 1:
+            seams = await asyncio.gather(*[
+                self._smooth_seam_async(articles, index) for index in range(len(articles) - 1)
+            ])
+            articles = self._apply_seams(articles, seams)
+        return self._assemble(suggestions, articles, shards, marker)
+
+    @staticmethod
+    def _create_shard_heading(index, count):
+        return f"\n【第 {index + 1}/{count} 部分】\n"
+
+    def _create_shard_context(self, context, shards, index, style_brief, article_slice=None, marker=ARTICLE_MARKER):
+        """
+        在对话上下文后附加分片说明：所处位置、全文风格要点、相邻分片的首尾，以及最新修改稿中对应这一部分的内容
+        """
+        overlap = self.settings["overlap_chars"]
+        note = (
+            f"\n分段润色说明：这篇文章较长，已按段落分为 {len(shards)} 部分并行润色，"
+            f"你只负责第 {index + 1} 部分，即本次提供的文章内容。请保持与全文一致的风格，"
+            f"{SHARD_OUTPUT_NOTES.get(marker, SHARD_OUTPUT_NOTES[ARTICLE_MARKER])}\n"
+        )
+        if style_brief:
+            note += f"全文风格要点：{style_brief}\n"
+        if index > 0:
+            note += f"前文结尾（仅供衔接参考，不要修改或输出）：{_take_tail(shards[index - 1]['text'], overlap)}\n"
+        if index < len(shards) - 1:
+            note += f"后文开头（仅供衔接参考，不要修改或输出）：{_take_head(shards[index + 1]['text'], overlap)}\n"
+        if article_slice:
+            note += f"最新修改稿中对应这一部分的内容：\n{article_slice}\n"
+        return context + note
+
+    @staticmethod
+    def _split_outputs(outputs, shards, marker):
+        """
+        拆分各分片的输出，缺少修改稿的分片保留原文
+        """
+        suggestions = []
+        articles = []
+        for output, shard in zip(outputs, shards):
+            if marker in output:
+                suggestion, article = output.split(marker, 1)
+                article = article.strip() or shard["text"]
+            else:
+                suggestion, article = output, shard["text"]
+            suggestions.append(suggestion.strip())
+            articles.append(article)
+        return suggestions, articles
+
+    def _create_seam_messages(self, left, right):
+        """
+        构建接缝润色的请求消息
+        """
+        static = {"divider": SEAM_DIVIDER}
+        return [
+            {"role": "system", "content": self.prompts.render(SEAM_TEMPLATE, "system", static=static)},
+            {"role": "user", "content": self.prompts.render(SEAM_TEMPLATE, "request", static=static, left=left, right=right)}
+        ]
+
+    def _get_seam_window(self, articles, index):
+        """
+        获取第 index 个拼接处两侧的文字，窗口不超过所在分片的三分之一，避免相邻的接缝重叠
+        """
+        window = self.settings["seam_window"]
+        left = _take_tail(articles[index], min(window, len(articles[index]) // 3))
+        right = _take_head(articles[index + 1], min(window, len(articles[index + 1]) // 3))
+        return left, right
+
+    def _get_seam_route(self):
+        """
+        接缝润色使用的模型和采样参数，设置了 seam_model 时优先使用它
+        """
+        model, params = resolve_route(self.config, "seam")
+        return self.settings["seam_model"] or model, params
+
+    def _smooth_seam(self, articles, index):
+        left, right = self._get_seam_window(articles, index)
+        model, params = self._get_seam_route()
+        try:
+            output = chat_completion(
+                get_client(self.config),
+                model,
+                self._create_seam_messages(left, right),
+                params=params,
+                config=self.config
+            )
+        except Exception as e:
+            print(f"⚠️ 第 {index + 1} 个拼接处润色失败，保留原文: {str(e)}")
+            return None
+        return self._parse_seam(output, left, right)
+
+    async def _smooth_seam_async(self, articles, index):
+        left, right = self._get_seam_window(articles, index)
+        model, params = self._get_seam_route()
+        try:
+            output = await async_chat_completion(
+                get_async_client(self.config),
+                model,
+                self._create_seam_messages(left, right),
+                params=params,
+                config=self.config
+            )
+        except Exception as e:
+            print(f"⚠️ 第 {index + 1} 个拼接处润色失败，保留原文: {str(e)}")
+            return None
+        return self._parse_seam(output, left, right)
+
+    @staticmethod
+    def _parse_seam(output, left, right):
+        """
+        解析接缝润色的输出，格式不对或改动过大时返回None（保留原文）
+        """
+        if not output or SEAM_DIVIDER not in output:
+            return None
+        new_left, new_right = (part.strip() for part in output.split(SEAM_DIVIDER, 1))
+        original_length = len(left) + len(right)
+        if not new_left or not new_right or not 0.5 <= (len(new_left) + len(new_right)) / original_length <= 1.5:
+            return None
+        return left, right, new_left, new_right
+
+    @staticmethod
+    def _apply_seams(articles, seams):
+        """
+        用接缝润色的结果替换各拼接处两侧的文字
+        """
+        articles = list(articles)
+        for index, seam in enumerate(seams):
+            if seam is None:
+                continue
+            left, right, new_left, new_right = seam
+            if articles[index].endswith(left) and articles[index + 1].startswith(right):
+                articles[index] = articles[index][:len(articles[index]) - len(left)] + new_left
+                articles[index + 1] = new_right + articles[index + 1][len(right):]
+        return articles
+
+    @staticmethod
+    def _assemble(suggestions, articles, shards, marker):
+        """
+        把各分片的润色建议和修改稿组装为与单次调用相同格式的输出
+        """
+        heading = ""
+        bodies = []
+        for index, suggestion in enumerate(suggestions):
+            lines = suggestion.split("\n", 1)
+            if lines[0].startswith("#"):
+                heading = heading or lines[0]
+                suggestion = lines[1].strip() if len(lines) > 1 else ""
+            bodies.append(f"【第 {index + 1} 部分】\n{suggestion}")
+
+        article = ""
+        for index, (text, shard) in enumerate(zip(articles, shards)):
+            article += text + (shard["separator"] if index < len(shards) - 1 else "")
+
+        output = f"{heading}\n\n" if heading else ""
+        return output + "\n\n".join(bodies) + f"\n\n{marker}\n\n{article}"
+
@@ -0,0 +1,49 @@
+import copy
+import pytest
+import config
+from config import load_config
+from conversation import Conversation
+from mock_server import start_mock_server, FILLER_TEXT
+
+SHORT_TEXT = "春天来了。花开了，鸟儿在枝头歌唱。\n\n我们走在河边，心情很好。"
+LONG_TEXT = "\n\n".join(f"这是第{i}段。河水静静流淌，岸边的柳树随风摇曳。" * 3 for i in range(8))
+
+
+@pytest.fixture
+def mock_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "CONFIG_FILE", str(tmp_path / "agent_config.json"))
+    server, url = start_mock_server({"first_token_latency": 0.0, "tokens_per_second": 100000})
+    test_config = copy.deepcopy(load_config())
+    test_config["api"].update(deepseek_key="test-key", deepseek_base_url=url)
+    test_config["api"]["rate_limit"] = dict(test_config["api"]["rate_limit"], enabled=False)
+    test_config["cache"]["enabled"] = False
+    test_config["tracing"]["enabled"] = False
+    test_config["memory"].update(mode="ring", max_entries=8, max_tokens=100000)
+    test_config["sharding"].update(min_chars=len(SHORT_TEXT) + 1, shard_chars=120, smooth_seams=False)
+    yield test_config
+    server.shutdown()
+
+
+@pytest.mark.parametrize("mode", ["two_pass", "single_pass"])
+def test_memory_records_suggestions_with_and_without_sharding(mock_config, mode):
+    for agent_config in mock_config["agents"]:
+        agent_config["mode"] = mode
+    reference_data = {"content": "", "style_analysis": "", "ref_type": "self"}
+
+    entries = {}
+    for text in (SHORT_TEXT, LONG_TEXT):
+        conversation = Conversation(mock_config)
+        assert conversation.sharded_polisher.should_shard(text) == (text is LONG_TEXT)
+        conversation.start_conversation(text, reference_data, 1)
+        entries[text is LONG_TEXT] = {agent.name: list(agent.memory._entries) for agent in conversation.agents}
+
+    for sharded, agent_entries in entries.items():
+        for name, recorded in agent_entries.items():
+            # 每个Agent每轮只有一条记录，内容是输出中的润色建议，而不是思考过程或修改稿
+            assert len(recorded) == 1, (sharded, name)
+            content = recorded[0]["content"]
+            assert content.startswith("#") and "润色建议" in content.split("\n", 1)[0]
+            assert FILLER_TEXT[:10] in content
+            assert "模拟分析" not in content
+            assert "河水静静流淌" not in content and "花开了" not in content
@@ -0,0 +1,75 @@
+import json
+import config
+from config import load_config
+from conversation import Conversation
+
+EXPERTS = ["文学专家", "语言优化师", "结构分析师", "风格塑造师"]
+
+# 旧版本的配置文件：Agent只有名称、说明和颜色，没有 depends_on、mode 等字段
+BASELINE_CONFIG = {
+    "api": {
+        "deepseek_key": "test-key",
+        "deepseek_base_url": "https://api.deepseek.com",
+        "model": "deepseek-chat",
+        "models": {"DeepSeek-V3": "deepseek-chat", "DeepSeek-R1": "deepseek-reasoner"}
+    },
+    "agents": [
+        {"name": "文学专家", "description": "文学性", "color": "blue"},
+        {"name": "语言优化师", "description": "语言", "color": "green"},
+        {"name": "结构分析师", "description": "结构", "color": "orange"},
+        {"name": "风格塑造师", "description": "风格", "color": "purple"},
+        {"name": "综合评审员", "description": "整合", "color": "red"}
+    ],
+    "max_rounds": 3,
+    "round_mode": "dag"
+}
+
+
+def load_baseline_config(tmp_path, monkeypatch, agents=None):
+    path = tmp_path / "agent_config.json"
+    data = dict(BASELINE_CONFIG, agents=agents or BASELINE_CONFIG["agents"])
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(config, "CONFIG_FILE", str(path))
+    return load_config()
+
+
+def test_baseline_config_backfills_agent_fields(tmp_path, monkeypatch):
+    loaded = load_baseline_config(tmp_path, monkeypatch)
+    agents = {agent["name"]: agent for agent in loaded["agents"]}
+
+    assert agents["综合评审员"]["depends_on"] == EXPERTS
+    for name in EXPERTS:
+        assert agents[name]["depends_on"] == []
+    for agent in loaded["agents"]:
+        assert agent["mode"] == config.DEFAULT_AGENT_MODE
+        assert agent["output_format"] == config.DEFAULT_OUTPUT_FORMAT
+        assert agent["routing"] == {}
+
+    # 补全后的配置写回文件，再次加载时不需要修改
+    saved = json.loads((tmp_path / "agent_config.json").read_text(encoding="utf-8"))
+    assert not config.ensure_config_complete(saved)
+
+
+def test_baseline_config_in_dag_mode_runs_reviewer_after_experts(tmp_path, monkeypatch):
+    conversation = Conversation(load_baseline_config(tmp_path, monkeypatch))
+    finished = []
+
+    def execute(name, upstream_results):
+        if name == "综合评审员":
+            assert sorted(finished) == sorted(EXPERTS)
+            assert upstream_results == EXPERTS
+        finished.append(name)
+        return name
+
+    results, _ = conversation.scheduler.run(execute)
+    assert results == EXPERTS + ["综合评审员"]
+
+
+def test_backfilled_dependencies_skip_missing_agents(tmp_path, monkeypatch):
+    agents = [agent for agent in BASELINE_CONFIG["agents"] if agent["name"] != "风格塑造师"]
+    loaded = load_baseline_config(tmp_path, monkeypatch, agents)
+    reviewer = next(agent for agent in loaded["agents"] if agent["name"] == "综合评审员")
+
+    assert reviewer["depends_on"] == ["文学专家", "语言优化师", "结构分析师"]
+    Conversation(loaded)
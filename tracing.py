@@ -0,0 +1,404 @@
+import os
+import json
+import time
+import atexit
+import secrets
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from config import TRACING_CONFIG
+
+# 当前上下文中正在进行的 span，线程池和异步任务复制上下文后子 span 自动挂到其下
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+# span 的类型，与 OTLP 的 SpanKind 对应
+SPAN_KIND_INTERNAL = "internal"
+SPAN_KIND_CLIENT = "client"
+OTLP_SPAN_KINDS = {SPAN_KIND_INTERNAL: 1, SPAN_KIND_CLIENT: 3}
+
+# 进程级追踪器，按追踪配置区分
+_tracers = {}
+_lock = threading.Lock()
+
+
+def get_tracing_config(config):
+    """
+    合并默认调用追踪配置和配置文件中的调用追踪配置
+    """
+    tracing_config = dict(TRACING_CONFIG)
+    tracing_config.update(config.get("tracing", {}))
+    return tracing_config
+
+
+class Span:
+    """
+    一段被追踪的操作（任务、轮次、Agent阶段或一次LLM调用）
+
+    属性在操作进行中和结束前都可以补充，结束时交给追踪器导出
+    """
+    recording = True
+
+    def __init__(self, tracer, name, parent=None, kind=SPAN_KIND_INTERNAL, attributes=None):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.start_time = time.time()
+        self.end_time = None
+        self.status = "ok"
+        self.error = None
+        self.attributes = dict(attributes or {})
+
+    def set_attributes(self, **attributes):
+        """
+        设置属性，值为None的属性忽略
+        """
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+
+    def record_error(self, error):
+        """
+        把 span 标记为失败
+        """
+        self.status = "error"
+        self.error = str(error) or type(error).__name__
+
+    def end(self, status=None):
+        """
+        结束 span 并导出，重复调用时只有第一次生效
+
+        参数:
+            status: 覆盖结束状态（例如未完成就被新任务取代的任务记为 "abandoned"）
+        """
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if status:
+            self.status = status
+        self.tracer.export(self)
+
+    @property
+    def duration(self):
+        """
+        持续时间（秒），尚未结束时为到目前为止的时间
+        """
+        return (self.end_time or time.time()) - self.start_time
+
+    def to_dict(self):
+        """
+        转换为 JSONL 导出使用的字典
+        """
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start_time,
+            "end": self.end_time,
+            "duration": self.duration,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+
+class _NoopSpan:
+    """
+    未启用调用追踪时使用的 span，所有操作均为空操作
+    """
+    recording = False
+    trace_id = None
+    span_id = None
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self, status=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonlSpanExporter:
+    """
+    把 span 逐行写入 JSONL 文件，文件超过 max_bytes 时轮转为 <path>.1 ... <path>.<backup_count>
+    """
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        # 相对路径在创建时确定，之后切换工作目录（例如基准测试）不影响写入位置
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self.max_bytes and os.path.exists(self.path) and os.path.getsize(self.path) + len(line) > self.max_bytes:
+                self._rotate()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+    def _rotate(self):
+        """
+        轮转日志文件，超出 backup_count 的最旧文件被删除
+        """
+        if self.backup_count <= 0:
+            os.remove(self.path)
+            return
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def flush(self):
+        pass
+
+
+def _to_otlp_value(value):
+    """
+    把属性值转换为 OTLP/JSON 的 AnyValue
+    """
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp_span(span):
+    """
+    把 span 转换为 OTLP/JSON 格式（opentelemetry-proto 的 Span 消息）
+    """
+    otlp_span = {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": OTLP_SPAN_KINDS.get(span.kind, 1),
+        "startTimeUnixNano": str(int(span.start_time * 1e9)),
+        "endTimeUnixNano": str(int(span.end_time * 1e9)),
+        "attributes": [{"key": key, "value": _to_otlp_value(value)} for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1}
+    }
+    if span.parent_id:
+        otlp_span["parentSpanId"] = span.parent_id
+    if span.status not in ("ok", "error"):
+        otlp_span["attributes"].append({"key": "status", "value": {"stringValue": span.status}})
+    return otlp_span
+
+
+class OtlpSpanExporter:
+    """
+    按 OTLP/HTTP JSON 协议把 span 批量发送到 OpenTelemetry Collector 等兼容的接收端
+
+    span 先放入缓冲区，由后台线程每 flush_interval 秒或攒够 batch_size 个时发送；
+    发送失败时丢弃该批并打印一次警告，不影响润色流程
+    """
+    def __init__(self, endpoint, service_name="literasage", headers=None, batch_size=64, flush_interval=2.0,
+                 timeout=5.0, max_queue=2048):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.headers = dict(headers or {})
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.dropped = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._failing = False
+        self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        with self._lock:
+            if len(self._buffer) >= self.max_queue:
+                self.dropped += 1
+                return
+            self._buffer.append(to_otlp_span(span))
+            if len(self._buffer) >= self.batch_size:
+                self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """
+        立即发送缓冲区中的所有 span
+        """
+        with self._send_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+            for start in range(0, len(batch), self.batch_size):
+                self._send(batch[start:start + self.batch_size])
+
+    def _send(self, spans):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "literasage.tracing"}, "spans": spans}]
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+            headers={"Content-Type": "application/json", **self.headers},
+            method="POST"
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+            if self._failing:
+                print(f"✅ 调用追踪已恢复发送到 {self.endpoint}")
+            self._failing = False
+        except Exception as e:
+            self.dropped += len(spans)
+            if not self._failing:
+                print(f"⚠️ 发送调用追踪到 {self.endpoint} 失败，已丢弃 {len(spans)} 个span: {str(e)}")
+            self._failing = True
+
+
+class Tracer:
+    """
+    创建 span 并把结束的 span 交给各个导出器
+    """
+    def __init__(self, exporters):
+        self.exporters = exporters
+
+    def export(self, span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                print(f"⚠️ 导出调用追踪失败: {str(e)}")
+
+    def flush(self):
+        for exporter in self.exporters:
+            exporter.flush()
+
+
+def _create_exporters(tracing_config):
+    """
+    根据配置创建导出器
+    """
+    exporters = []
+    for name in tracing_config["exporters"]:
+        if name == "jsonl":
+            exporters.append(JsonlSpanExporter(
+                tracing_config["path"], tracing_config["max_bytes"], tracing_config["backup_count"]
+            ))
+        elif name == "otlp":
+            exporters.append(OtlpSpanExporter(
+                tracing_config["otlp_endpoint"],
+                tracing_config["service_name"],
+                tracing_config["otlp_headers"],
+                tracing_config["batch_size"],
+                tracing_config["flush_interval"]
+            ))
+        else:
+            print(f"⚠️ 未知的调用追踪导出器: {name}")
+    return exporters
+
+
+def get_tracer(config):
+    """
+    获取进程内共享的追踪器，未启用调用追踪时返回None
+
+    参数:
+        config: 系统配置，使用其中的 tracing 字段
+    """
+    if not config:
+        return None
+    tracing_config = get_tracing_config(config)
+    if not tracing_config["enabled"] or not tracing_config["exporters"]:
+        return None
+
+    key = json.dumps(tracing_config, sort_keys=True, default=str)
+    with _lock:
+        tracer = _tracers.get(key)
+        if tracer is None:
+            tracer = Tracer(_create_exporters(tracing_config))
+            _tracers[key] = tracer
+        return tracer
+
+
+def current_span():
+    """
+    获取当前上下文中正在进行的 span，没有时返回空操作的 span
+    """
+    return _current_span.get() or NOOP_SPAN
+
+
+def begin_span(config, name, parent=None, kind=SPAN_KIND_INTERNAL, **attributes):
+    """
+    开始一个不绑定到当前上下文的 span，用于跨越多次调用的操作（例如一次润色任务），由调用方负责 end()
+
+    参数:
+        config: 系统配置，没有父 span 时据此决定是否追踪
+        name: span 名称
+        parent: 父 span，默认为当前上下文中的 span
+        kind: span 类型
+        attributes: 初始属性
+
+    返回:
+        Span，未启用调用追踪时为空操作的 span
+    """
+    parent = parent if parent is not None else _current_span.get()
+    if parent is not None and not parent.recording:
+        parent = None
+    tracer = parent.tracer if parent is not None else get_tracer(config)
+    if tracer is None:
+        return NOOP_SPAN
+    return Span(tracer, name, parent, kind, {key: value for key, value in attributes.items() if value is not None})
+
+
+@contextmanager
+def start_span(config, name, parent=None, kind=SPAN_KIND_INTERNAL, **attributes):
+    """
+    在 with 代码块内追踪一段操作，代码块内开始的 span 和LLM调用都挂在它下面；
+    代码块抛出异常时 span 标记为失败，异常照常抛出
+
+    参数与 begin_span 相同
+    """
+    span = begin_span(config, name, parent, kind, **attributes)
+    if not span.recording:
+        yield span
+        return
+
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+
+def flush_tracers():
+    """
+    发送所有追踪器中缓冲的 span，进程退出时自动调用
+    """
+    with _lock:
+        tracers = list(_tracers.values())
+    for tracer in tracers:
+        tracer.flush()
+
+
+atexit.register(flush_tracers)
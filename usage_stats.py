@@ -0,0 +1,159 @@
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# 当前上下文中正在收集用量记录的列表（可嵌套，例如一次任务中的某一轮）
+_active_collectors = contextvars.ContextVar("usage_collectors", default=())
+
+# 当前上下文中发起调用的Agent名称，写入用量记录的 agent 字段
+_current_agent = contextvars.ContextVar("usage_agent", default=None)
+
+# 进程级累计用量
+_totals = {
+    "calls": 0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0,
+    "reasoning_tokens": 0,
+    "cache_hit_tokens": 0,
+    "cache_miss_tokens": 0
+}
+_lock = threading.Lock()
+
+
+def extract_usage(usage):
+    """
+    从API返回的usage对象中提取token用量
+
+    DeepSeek在usage中额外返回 prompt_cache_hit_tokens 和 prompt_cache_miss_tokens，
+    其他兼容服务没有这两个字段时按全部未命中处理
+
+    参数:
+        usage: 响应中的usage对象，可以为None
+
+    返回:
+        用量字典
+    """
+    if usage is None:
+        return {
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "reasoning_tokens": 0,
+            "cache_hit_tokens": 0,
+            "cache_miss_tokens": 0
+        }
+
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    hit_tokens = getattr(usage, "prompt_cache_hit_tokens", 0) or 0
+    miss_tokens = getattr(usage, "prompt_cache_miss_tokens", None)
+    if miss_tokens is None:
+        miss_tokens = prompt_tokens - hit_tokens
+
+    # 推理模型的推理过程计入 completion_tokens，其中的推理部分在 completion_tokens_details 中单独给出
+    details = getattr(usage, "completion_tokens_details", None)
+
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        "reasoning_tokens": getattr(details, "reasoning_tokens", 0) or 0,
+        "cache_hit_tokens": hit_tokens,
+        "cache_miss_tokens": miss_tokens
+    }
+
+
+def record_usage(record):
+    """
+    记录一次LLM调用的用量，同时写入进程累计值和当前上下文中所有的收集器
+
+    参数:
+        record: 用量记录，包含 model、prompt_tokens、completion_tokens、
+                cache_hit_tokens、cache_miss_tokens、elapsed 等字段
+    """
+    record.setdefault("agent", _current_agent.get())
+    with _lock:
+        _totals["calls"] += 1
+        for key in ("prompt_tokens", "completion_tokens", "reasoning_tokens", "cache_hit_tokens", "cache_miss_tokens"):
+            _totals[key] += record.get(key, 0)
+
+    for collector in _active_collectors.get():
+        collector.append(record)
+
+
+@contextmanager
+def collect_usage():
+    """
+    在 with 代码块内收集当前上下文发起的所有LLM调用的用量记录
+
+    用法:
+        with collect_usage() as records:
+            ...
+        summary = summarize_usage(records)
+    """
+    records = []
+    token = _active_collectors.set(_active_collectors.get() + (records,))
+    try:
+        yield records
+    finally:
+        _active_collectors.reset(token)
+
+
+def current_agent():
+    """
+    获取当前上下文中调用所属的Agent名称，不在 attribute_usage 中时为None
+    """
+    return _current_agent.get()
+
+
+@contextmanager
+def attribute_usage(agent_name):
+    """
+    在 with 代码块内发起的LLM调用的用量记录中标注Agent名称，
+    线程池和异步任务复制上下文后同样生效
+    """
+    token = _current_agent.set(agent_name)
+    try:
+        yield
+    finally:
+        _current_agent.reset(token)
+
+
+def summarize_usage(records, prefill_tokens_per_second=None):
+    """
+    汇总一组用量记录，计算提示词缓存命中率和预计节省的时间
+
+    参数:
+        records: 用量记录列表
+        prefill_tokens_per_second: 服务端处理未命中提示词的速度，用于估算缓存节省的时间
+
+    返回:
+        汇总字典
+    """
+    summary = {
+        "calls": len(records),
+        "prompt_tokens": sum(r.get("prompt_tokens", 0) for r in records),
+        "completion_tokens": sum(r.get("completion_tokens", 0) for r in records),
+        "cache_hit_tokens": sum(r.get("cache_hit_tokens", 0) for r in records),
+        "cache_miss_tokens": sum(r.get("cache_miss_tokens", 0) for r in records),
+        "reasoning_tokens": sum(r.get("reasoning_tokens", 0) for r in records),
+        "reasoning_seconds": sum(r.get("reasoning_seconds") or 0 for r in records),
+        "elapsed": sum(r.get("elapsed", 0) for r in records),
+        "prompt_assembly_seconds": sum(r.get("prompt_assembly_seconds", 0) for r in records),
+        "retries": sum(r.get("retries", 0) for r in records)
+    }
+
+    cached_prompt_tokens = summary["cache_hit_tokens"] + summary["cache_miss_tokens"]
+    summary["cache_hit_rate"] = summary["cache_hit_tokens"] / cached_prompt_tokens if cached_prompt_tokens else 0.0
+
+    if prefill_tokens_per_second:
+        summary["estimated_saved_seconds"] = summary["cache_hit_tokens"] / prefill_tokens_per_second
+    else:
+        summary["estimated_saved_seconds"] = 0.0
+
+    return summary
+
+
+def get_total_usage():
+    """
+    获取进程启动以来的累计用量
+    """
+    with _lock:
+        return dict(_totals)
@@ -87,6 +87,134 @@ def count_words(text: str) -> int:
     text = re.sub(r'\s+', '', text)
     return len(text)
 
+# 每条消息的角色标记等固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数量，不依赖分词器
+    
+    按DeepSeek官方的换算关系：1个中文字符约0.6个token，1个英文字母或数字约0.3个token。
+    空白不单独计数，但连续的缩进和换行约合1个token（提示词中的多行缩进很多，按字符计会明显高估）；
+    ASCII标点约0.5个token，其他字符（表情符号、生僻符号等）约1个token
+    
+    参数:
+        text: 要估算的文本
+        
+    返回:
+        估算的token数量
+    """
+    if not text:
+        return 0
+    cjk_count = len(re.findall(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]', text))
+    word_count = len(re.findall(r'[A-Za-z0-9]', text))
+    punctuation_count = len(re.findall(r'[!-/:-@\[-`{-~]', text))
+    whitespace_count = len(re.findall(r'\s', text))
+    whitespace_runs = len(re.findall(r'\s{2,}', text))
+    other_count = len(text) - cjk_count - word_count - punctuation_count - whitespace_count
+    return int(cjk_count * 0.6 + word_count * 0.3 + punctuation_count * 0.5 + whitespace_runs + other_count) + 1
+
+def estimate_messages_tokens(messages: List[Dict[str, Any]]) -> int:
+    """
+    估算一组对话消息的提示词token数量，包括每条消息的固定开销
+    
+    参数:
+        messages: 消息列表
+        
+    返回:
+        估算的token数量
+    """
+    return sum(estimate_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """
+    计算一组数值的百分位数，在相邻两个值之间线性插值
+    
+    参数:
+        values: 数值列表（无需排序）
+        p: 百分位，0到100之间
+        
+    返回:
+        百分位数，列表为空时返回None
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def render_progress_bar(percentage: int) -> str:
+    """
+    生成进度条HTML
+    
+    参数:
+        percentage: 进度百分比 (0-100)
+        
+    返回:
+        HTML字符串
+    """
+    return f'<div style="width: 100%; height: 30px; background-color: #f3f3f3; border-radius: 5px; overflow: hidden; margin: 10px 0;">' \
+           f'<div id="progress-bar" style="width: {percentage}%; height: 100%; background-color: #4CAF50; text-align: center; line-height: 30px; color: white;">{percentage}%</div>' \
+           f'</div>'
+
+def render_agent_progress_html(agent_responses: Dict[str, Dict[str, Any]], processing_agents: List[str]) -> str:
+    """
+    生成实时的Agent进度HTML，流式输出时每收到一段内容都会重新生成
+    
+    参数:
+        agent_responses: {Agent名称: {"color", "content", "reasoning", "completed", "error"}}
+        processing_agents: 尚未完成的Agent名称列表
+        
+    返回:
+        HTML字符串
+    """
+    parts = ["<h3>当前润色进度</h3>"]
+    
+    # 添加已响应的Agent
+    for agent_name, data in agent_responses.items():
+        color = data["color"]
+        content = data["content"]
+        completed = data["completed"]
+        
+        # 生成状态指示器
+        status_indicator = "" if completed else '<div class="loading-spinner"></div>'
+        
+        # 错误样式
+        extra_class = " error-bg" if data["error"] else ""
+        
+        # 推理过程折叠显示，正文开始输出前保持展开，便于看到推理进展
+        reasoning_html = ""
+        if data.get("reasoning"):
+            open_attr = "" if content or completed else " open"
+            reasoning_html = f"""
+                    <details class="agent-reasoning"{open_attr}>
+                        <summary>推理过程（{len(data["reasoning"])} 字符）</summary>
+                        {data["reasoning"]}
+                    </details>
+                    """
+        
+        parts.append(f"""
+                <div class="agent-response {color}-bg{extra_class}">
+                    <div class="agent-name">{agent_name} {status_indicator}</div>
+                    {reasoning_html}
+                    <div>{content}</div>
+                </div>
+                """)
+    
+    # 添加等待中的Agent
+    for agent_name in processing_agents:
+        if agent_name not in agent_responses:
+            parts.append(f"""
+                    <div class="agent-response" style="background-color: #f8f9fa; border-left: 5px solid #6c757d;">
+                        <div class="agent-name">{agent_name} <div class="loading-spinner"></div></div>
+                        <div>正在生成响应...</div>
+                    </div>
+                    """)
+    
+    return "".join(parts)
+
 def truncate_text(text: str, max_length: int = 100) -> str:
     """
     截断文本